@@ -0,0 +1,67 @@
+import argparse
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+
+from color import Color  # noqa: E402
+from geometry import Box, Sphere  # noqa: E402
+from material import Material  # noqa: E402
+from point import Point  # noqa: E402
+from ray import Ray  # noqa: E402
+from scene import Scene  # noqa: E402
+from vector import Vector  # noqa: E402
+
+
+def random_objects(count, rng):
+    material = Material(Color.from_hex("#CC3333"))
+    objects = []
+    for _ in range(count):
+        center = Point(rng.uniform(-4, 4), rng.uniform(-2, 2), rng.uniform(2, 10))
+        if rng.random() < 0.5:
+            objects.append(Sphere(center, rng.uniform(0.05, 0.2), material))
+        else:
+            size = rng.uniform(0.1, 0.3)
+            objects.append(Box(center, size, size, size, material))
+    return objects
+
+
+def main():
+    parser = argparse.ArgumentParser(description="BVH build and traversal scaling")
+    parser.add_argument("-r", "--rays", type=int, default=2000)
+    parser.add_argument(
+        "-n", "--counts", type=int, nargs="+", default=[10, 100, 1000, 5000]
+    )
+    args = parser.parse_args()
+    camera = Vector(0, 0, -2)
+    print(
+        f"{'objects':>8} {'build ms':>9} {'nodes':>6} {'depth':>5} "
+        f"{'boxes/ray':>9} {'tests/ray':>9} {'us/ray':>8}"
+    )
+    for count in args.counts:
+        rng = random.Random(count)
+        scene = Scene(camera, random_objects(count, rng), [], 1, 1)
+        rays = [
+            Ray(camera, Point(rng.uniform(-1, 1), rng.uniform(-0.5, 0.5)) - camera)
+            for _ in range(args.rays)
+        ]
+        start = time.perf_counter()
+        for ray in rays:
+            scene.bvh.find_nearest(ray)
+        elapsed = time.perf_counter() - start
+        scene.bvh.instrument()
+        for ray in rays:
+            scene.bvh.find_nearest(ray)
+        scene.bvh.uninstrument()
+        stats = scene.bvh.stats()
+        print(
+            f"{count:>8} {stats['build_time'] * 1000:>9.1f} {stats['nodes']:>6} "
+            f"{stats['depth']:>5} {stats['boxes_per_ray']:>9.1f} "
+            f"{stats['tests_per_ray']:>9.1f} {elapsed / len(rays) * 1e6:>8.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
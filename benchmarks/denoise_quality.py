@@ -0,0 +1,103 @@
+import argparse
+import math
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT / "src"))
+
+from denoise import AuxBuffers, denoise  # noqa: E402
+from engine import RenderEngine  # noqa: E402
+from image import Image  # noqa: E402
+from scenes import many_lights, sphere  # noqa: E402
+
+
+def render(engine, scene, denoised=False):
+    # Returns the render and denoise times and the pixels.
+    image = Image(scene.width, scene.height)
+    sample_counts = Image(scene.width, scene.height, channels=1)
+    aux = AuxBuffers(scene.width, scene.height) if denoised else None
+    try:
+        start = time.perf_counter()
+        tile = (0, 0, scene.width, scene.height)
+        engine.render_tile(scene, tile, image, sample_counts, aux=aux)
+        seconds = time.perf_counter() - start
+        denoise_seconds = 0.0
+        if denoised:
+            start = time.perf_counter()
+            denoise(image, aux)
+            denoise_seconds = time.perf_counter() - start
+        return (seconds, denoise_seconds, list(image.pixels))
+    finally:
+        image.close()
+        sample_counts.close()
+        if aux is not None:
+            aux.close()
+
+
+def rmse(values, reference):
+    # On the displayed values, clamped as when writing the image.
+    total = 0.0
+    for a, b in zip(values, reference):
+        d = min(max(a, 0.0), 1.0) - min(max(b, 0.0), 1.0)
+        total += d * d
+    return math.sqrt(total / len(values))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Error and time of a low spp render plus denoising against "
+        "a high spp render"
+    )
+    parser.add_argument("--width", type=int, default=96)
+    parser.add_argument("--height", type=int, default=54)
+    parser.add_argument("--low", type=int, default=4)
+    parser.add_argument("--high", type=int, default=32)
+    parser.add_argument("--reference-spp", type=int, default=128)
+    parser.add_argument(
+        "-k",
+        "--light-samples",
+        type=int,
+        default=2,
+        help="Light samples in the many lights scene, the source of its noise",
+    )
+    args = parser.parse_args()
+    cases = [
+        ("sphere (edges only)", sphere(args.width, args.height), 0),
+        (
+            f"64 lights, {args.light_samples} sampled",
+            many_lights(args.width, args.height, 64),
+            args.light_samples,
+        ),
+    ]
+    print(f"{args.width}x{args.height}, rmse against {args.reference_spp} spp")
+    for name, scene, light_samples in cases:
+        _, _, reference = render(
+            RenderEngine(
+                samples_per_pixel=args.reference_spp,
+                light_samples=light_samples,
+                seed=1 << 20,
+            ),
+            scene,
+        )
+        print(name)
+        for label, spp, denoised in (
+            (f"{args.low} spp", args.low, False),
+            (f"{args.low} spp + denoise", args.low, True),
+            (f"{args.high} spp", args.high, False),
+        ):
+            seconds, denoise_seconds, values = render(
+                RenderEngine(samples_per_pixel=spp, light_samples=light_samples),
+                scene,
+                denoised,
+            )
+            total = seconds + denoise_seconds
+            print(
+                f"  {label:<18} rmse {rmse(values, reference):.5f} "
+                f"{total:7.2f}s (denoise {denoise_seconds:.3f}s)"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+import argparse
+import io
+import os
+import subprocess
+import sys
+import time
+from multiprocessing import cpu_count
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT / "src"))
+sys.path.insert(0, str(ROOT / "test"))
+
+import test_box  # noqa: E402
+from distributed import Coordinator  # noqa: E402
+from engine import RenderEngine  # noqa: E402
+from scene import Scene  # noqa: E402
+
+AUTHKEY = os.urandom(16).hex()
+
+
+def render_with_workers(engine, scene, count):
+    with Coordinator(engine, scene, ("127.0.0.1", 0), AUTHKEY.encode()) as coordinator:
+        host, port = coordinator.address
+        env = dict(os.environ, PRAY_AUTHKEY=AUTHKEY)
+        workers = [
+            subprocess.Popen(
+                [sys.executable, str(ROOT / "src" / "worker.py"), f"{host}:{port}"],
+                env=env,
+                stdout=subprocess.DEVNULL,
+            )
+            for _ in range(count)
+        ]
+        try:
+            start = time.perf_counter()
+            coordinator.render(io.BytesIO(), raw=True)
+            return time.perf_counter() - start
+        finally:
+            for worker in workers:
+                worker.wait(timeout=10)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Throughput of a localhost coordinator against worker count"
+    )
+    parser.add_argument("-w", "--workers", type=int, default=cpu_count())
+    parser.add_argument("-s", "--samples", type=int, default=2)
+    parser.add_argument("--width", type=int, default=192)
+    parser.add_argument("--height", type=int, default=108)
+    args = parser.parse_args()
+    scene = Scene(
+        test_box.CAMERA, test_box.OBJECTS, test_box.LIGHTS, args.width, args.height
+    )
+    engine = RenderEngine(samples_per_pixel=args.samples, tile_size=16)
+    pixels = args.width * args.height
+    print(f"{'workers':>7} {'seconds':>9} {'kpixels/s':>10} {'speedup':>8}")
+    baseline = None
+    for count in range(1, args.workers + 1):
+        # Includes worker start-up, as a farm render would.
+        seconds = render_with_workers(engine, scene, count)
+        baseline = baseline or seconds
+        print(
+            f"{count:>7} {seconds:>9.2f} {pixels / seconds / 1000:>10.1f} "
+            f"{baseline / seconds:>7.2f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+import argparse
+import io
+import sys
+import time
+from multiprocessing import cpu_count
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT / "src"))
+sys.path.insert(0, str(ROOT / "test"))
+
+import test_sphere  # noqa: E402
+from engine import RenderEngine  # noqa: E402
+from executor import EXECUTORS  # noqa: E402
+from progress import ProgressMonitor  # noqa: E402
+from scene import Scene  # noqa: E402
+
+
+def render(executor, scene, workers, samples):
+    engine = RenderEngine(samples_per_pixel=samples, tile_size=16, executor=executor)
+    start = time.perf_counter()
+    engine.render_multiprocess(
+        scene, workers, io.BytesIO(), raw=True, progress=ProgressMonitor()
+    )
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Startup cost and scaling of the process, thread and inline "
+        "executors"
+    )
+    parser.add_argument(
+        "-p", "--process", type=int, nargs="+", default=sorted({1, cpu_count()})
+    )
+    parser.add_argument("-s", "--samples", type=int, default=2)
+    parser.add_argument("--width", type=int, default=96)
+    parser.add_argument("--height", type=int, default=54)
+    args = parser.parse_args()
+    free_threaded = not getattr(sys, "_is_gil_enabled", lambda: True)()
+    print(
+        f"{args.width}x{args.height} at {args.samples} spp, "
+        f"{'free-threaded' if free_threaded else 'GIL'} build, {cpu_count()} CPUs"
+    )
+    # A 2x2 frame is all overhead: starting workers, handing them the
+    # scene, and shutting down.
+    tiny = Scene(test_sphere.CAMERA, test_sphere.OBJECTS, test_sphere.LIGHTS, 2, 2)
+    scene = Scene(
+        test_sphere.CAMERA,
+        test_sphere.OBJECTS,
+        test_sphere.LIGHTS,
+        args.width,
+        args.height,
+    )
+    print(
+        f"{'executor':<9} {'workers':>7} {'startup':>10} {'render':>9} "
+        f"{'speedup':>8}"
+    )
+    for executor in EXECUTORS:
+        base = None
+        for workers in [1] if executor == "inline" else args.process:
+            startup = min(render(executor, tiny, workers, 1) for _ in range(3))
+            seconds = render(executor, scene, workers, args.samples)
+            base = base or seconds
+            print(
+                f"{executor:<9} {workers:>7} {startup * 1000:>8.1f}ms "
+                f"{seconds:>8.2f}s {base / seconds:>7.2f}x"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+import argparse
+import math
+import pickle
+import random
+import sys
+import time
+import tracemalloc
+from array import array
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT / "src"))
+sys.path.insert(0, str(ROOT / "test"))
+
+import test_box  # noqa: E402
+from color import Color  # noqa: E402
+from engine import RenderEngine  # noqa: E402
+from image import Image  # noqa: E402
+from instance import Instance, transform_matrix  # noqa: E402
+from material import Material  # noqa: E402
+from mesh import TriangleMesh  # noqa: E402
+from scene import Scene  # noqa: E402
+from vector import Vector  # noqa: E402
+
+
+def sphere_arrays(rings):
+    # A unit UV sphere with 4 * rings^2 triangles.
+    segments = 2 * rings
+    vertices = array("d")
+    triangles = array("i")
+    for i in range(rings + 1):
+        theta = math.pi * i / rings
+        for j in range(segments):
+            phi = 2 * math.pi * j / segments
+            vertices.extend(
+                (
+                    math.sin(theta) * math.cos(phi),
+                    math.cos(theta),
+                    math.sin(theta) * math.sin(phi),
+                )
+            )
+    for i in range(rings):
+        for j in range(segments):
+            a = i * segments + j
+            b = i * segments + (j + 1) % segments
+            triangles.extend((a, b, b + segments, a, b + segments, a + segments))
+    return (vertices, triangles)
+
+
+def placements(count):
+    rng = random.Random(count)
+    return [
+        (
+            (rng.uniform(-3, 3), rng.uniform(-1.5, 0.3), rng.uniform(1, 8)),
+            (0, rng.uniform(0, 360), 0),
+            rng.uniform(0.05, 0.2),
+        )
+        for _ in range(count)
+    ]
+
+
+def copies(vertices, triangles, material, count):
+    # What a scene without instancing holds: every object its own mesh.
+    objects = []
+    for translate, rotate, scale in placements(count):
+        m = transform_matrix(rotate, (scale, scale, scale))
+        moved = array("d")
+        for v in range(0, len(vertices), 3):
+            x, y, z = vertices[v], vertices[v + 1], vertices[v + 2]
+            moved.extend(
+                (
+                    m[0] * x + m[1] * y + m[2] * z + translate[0],
+                    m[3] * x + m[4] * y + m[5] * z + translate[1],
+                    m[6] * x + m[7] * y + m[8] * z + translate[2],
+                )
+            )
+        objects.append(TriangleMesh(moved, triangles, material))
+    return objects
+
+
+def instances(vertices, triangles, material, count):
+    prototype = TriangleMesh(vertices, triangles, material)
+    return [
+        Instance(prototype, translate=translate, rotate=rotate, scale=scale)
+        for translate, rotate, scale in placements(count)
+    ]
+
+
+def measure(build, args, count):
+    tracemalloc.start()
+    start = time.perf_counter()
+    objects = build(*args, count)
+    seconds = time.perf_counter() - start
+    memory, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return (objects, seconds, memory)
+
+
+def render(scene, samples):
+    engine = RenderEngine(samples_per_pixel=samples)
+    image = Image(scene.width, scene.height)
+    sample_counts = Image(scene.width, scene.height, channels=1)
+    try:
+        start = time.perf_counter()
+        engine.render_tile(
+            scene, (0, 0, scene.width, scene.height), image, sample_counts
+        )
+        return time.perf_counter() - start
+    finally:
+        image.close()
+        sample_counts.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Memory, pickled size and render time of repeated meshes as "
+        "copies and as instances of one prototype"
+    )
+    parser.add_argument("-n", "--counts", type=int, nargs="+", default=[10, 50, 200])
+    parser.add_argument("--rings", type=int, default=12)
+    parser.add_argument("-s", "--samples", type=int, default=1)
+    parser.add_argument("--width", type=int, default=64)
+    parser.add_argument("--height", type=int, default=36)
+    args = parser.parse_args()
+    vertices, triangles = sphere_arrays(args.rings)
+    material = Material(Color.from_hex("#CC3333"))
+    print(
+        f"{len(triangles) // 3} triangles per mesh, {args.width}x{args.height} at "
+        f"{args.samples} spp"
+    )
+    print(
+        f"{'objects':>8} {'kind':<10} {'build s':>8} {'memory MB':>10} "
+        f"{'pickle MB':>10} {'render s':>9}"
+    )
+    for count in args.counts:
+        for kind, build in (("copies", copies), ("instances", instances)):
+            objects, seconds, memory = measure(
+                build, (vertices, triangles, material), count
+            )
+            scene = Scene(
+                Vector(0, -0.2, -2), objects, test_box.LIGHTS, args.width, args.height
+            )
+            # The scene as it is cached and sent to workers that do not fork.
+            pickled = len(pickle.dumps(scene, protocol=pickle.HIGHEST_PROTOCOL))
+            print(
+                f"{count:>8} {kind:<10} {seconds:>8.2f} {memory / 1e6:>10.2f} "
+                f"{pickled / 1e6:>10.2f} {render(scene, args.samples):>9.2f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
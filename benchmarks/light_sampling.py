@@ -0,0 +1,69 @@
+import argparse
+import math
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT / "src"))
+
+from engine import RenderEngine  # noqa: E402
+from image import Image  # noqa: E402
+from scenes import many_lights  # noqa: E402
+
+
+def render(engine, scene):
+    image = Image(scene.width, scene.height)
+    sample_counts = Image(scene.width, scene.height, channels=1)
+    try:
+        start = time.perf_counter()
+        tile = (0, 0, scene.width, scene.height)
+        engine.render_tile(scene, tile, image, sample_counts)
+        return (time.perf_counter() - start, list(image.pixels))
+    finally:
+        image.close()
+        sample_counts.close()
+
+
+def rmse(values, reference):
+    # On the displayed values, clamped as when writing the image.
+    total = 0.0
+    for a, b in zip(values, reference):
+        d = min(max(a, 0.0), 1.0) - min(max(b, 0.0), 1.0)
+        total += d * d
+    return math.sqrt(total / len(values))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Shading cost and error of light sampling as lights are added"
+    )
+    parser.add_argument("--width", type=int, default=64)
+    parser.add_argument("--height", type=int, default=36)
+    parser.add_argument("-s", "--samples", type=int, default=4)
+    parser.add_argument("-k", "--light-samples", type=int, default=4)
+    parser.add_argument("--lights", type=int, nargs="+", default=[3, 30, 300])
+    args = parser.parse_args()
+    print(
+        f"{args.width}x{args.height} at {args.samples} spp, "
+        f"{args.light_samples} light samples"
+    )
+    print(f"{'lights':>8} {'all (us/px)':>12} {'sampled':>10} {'rmse':>8}")
+    pixels = args.width * args.height
+    for count in args.lights:
+        scene = many_lights(args.width, args.height, count)
+        exact_time, exact = render(RenderEngine(samples_per_pixel=args.samples), scene)
+        sampled_time, sampled = render(
+            RenderEngine(
+                samples_per_pixel=args.samples, light_samples=args.light_samples
+            ),
+            scene,
+        )
+        print(
+            f"{count:>8} {exact_time / pixels * 1e6:>12.1f} "
+            f"{sampled_time / pixels * 1e6:>10.1f} {rmse(sampled, exact):>8.4f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+import argparse
+import math
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+SRC = Path(__file__).resolve().parents[1] / "src"
+sys.path.insert(0, str(SRC))
+
+from mesh import TriangleMesh  # noqa: E402
+from point import Point  # noqa: E402
+from ray import Ray  # noqa: E402
+from vector import Vector  # noqa: E402
+
+
+def write_sphere_obj(path, rings):
+    # A UV sphere with 4 * rings^2 triangles.
+    segments = 2 * rings
+    with open(path, "w") as f:
+        for i in range(rings + 1):
+            theta = math.pi * i / rings
+            for j in range(segments):
+                phi = 2 * math.pi * j / segments
+                f.write(
+                    f"v {0.5 * math.sin(theta) * math.cos(phi):.6f} "
+                    f"{0.5 * math.cos(theta):.6f} "
+                    f"{1.5 + 0.5 * math.sin(theta) * math.sin(phi):.6f}\n"
+                )
+        for i in range(rings):
+            for j in range(segments):
+                a = i * segments + j + 1
+                b = i * segments + (j + 1) % segments + 1
+                c = b + segments
+                d = a + segments
+                f.write(f"f {a} {b} {c}\nf {a} {c} {d}\n")
+
+
+def load(path, cache_dir, rays):
+    start = time.perf_counter()
+    mesh = TriangleMesh.load_obj(path, None, cache_dir)
+    elapsed = time.perf_counter() - start
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    rng = random.Random(1)
+    origin = Point(0, 0, -2)
+    batch = [
+        Ray(origin, Vector(rng.uniform(-0.3, 0.3), rng.uniform(-0.3, 0.3), 1))
+        for _ in range(rays)
+    ]
+    start = time.perf_counter()
+    for ray in batch:
+        mesh.hit(ray)
+    trace = time.perf_counter() - start
+    print(
+        f"{mesh.triangle_count():>10} {elapsed:>9.2f} {rss:>9.0f} "
+        f"{rays / trace:>9.0f}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Triangle mesh load and trace cost")
+    parser.add_argument("-n", "--rings", type=int, default=158)
+    parser.add_argument("-r", "--rays", type=int, default=2000)
+    parser.add_argument("--child", nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        load(args.child[0], args.child[1], args.rays)
+        return
+    with tempfile.TemporaryDirectory() as tmp:
+        path = str(Path(tmp) / "sphere.obj")
+        write_sphere_obj(path, args.rings)
+        print(f"{'':<10}{'triangles':>10} {'load s':>9} {'max MB':>9} {'rays/s':>9}")
+        # Each load runs in a fresh process so peak memory is its own.
+        for label in ("obj", "cached"):
+            print(f"{label:<10}", end="", flush=True)
+            subprocess.run(
+                [sys.executable, __file__, "-r", str(args.rays), "--child", path, tmp],
+                check=True,
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+import argparse
+import io
+import sys
+import time
+from multiprocessing import cpu_count
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT / "src"))
+sys.path.insert(0, str(ROOT / "test"))
+
+import test_sphere  # noqa: E402
+from engine import RenderEngine  # noqa: E402
+from pool import RenderPool  # noqa: E402
+from scene import Scene  # noqa: E402
+from vector import Vector  # noqa: E402
+
+
+def cameras(count):
+    return [Vector(-0.5 + i / max(count - 1, 1), -0.35, -1) for i in range(count)]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Per-frame overhead of spawn-per-render against a RenderPool"
+    )
+    parser.add_argument("-f", "--frames", type=int, default=10)
+    parser.add_argument("-p", "--process", type=int, default=cpu_count())
+    parser.add_argument("--width", type=int, default=48)
+    parser.add_argument("--height", type=int, default=27)
+    args = parser.parse_args()
+    scene = Scene(
+        test_sphere.CAMERA,
+        test_sphere.OBJECTS,
+        test_sphere.LIGHTS,
+        args.width,
+        args.height,
+    )
+    engine = RenderEngine(samples_per_pixel=1, tile_size=16)
+
+    start = time.perf_counter()
+    for camera in cameras(args.frames):
+        scene.camera = camera
+        engine.render_multiprocess(scene, args.process, io.BytesIO(), raw=True)
+    spawn = (time.perf_counter() - start) / args.frames
+    print()
+
+    start = time.perf_counter()
+    with RenderPool(engine, scene, args.process) as pool:
+        startup = time.perf_counter() - start
+        for camera in cameras(args.frames):
+            image = pool.render(camera=camera)
+            image.write_ppm(io.BytesIO())
+            image.close()
+    pooled = (time.perf_counter() - start) / args.frames
+
+    print(
+        f"{args.frames} frames of {args.width}x{args.height} on {args.process} "
+        "processes"
+    )
+    print(f"spawn per render: {spawn * 1000:8.1f} ms/frame")
+    print(
+        f"render pool:      {pooled * 1000:8.1f} ms/frame "
+        f"(pool startup {startup * 1000:.1f} ms, amortized)"
+    )
+
+
+if __name__ == "__main__":
+    main()
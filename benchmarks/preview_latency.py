@@ -0,0 +1,73 @@
+import argparse
+import asyncio
+import io
+import sys
+import time
+from multiprocessing import cpu_count
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT / "src"))
+sys.path.insert(0, str(ROOT / "test"))
+
+import test_sphere  # noqa: E402
+from engine import RenderEngine  # noqa: E402
+from preview import PreviewRenderer  # noqa: E402
+from scene import Scene  # noqa: E402
+
+
+async def progressive(engine, scene, processes):
+    frames = []
+    start = time.perf_counter()
+    renderer = PreviewRenderer(engine, scene, processes)
+    try:
+        await renderer.run(
+            lambda frame, info: frames.append((time.perf_counter() - start, info))
+        )
+    finally:
+        renderer.close()
+    return frames
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Time to first image of the progressive preview against a "
+        "full render"
+    )
+    parser.add_argument("-s", "--samples", type=int, default=8)
+    parser.add_argument("-p", "--process", type=int, default=cpu_count())
+    parser.add_argument("--width", type=int, default=192)
+    parser.add_argument("--height", type=int, default=108)
+    args = parser.parse_args()
+    scene = Scene(
+        test_sphere.CAMERA,
+        test_sphere.OBJECTS,
+        test_sphere.LIGHTS,
+        args.width,
+        args.height,
+    )
+    engine = RenderEngine(samples_per_pixel=args.samples, tile_size=16)
+
+    start = time.perf_counter()
+    engine.render_multiprocess(scene, args.process, io.BytesIO())
+    full = time.perf_counter() - start
+    print()
+
+    frames = asyncio.run(progressive(engine, scene, args.process))
+    print(
+        f"{args.width}x{args.height} at {args.samples} spp on {args.process} "
+        "processes"
+    )
+    print(f"full render:            {full:8.3f}s")
+    for seconds, info in frames:
+        if info["partial"]:
+            continue
+        if info["step"] > 1:
+            label = f"{info['step']}x{info['step']} blocks"
+        else:
+            label = f"{info['samples']} spp"
+        print(f"preview pass {info['pass']} {label:<10} {seconds:8.3f}s")
+
+
+if __name__ == "__main__":
+    main()
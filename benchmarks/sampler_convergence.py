@@ -0,0 +1,94 @@
+import argparse
+import math
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT / "src"))
+sys.path.insert(0, str(ROOT / "test"))
+
+import test_sphere  # noqa: E402
+from engine import RenderEngine  # noqa: E402
+from image import Image  # noqa: E402
+from sampler import SAMPLERS  # noqa: E402
+from scene import Scene  # noqa: E402
+
+
+def render(engine, scene):
+    image = Image(scene.width, scene.height)
+    sample_counts = Image(scene.width, scene.height, channels=1)
+    try:
+        start = time.perf_counter()
+        tile = (0, 0, scene.width, scene.height)
+        engine.render_tile(scene, tile, image, sample_counts)
+        return (time.perf_counter() - start, list(image.pixels))
+    finally:
+        image.close()
+        sample_counts.close()
+
+
+def rmse(values, reference):
+    # On the displayed values, clamped as when writing the image.
+    total = 0.0
+    for a, b in zip(values, reference):
+        d = min(max(a, 0.0), 1.0) - min(max(b, 0.0), 1.0)
+        total += d * d
+    return math.sqrt(total / len(values))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Anti-aliasing error against samples per pixel for each sampler"
+    )
+    parser.add_argument("--width", type=int, default=48)
+    parser.add_argument("--height", type=int, default=27)
+    parser.add_argument("--spp", type=int, nargs="+", default=[2, 4, 8, 16, 32])
+    parser.add_argument("--reference-spp", type=int, default=256)
+    parser.add_argument("--samplers", nargs="+", choices=SAMPLERS, default=SAMPLERS)
+    parser.add_argument(
+        "--target",
+        type=float,
+        help="Also print the fewest spp each sampler needs to reach this rmse",
+    )
+    args = parser.parse_args()
+    scene = Scene(
+        test_sphere.CAMERA,
+        test_sphere.OBJECTS,
+        test_sphere.LIGHTS,
+        args.width,
+        args.height,
+    )
+    # A different seed than the measured renders, so the reference shares
+    # none of their error.
+    _, reference = render(
+        RenderEngine(samples_per_pixel=args.reference_spp, seed=1 << 20),
+        scene,
+    )
+    print(
+        f"{args.width}x{args.height}, rmse against a {args.reference_spp} spp "
+        "sobol reference"
+    )
+    print(f"{'spp':>5}" + "".join(f" {name:>11}" for name in args.samplers))
+    errors = {name: [] for name in args.samplers}
+    for spp in args.spp:
+        row = f"{spp:>5}"
+        for name in args.samplers:
+            _, values = render(RenderEngine(samples_per_pixel=spp, sampler=name), scene)
+            error = rmse(values, reference)
+            errors[name].append(error)
+            row += f" {error:>11.5f}"
+        print(row)
+    if args.target is not None:
+        print(f"fewest spp for rmse <= {args.target}:")
+        for name in args.samplers:
+            reached = [
+                spp
+                for spp, error in zip(args.spp, errors[name])
+                if error <= args.target
+            ]
+            print(f"  {name:<11} {reached[0] if reached else 'not reached'}")
+
+
+if __name__ == "__main__":
+    main()
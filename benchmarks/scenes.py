@@ -0,0 +1,69 @@
+import random
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT / "src"))
+sys.path.insert(0, str(ROOT / "test"))
+
+import test_box  # noqa: E402
+import test_sphere  # noqa: E402
+from color import Color  # noqa: E402
+from geometry import Box, Sphere  # noqa: E402
+from light import Light  # noqa: E402
+from material import ChequeredMaterial, Material, MirrorMaterial  # noqa: E402
+from point import Point  # noqa: E402
+from scene import Scene  # noqa: E402
+from vector import Vector  # noqa: E402
+
+PALETTE = ["#CC3333", "#3333CC", "#33CC33", "#FFD43B", "#306998", "#E6E6E6"]
+
+
+def floor():
+    return Sphere(Point(0, 10000.5, 1), 10000.0, ChequeredMaterial())
+
+
+def box(width, height):
+    return Scene(test_box.CAMERA, test_box.OBJECTS, test_box.LIGHTS, width, height)
+
+
+def sphere(width, height):
+    return Scene(
+        test_sphere.CAMERA, test_sphere.OBJECTS, test_sphere.LIGHTS, width, height
+    )
+
+
+def many_objects(width, height, count=300):
+    rng = random.Random(count)
+    objects = [floor()]
+    for i in range(count):
+        center = Point(rng.uniform(-3, 3), rng.uniform(-1.5, 0.4), rng.uniform(1, 8))
+        color = Color.from_hex(PALETTE[i % len(PALETTE)])
+        if i % 7 == 0:
+            material = MirrorMaterial()
+        else:
+            material = Material(color)
+        if i % 2:
+            objects.append(Sphere(center, rng.uniform(0.05, 0.15), material))
+        else:
+            size = rng.uniform(0.1, 0.25)
+            objects.append(Box(center, size, size, size, material))
+    return Scene(Vector(0, -0.2, -2), objects, test_box.LIGHTS, width, height)
+
+
+def many_lights(width, height, count=64):
+    rng = random.Random(count)
+    lights = []
+    for i in range(count):
+        color = Color.from_hex(PALETTE[i % len(PALETTE)]).iscale(3.0 / count)
+        position = Point(rng.uniform(-6, 6), rng.uniform(-6, -0.5), rng.uniform(-10, 4))
+        lights.append(Light(position, color))
+    return Scene(test_box.CAMERA, test_box.OBJECTS, lights, width, height)
+
+
+SCENES = {
+    "box": box,
+    "sphere": sphere,
+    "many_objects": many_objects,
+    "many_lights": many_lights,
+}
@@ -0,0 +1,334 @@
+import argparse
+import contextlib
+import io
+import json
+import platform
+import random
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from multiprocessing import cpu_count
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT / "src"))
+
+from engine import RenderEngine  # noqa: E402
+from image import Image  # noqa: E402
+from point import Point  # noqa: E402
+from ray import Ray  # noqa: E402
+from scenes import SCENES  # noqa: E402
+
+# Results only compare against ones taken on the same machine with the same
+# settings (see MATCHED_META), so each machine keeps its own baseline, made
+# with "suite.py run -o benchmarks/baseline.json"; it is not checked in.
+DEFAULT_BASELINE = ROOT / "benchmarks" / "baseline.json"
+
+# The suite traces rays one by one, as the python backend does.
+BACKEND = "python"
+
+# Meta entries that change what the numbers measure: results taken with
+# different ones are not comparable.
+MATCHED_META = (
+    "backend",
+    "cpu",
+    "cpu_count",
+    "python",
+    "rays",
+    "width",
+    "height",
+    "samples",
+    "seed",
+    "png_width",
+    "png_height",
+)
+
+# Metrics where a larger value is an improvement; everything else is a time
+# or a count, where smaller is better.
+HIGHER_IS_BETTER = ("rays_per_s",)
+
+
+def cpu_model():
+    # platform.processor() is empty on most Linux systems.
+    try:
+        for line in Path("/proc/cpuinfo").read_text().splitlines():
+            if line.startswith("model name"):
+                return line.split(":", 1)[1].strip()
+    except OSError:
+        pass
+    return platform.processor() or platform.machine()
+
+
+def git_commit():
+    try:
+        result = subprocess.run(
+            ["git", "describe", "--always", "--dirty"],
+            cwd=ROOT,
+            capture_output=True,
+            text=True,
+        )
+    except OSError:
+        return None
+    return result.stdout.strip() or None
+
+
+def primary_rays(engine, scene, count, rng):
+    x0, y0, xstep, ystep = engine.screen(scene)
+    camera = scene.camera
+    rays = []
+    for _ in range(count):
+        x = x0 + rng.uniform(0, scene.width - 1) * xstep
+        y = y0 + rng.uniform(0, scene.height - 1) * ystep
+        rays.append(Ray(camera, camera.direction_to(Point(x, y)), normalized=True))
+    return rays
+
+
+def measure(engine, scene, fn, items):
+    # Timed with the plain traversal, then traced again with the BVH's
+    # counters, both from the same occluder cache state.
+    engine.last_occluder.clear()
+    start = time.perf_counter()
+    for item in items:
+        fn(item)
+    elapsed = time.perf_counter() - start
+    engine.last_occluder.clear()
+    scene.bvh.reset_stats()
+    scene.bvh.instrument()
+    try:
+        for item in items:
+            fn(item)
+    finally:
+        scene.bvh.uninstrument()
+    stats = scene.bvh.stats()
+    return (len(items) / elapsed if elapsed > 0 else 0.0, stats["tests_per_ray"])
+
+
+def bench_rays(engine, scene, count, seed):
+    rng = random.Random(seed)
+    results = {}
+    rays = primary_rays(engine, scene, count, rng)
+    rate, tests = measure(
+        engine, scene, lambda ray: engine.find_nearest(ray, scene), rays
+    )
+    results["primary_rays_per_s"] = rate
+    results["primary_tests_per_ray"] = tests
+    hits = []
+    for ray in rays:
+        hit = engine.find_nearest(ray, scene)
+        if hit is not None:
+            hits.append((ray, hit))
+
+    shadow_rays = []
+    for _, hit in hits:
+        origin = hit.point.add_scaled(hit.normal, engine.MIN_DISPLACE)
+        for light_index, light in enumerate(scene.lights):
+            direction = hit.point.direction_to(light.position)
+            shadow_rays.append(
+                (
+                    Ray(origin, direction, normalized=True),
+                    hit.point.distance_to(light.position),
+                    light_index,
+                )
+            )
+    rate, tests = measure(
+        engine,
+        scene,
+        lambda item: engine.occluded(item[0], scene, item[1], item[2]),
+        shadow_rays,
+    )
+    results["shadow_rays_per_s"] = rate
+    results["shadow_tests_per_ray"] = tests
+
+    reflected = [
+        Ray(
+            hit.point.add_scaled(hit.normal, engine.MIN_DISPLACE),
+            ray.direction.reflect(hit.normal),
+            normalized=True,
+        )
+        for ray, hit in hits
+    ]
+    rate, tests = measure(
+        engine, scene, lambda ray: engine.find_nearest(ray, scene), reflected
+    )
+    results["reflection_rays_per_s"] = rate
+    results["reflection_tests_per_ray"] = tests
+    return results
+
+
+def bench_render(scene, samples, processes_counts):
+    results = {}
+    engine = RenderEngine(samples_per_pixel=samples, tile_size=16)
+    for processes_count in processes_counts:
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            engine.render_multiprocess(scene, processes_count, io.BytesIO(), raw=True)
+        results[f"render_s_p{processes_count}"] = time.perf_counter() - start
+    return results
+
+
+def bench_png(width, height, seed):
+    rng = random.Random(seed)
+    image = Image(width, height)
+    try:
+        for i in range(len(image.pixels)):
+            image.pixels[i] = rng.random()
+        start = time.perf_counter()
+        image.write_png(io.BytesIO())
+        return time.perf_counter() - start
+    finally:
+        image.close()
+
+
+def run(args):
+    processes_counts = args.process or sorted({1, cpu_count()})
+    report = {
+        "meta": {
+            "date": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "commit": git_commit(),
+            "backend": BACKEND,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu": cpu_model(),
+            "cpu_count": cpu_count(),
+            "rays": args.rays,
+            "width": args.width,
+            "height": args.height,
+            "samples": args.samples,
+            "seed": args.seed,
+            "png_width": args.png_width,
+            "png_height": args.png_height,
+        },
+        "results": {},
+    }
+    for name in args.scenes:
+        print(f"Benchmarking {name}...", file=sys.stderr)
+        scene = SCENES[name](args.width, args.height)
+        results = {"bvh_build_s": scene.bvh.build_time}
+        results.update(bench_rays(RenderEngine(), scene, args.rays, args.seed))
+        results.update(bench_render(scene, args.samples, processes_counts))
+        report["results"][name] = results
+    report["results"]["png"] = {
+        "png_encode_s": bench_png(args.png_width, args.png_height, args.seed)
+    }
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        Path(args.output).write_text(text + "\n")
+    else:
+        print(text)
+
+
+def compare(args):
+    if not Path(args.baseline).exists():
+        print(
+            f"Error: no baseline at {args.baseline}; create one on this machine "
+            f"with: suite.py run -o {args.baseline}",
+            file=sys.stderr,
+        )
+        return 2
+    baseline_report = json.loads(Path(args.baseline).read_text())
+    current_report = json.loads(Path(args.current).read_text())
+    baseline_meta = baseline_report.get("meta", {})
+    current_meta = current_report.get("meta", {})
+    print(
+        f"Baseline from commit {baseline_meta.get('commit') or 'unknown'}, "
+        f"current from {current_meta.get('commit') or 'unknown'}"
+    )
+    mismatched = [
+        key for key in MATCHED_META if baseline_meta.get(key) != current_meta.get(key)
+    ]
+    for key in mismatched:
+        print(
+            f"meta.{key} differs: baseline {baseline_meta.get(key)!r}, "
+            f"current {current_meta.get(key)!r}",
+            file=sys.stderr,
+        )
+    if mismatched:
+        if not args.force:
+            print(
+                "Error: results were measured differently; rerun with the "
+                "baseline's settings or pass --force",
+                file=sys.stderr,
+            )
+            return 2
+        print("Warning: comparing results measured differently", file=sys.stderr)
+    baseline = baseline_report["results"]
+    current = current_report["results"]
+    regressions = 0
+    print(f"{'metric':<40} {'baseline':>12} {'current':>12} {'change':>8}")
+    for group in sorted(set(baseline) & set(current)):
+        for metric in sorted(set(baseline[group]) & set(current[group])):
+            old = baseline[group][metric]
+            new = current[group][metric]
+            change = (new - old) / old if old else 0.0
+            if metric.endswith(HIGHER_IS_BETTER):
+                worse = change < -args.tolerance
+            else:
+                worse = change > args.tolerance
+            regressions += worse
+            flag = "  REGRESSION" if worse else ""
+            print(
+                f"{group + '.' + metric:<40} {old:>12.4g} {new:>12.4g} "
+                f"{change * 100:>+7.1f}%{flag}"
+            )
+    print(f"\n{regressions} regression(s) beyond {args.tolerance * 100:.0f}%")
+    return 1 if regressions else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="PRay benchmark suite")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="Run the benchmarks")
+    run_parser.add_argument(
+        "--scenes", nargs="+", choices=sorted(SCENES), default=list(SCENES)
+    )
+    run_parser.add_argument("-o", "--output", help="Write results to this JSON file")
+    run_parser.add_argument("-r", "--rays", type=int, default=2000)
+    run_parser.add_argument("-s", "--samples", type=int, default=1)
+    run_parser.add_argument("--width", type=int, default=96)
+    run_parser.add_argument("--height", type=int, default=54)
+    run_parser.add_argument("--png-width", type=int, default=960)
+    run_parser.add_argument("--png-height", type=int, default=540)
+    run_parser.add_argument(
+        "-p",
+        "--process",
+        type=int,
+        nargs="+",
+        help="Process counts to time end-to-end renders with (default: 1 and all CPUs)",
+    )
+    run_parser.add_argument("--seed", type=int, default=1)
+
+    compare_parser = commands.add_parser(
+        "compare", help="Compare results against a baseline"
+    )
+    compare_parser.add_argument("current", help="Results JSON from a run")
+    compare_parser.add_argument(
+        "-b",
+        "--baseline",
+        default=str(DEFAULT_BASELINE),
+        help="Baseline results JSON from a run on this machine "
+        "(default: benchmarks/baseline.json)",
+    )
+    compare_parser.add_argument(
+        "-t",
+        "--tolerance",
+        type=float,
+        default=0.1,
+        help="Relative change treated as a regression (default: 0.1)",
+    )
+    compare_parser.add_argument(
+        "-f",
+        "--force",
+        action="store_true",
+        help="Compare even when the runs' settings or machines differ",
+    )
+    args = parser.parse_args()
+    if args.command == "run":
+        run(args)
+    else:
+        sys.exit(compare(args))
+
+
+if __name__ == "__main__":
+    main()
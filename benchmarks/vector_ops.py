@@ -0,0 +1,104 @@
+import argparse
+import math
+import sys
+import timeit
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+
+from vector import Vector  # noqa: E402
+
+
+class DictVector:
+    # The original dict-backed vector, kept as the "before" reference.
+
+    def __init__(self, x=0.0, y=0.0, z=0.0):
+        self.x = x
+        self.y = y
+        self.z = z
+
+    def dot_product(self, other):
+        return self.x * other.x + self.y * other.y + self.z * other.z
+
+    def magnitude(self):
+        return math.sqrt(self.dot_product(self))
+
+    def normalize(self):
+        return self / self.magnitude()
+
+    def __add__(self, other):
+        return DictVector(self.x + other.x, self.y + other.y, self.z + other.z)
+
+    def __sub__(self, other):
+        return DictVector(self.x - other.x, self.y - other.y, self.z - other.z)
+
+    def __mul__(self, other):
+        if isinstance(other, DictVector):
+            return DictVector(self.x * other.x, self.y * other.y, self.z * other.z)
+        else:
+            return DictVector(self.x * other, self.y * other, self.z * other)
+
+    def __rmul__(self, other):
+        return self.__mul__(other)
+
+    def __truediv__(self, other):
+        return DictVector(self.x / other, self.y / other, self.z / other)
+
+
+# (name, before, after): the composite expressions the tracer evaluates per
+# ray, written the way engine.py used to and the way it does now.
+OPERATIONS = [
+    ("add", "a + b", "a + b"),
+    ("scale", "a * 2.0", "a * 2.0"),
+    ("dot", "a.dot_product(b)", "a.dot_product(b)"),
+    ("normalize", "a.normalize()", "a.normalize()"),
+    ("point_at", "a + b * 1.5", "a.add_scaled(b, 1.5)"),
+    ("direction_to", "(b - a).normalize()", "a.direction_to(b)"),
+    ("reflect", "a - 2 * a.dot_product(n) * n", "a.reflect(n)"),
+    ("accumulate", "c + a * b * 0.1", "c.iadd_product(a, b, 0.1)"),
+]
+
+
+def time_op(cls, statement, number):
+    namespace = {
+        "a": cls(0.3, -0.2, 0.9),
+        "b": cls(1.0, 2.0, 3.0),
+        "c": cls(0.0, 0.0, 0.0),
+        "n": cls(0.0, 1.0, 0.0),
+    }
+    best = min(timeit.repeat(statement, globals=namespace, number=number, repeat=5))
+    return best / number * 1e9
+
+
+def bytes_per_object(cls, count):
+    tracemalloc.start()
+    objects = [cls(float(i), 0.0, 0.0) for i in range(count)]
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del objects
+    # Subtract the list and the float objects that both layouts share.
+    return size / count - 8 - sys.getsizeof(1.0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Vector math microbenchmark")
+    parser.add_argument("-n", "--number", type=int, default=200000)
+    args = parser.parse_args()
+    print(f"{'operation':<14} {'before ns':>10} {'after ns':>10} {'speedup':>8}")
+    for name, before, after in OPERATIONS:
+        t_before = time_op(DictVector, before, args.number)
+        t_after = time_op(Vector, after, args.number)
+        print(
+            f"{name:<14} {t_before:>10.1f} {t_after:>10.1f} "
+            f"{t_before / t_after:>7.2f}x"
+        )
+    count = 100000
+    print(
+        f"\nbytes per vector: before {bytes_per_object(DictVector, count):.0f}, "
+        f"after {bytes_per_object(Vector, count):.0f}"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,457 @@
+import time
+from array import array
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+INV_EPSILON = 1e30
+PADDING = 1e-7
+
+
+class BVH:
+    LEAF_SIZE = 4
+    MAX_LEAF_SIZE = 16
+    BINS = 12
+    TRAVERSAL_COST = 1.0
+    INTERSECTION_COST = 1.0
+
+    def __init__(self, objects):
+        self.objects = list(objects)
+        start = time.perf_counter()
+        self.build([obj.bounds() for obj in self.objects])
+        self.build_time = time.perf_counter() - start
+        self.reset_stats()
+
+    @classmethod
+    def from_boxes(cls, boxes):
+        # For primitives that are not scene objects, such as the triangles of
+        # a mesh, which traverse the flat arrays themselves.
+        bvh = cls([])
+        start = time.perf_counter()
+        bvh.build_boxes(boxes)
+        bvh.build_time = time.perf_counter() - start
+        return bvh
+
+    @classmethod
+    def from_box_arrays(cls, lo, hi):
+        # Object-median build over numpy arrays of box corners, for primitives
+        # too many for the SAH build in Python. Each node splits at the median
+        # of its primitives' centroids along their longest axis, and a whole
+        # level of the tree is split at once. Nodes over m primitives always
+        # split into m // 2 and the rest, so the depth-first layout follows
+        # from the sizes alone.
+        bvh = cls([])
+        start = time.perf_counter()
+        lo = lo - PADDING
+        hi = hi + PADDING
+        count = len(lo)
+        subtree_sizes = {}
+
+        def subtree(m):
+            if m <= cls.LEAF_SIZE:
+                return 1
+            if m not in subtree_sizes:
+                subtree_sizes[m] = 1 + subtree(m // 2) + subtree(m - m // 2)
+            return subtree_sizes[m]
+
+        node_count = subtree(count) if count else 0
+        offsets = np.zeros(node_count, dtype=np.intc)
+        counts = np.zeros(node_count, dtype=np.intc)
+        bounds = np.empty((node_count, 6))
+        order = np.arange(count)
+        centroids = (lo + hi) / 2
+        starts = np.zeros(min(count, 1), dtype=np.int64)
+        ends = np.full(len(starts), count, dtype=np.int64)
+        nodes = np.zeros(len(starts), dtype=np.int64)
+        leaves = []
+        levels = []
+        depth = 0
+        while len(nodes):
+            depth += 1
+            sizes = ends - starts
+            leaf = sizes <= cls.LEAF_SIZE
+            offsets[nodes[leaf]] = starts[leaf]
+            counts[nodes[leaf]] = sizes[leaf]
+            leaves.append((nodes[leaf], starts[leaf]))
+            inner = ~leaf
+            starts, ends, nodes, sizes = (
+                starts[inner],
+                ends[inner],
+                nodes[inner],
+                sizes[inner],
+            )
+            if not len(nodes):
+                break
+            # Positions of the inner nodes' primitives in order, node by node.
+            firsts = np.cumsum(sizes) - sizes
+            segments = np.repeat(np.arange(len(nodes)), sizes)
+            positions = np.arange(len(segments)) + np.repeat(starts - firsts, sizes)
+            prims = order[positions]
+            c = centroids[prims]
+            cmin = np.minimum.reduceat(c, firsts)
+            extent = np.maximum.reduceat(c, firsts) - cmin
+            axis = np.argmax(extent, axis=1)
+            rows = np.arange(len(nodes))
+            span = extent[rows, axis]
+            span[span <= 0] = 1.0
+            # One sort orders the primitives by node, then along its axis.
+            key = c[np.arange(len(c)), axis[segments]] - cmin[rows, axis][segments]
+            key = segments + 0.5 * key / span[segments]
+            order[positions] = prims[np.argsort(key)]
+            mids = starts + sizes // 2
+            lefts = nodes + 1
+            halves, inverse = np.unique(sizes // 2, return_inverse=True)
+            rights = lefts + np.array([subtree(m) for m in halves])[inverse]
+            offsets[nodes] = rights
+            levels.append((nodes, lefts, rights))
+            starts, ends, nodes = (
+                np.concatenate((starts, mids)),
+                np.concatenate((mids, ends)),
+                np.concatenate((lefts, rights)),
+            )
+        if node_count:
+            leaf_nodes = np.concatenate([n for n, _ in leaves])
+            leaf_starts = np.concatenate([s for _, s in leaves])
+            by_start = np.argsort(leaf_starts)
+            leaf_nodes = leaf_nodes[by_start]
+            leaf_starts = leaf_starts[by_start]
+            bounds[leaf_nodes, :3] = np.minimum.reduceat(lo[order], leaf_starts)
+            bounds[leaf_nodes, 3:] = np.maximum.reduceat(hi[order], leaf_starts)
+            for nodes, lefts, rights in reversed(levels):
+                bounds[nodes, :3] = np.minimum(bounds[lefts, :3], bounds[rights, :3])
+                bounds[nodes, 3:] = np.maximum(bounds[lefts, 3:], bounds[rights, 3:])
+        bvh.indices = array("i", order.astype(np.intc).tobytes())
+        bvh.bounds = array("d", bounds.tobytes())
+        bvh.offsets = array("i", offsets.tobytes())
+        bvh.counts = array("i", counts.tobytes())
+        bvh.depth = depth
+        bvh.build_time = time.perf_counter() - start
+        return bvh
+
+    @classmethod
+    def from_arrays(cls, indices, bounds, offsets, counts, depth):
+        bvh = cls([])
+        bvh.indices = indices
+        bvh.bounds = bounds
+        bvh.offsets = offsets
+        bvh.counts = counts
+        bvh.depth = depth
+        return bvh
+
+    def build(self, prim_bounds):
+        self.build_boxes(
+            [(lo.x, lo.y, lo.z, hi.x, hi.y, hi.z) for lo, hi in prim_bounds]
+        )
+
+    def build_boxes(self, boxes):
+        boxes = [
+            (
+                b[0] - PADDING,
+                b[1] - PADDING,
+                b[2] - PADDING,
+                b[3] + PADDING,
+                b[4] + PADDING,
+                b[5] + PADDING,
+            )
+            for b in boxes
+        ]
+        centroids = [
+            ((b[0] + b[3]) / 2, (b[1] + b[4]) / 2, (b[2] + b[5]) / 2) for b in boxes
+        ]
+        self.indices = array("i", range(len(boxes)))
+        self.bounds = array("d")
+        self.offsets = array("i")
+        self.counts = array("i")
+        self.depth = 0
+        if not boxes:
+            return
+        stack = [(0, len(boxes), -1, 1)]
+        while stack:
+            start, end, parent, depth = stack.pop()
+            node = len(self.counts)
+            if parent >= 0:
+                self.offsets[parent] = node
+            self.depth = max(self.depth, depth)
+            node_box = self.union(boxes[i] for i in self.indices[start:end])
+            self.bounds.extend(node_box)
+            self.offsets.append(start)
+            self.counts.append(end - start)
+            if end - start <= self.LEAF_SIZE:
+                continue
+            mid = self.split(boxes, centroids, start, end, node_box)
+            if mid is None:
+                continue
+            self.counts[node] = 0
+            # The left child is stored right after its parent, the right child
+            # patches the parent's offset once it is popped.
+            stack.append((mid, end, node, depth + 1))
+            stack.append((start, mid, -1, depth + 1))
+
+    def split(self, boxes, centroids, start, end, node_box):
+        prims = self.indices[start:end]
+        best = None
+        last = self.BINS - 1
+        for axis in range(3):
+            coords = [centroids[i][axis] for i in prims]
+            cmin = min(coords)
+            cmax = max(coords)
+            if cmax - cmin <= 0:
+                continue
+            scale = self.BINS / (cmax - cmin)
+            bins = [[] for _ in range(self.BINS)]
+            for i, c in zip(prims, coords):
+                b = int((c - cmin) * scale)
+                bins[b if b < last else last].append(boxes[i])
+            bin_boxes = [self.union(members) if members else None for members in bins]
+            bin_counts = [len(members) for members in bins]
+            right_areas = [0.0] * self.BINS
+            right_box = None
+            right_count = 0
+            for b in range(self.BINS - 1, 0, -1):
+                if bin_boxes[b] is not None:
+                    right_box = self.merge(right_box, bin_boxes[b])
+                right_count += bin_counts[b]
+                if right_box is not None:
+                    right_areas[b] = self.area(right_box) * right_count
+            left_box = None
+            left_count = 0
+            for b in range(self.BINS - 1):
+                if bin_boxes[b] is not None:
+                    left_box = self.merge(left_box, bin_boxes[b])
+                left_count += bin_counts[b]
+                if left_count == 0 or left_count == len(prims):
+                    continue
+                cost = self.area(left_box) * left_count + right_areas[b + 1]
+                if best is None or cost < best[0]:
+                    best = (cost, axis, cmin, scale, b)
+        if best is None:
+            return None
+        leaf_cost = self.INTERSECTION_COST * len(prims)
+        parent_area = self.area(node_box)
+        split_cost = self.TRAVERSAL_COST + (
+            self.INTERSECTION_COST * best[0] / parent_area if parent_area > 0 else 0
+        )
+        if split_cost >= leaf_cost and len(prims) <= self.MAX_LEAF_SIZE:
+            return None
+        _, axis, cmin, scale, split_bin = best
+        left = []
+        right = []
+        for i in prims:
+            b = min(int((centroids[i][axis] - cmin) * scale), self.BINS - 1)
+            (left if b <= split_bin else right).append(i)
+        self.indices[start:end] = array("i", left + right)
+        return start + len(left)
+
+    @staticmethod
+    def union(boxes):
+        x0, y0, z0, x1, y1, z1 = zip(*boxes)
+        return (min(x0), min(y0), min(z0), max(x1), max(y1), max(z1))
+
+    @staticmethod
+    def merge(a, b):
+        if a is None:
+            return b
+        return (
+            a[0] if a[0] < b[0] else b[0],
+            a[1] if a[1] < b[1] else b[1],
+            a[2] if a[2] < b[2] else b[2],
+            a[3] if a[3] > b[3] else b[3],
+            a[4] if a[4] > b[4] else b[4],
+            a[5] if a[5] > b[5] else b[5],
+        )
+
+    @staticmethod
+    def area(b):
+        dx = b[3] - b[0]
+        dy = b[4] - b[1]
+        dz = b[5] - b[2]
+        return 2 * (dx * dy + dy * dz + dz * dx)
+
+    def reset_stats(self):
+        self.rays = 0
+        self.boxes_tested = 0
+        self.prims_tested = 0
+
+    def instrument(self):
+        # Counters are only collected between instrument() and uninstrument(),
+        # which swap counting wrappers in for the traversal's entry points,
+        # box test and primitives, as RenderStats does for the engine. Plain
+        # traversal pays nothing per node.
+        find_nearest = self.find_nearest
+        occluded = self.occluded
+        entry_distance = self.entry_distance
+
+        def counted_find_nearest(ray):
+            self.rays += 1
+            return find_nearest(ray)
+
+        def counted_occluded(ray, max_dist):
+            self.rays += 1
+            occluder = occluded(ray, max_dist)
+            return occluder.obj if occluder is not None else None
+
+        def counted_entry_distance(node, ox, oy, oz, ix, iy, iz, tmax):
+            self.boxes_tested += 1
+            return entry_distance(node, ox, oy, oz, ix, iy, iz, tmax)
+
+        self.find_nearest = counted_find_nearest
+        self.occluded = counted_occluded
+        self.entry_distance = counted_entry_distance
+        self.plain_objects = self.objects
+        self.objects = [CountedPrimitive(obj, self) for obj in self.objects]
+
+    def uninstrument(self):
+        del self.find_nearest
+        del self.occluded
+        del self.entry_distance
+        self.objects = self.plain_objects
+        del self.plain_objects
+
+    def stats(self):
+        rays = max(self.rays, 1)
+        return {
+            "objects": len(self.objects),
+            "nodes": len(self.counts),
+            "leaves": sum(1 for c in self.counts if c > 0),
+            "depth": self.depth,
+            "build_time": self.build_time,
+            "rays": self.rays,
+            "boxes_per_ray": self.boxes_tested / rays,
+            "tests_per_ray": self.prims_tested / rays,
+        }
+
+    def entry_distance(self, node, ox, oy, oz, ix, iy, iz, tmax):
+        b = self.bounds
+        k = node * 6
+        t0 = (b[k] - ox) * ix
+        t1 = (b[k + 3] - ox) * ix
+        tmin, tfar = (t0, t1) if t0 < t1 else (t1, t0)
+        t0 = (b[k + 1] - oy) * iy
+        t1 = (b[k + 4] - oy) * iy
+        if t0 > t1:
+            t0, t1 = t1, t0
+        tmin = t0 if t0 > tmin else tmin
+        tfar = t1 if t1 < tfar else tfar
+        t0 = (b[k + 2] - oz) * iz
+        t1 = (b[k + 5] - oz) * iz
+        if t0 > t1:
+            t0, t1 = t1, t0
+        tmin = t0 if t0 > tmin else tmin
+        tfar = t1 if t1 < tfar else tfar
+        if tmin > tfar or tfar < 0 or tmin > tmax:
+            return None
+        return tmin
+
+    def find_nearest(self, ray):
+        nearest = None
+        best = float("inf")
+        if not self.counts:
+            return nearest
+        if self.counts[0]:
+            # Small scenes fit in a single leaf, where the box test is pure cost.
+            for obj in self.objects:
+                hit = obj.hit(ray, best)
+                if hit is not None:
+                    best = hit.distance
+                    nearest = hit
+            return nearest
+        origin = ray.origin
+        direction = ray.direction
+        ox, oy, oz = origin.x, origin.y, origin.z
+        ix = 1 / direction.x if direction.x else INV_EPSILON
+        iy = 1 / direction.y if direction.y else INV_EPSILON
+        iz = 1 / direction.z if direction.z else INV_EPSILON
+        offsets = self.offsets
+        counts = self.counts
+        indices = self.indices
+        objects = self.objects
+        entry = self.entry_distance
+        t_root = entry(0, ox, oy, oz, ix, iy, iz, best)
+        stack = [(0, t_root)] if t_root is not None else []
+        while stack:
+            node, t_node = stack.pop()
+            if t_node > best:
+                continue
+            count = counts[node]
+            if count:
+                start = offsets[node]
+                for i in indices[start : start + count]:
+                    hit = objects[i].hit(ray, best)
+                    if hit is not None:
+                        best = hit.distance
+                        nearest = hit
+                continue
+            left = node + 1
+            right = offsets[node]
+            t_left = entry(left, ox, oy, oz, ix, iy, iz, best)
+            t_right = entry(right, ox, oy, oz, ix, iy, iz, best)
+            if t_left is not None and t_right is not None:
+                if t_left <= t_right:
+                    stack.append((right, t_right))
+                    stack.append((left, t_left))
+                else:
+                    stack.append((left, t_left))
+                    stack.append((right, t_right))
+            elif t_left is not None:
+                stack.append((left, t_left))
+            elif t_right is not None:
+                stack.append((right, t_right))
+        return nearest
+
+    def occluded(self, ray, max_dist):
+        if not self.counts:
+            return None
+        if self.counts[0]:
+            for obj in self.objects:
+                if obj.occludes(ray, max_dist):
+                    return obj
+            return None
+        origin = ray.origin
+        direction = ray.direction
+        ox, oy, oz = origin.x, origin.y, origin.z
+        ix = 1 / direction.x if direction.x else INV_EPSILON
+        iy = 1 / direction.y if direction.y else INV_EPSILON
+        iz = 1 / direction.z if direction.z else INV_EPSILON
+        offsets = self.offsets
+        counts = self.counts
+        indices = self.indices
+        objects = self.objects
+        entry = self.entry_distance
+        occluder = None
+        stack = [0]
+        while stack:
+            node = stack.pop()
+            if entry(node, ox, oy, oz, ix, iy, iz, max_dist) is None:
+                continue
+            count = counts[node]
+            if not count:
+                stack.append(offsets[node])
+                stack.append(node + 1)
+                continue
+            start = offsets[node]
+            for i in indices[start : start + count]:
+                if objects[i].occludes(ray, max_dist):
+                    occluder = objects[i]
+                    break
+            if occluder is not None:
+                break
+        return occluder
+
+
+class CountedPrimitive:
+    # Stands in for a scene object while its BVH is instrumented, counting
+    # the object's intersection tests.
+
+    def __init__(self, obj, bvh):
+        self.obj = obj
+        self.bvh = bvh
+
+    def hit(self, ray, max_dist=float("inf")):
+        self.bvh.prims_tested += 1
+        return self.obj.hit(ray, max_dist)
+
+    def occludes(self, ray, max_dist):
+        self.bvh.prims_tested += 1
+        return self.obj.occludes(ray, max_dist)
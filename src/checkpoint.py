@@ -0,0 +1,125 @@
+import hashlib
+import mmap
+import os
+import pickle
+import struct
+
+from image import Image
+
+MAGIC = b"PRAYCKPT"
+VERSION = 2
+# Magic, version, width, height, tile size, samples per pixel, seed, sampler
+# name and scene fingerprint.
+HEADER = struct.Struct("<8sIIIIIQ16s32s")
+# Keeps the float arrays that follow the header 8-byte aligned.
+HEADER_SIZE = 128
+
+
+def scene_fingerprint(scene):
+    # What the pixels depend on; the BVH is left out since it records its
+    # build time.
+    return hashlib.sha256(
+        pickle.dumps((scene.camera, scene.objects, scene.lights), protocol=4)
+    ).digest()
+
+
+class Checkpoint:
+    # Layout: header, framebuffer (3 doubles per pixel, the running mean),
+    # sample counts (1 double per pixel), then one byte per tile that is set
+    # once the tile's pixels and counts are complete. Tiles are numbered in
+    # row-major order of the tile grid, so any tile order can resume.
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "r+b") as f:
+            self.mapping = mmap.mmap(f.fileno(), 0)
+        if len(self.mapping) < HEADER_SIZE:
+            self.mapping.close()
+            raise ValueError(f"{path} is not a render checkpoint")
+        magic, version = struct.unpack_from("<8sI", self.mapping)
+        if magic != MAGIC or version != VERSION:
+            self.mapping.close()
+            raise ValueError(f"{path} is not a render checkpoint")
+        (
+            _,
+            _,
+            width,
+            height,
+            tile_size,
+            self.samples_per_pixel,
+            self.seed,
+            sampler,
+            self.fingerprint,
+        ) = HEADER.unpack_from(self.mapping)
+        self.width = width
+        self.height = height
+        self.tile_size = tile_size
+        self.sampler = sampler.rstrip(b"\0").decode()
+        self.columns = -(-width // tile_size)
+        self.rows = -(-height // tile_size)
+        pixels_offset = HEADER_SIZE
+        counts_offset = pixels_offset + width * height * 3 * 8
+        done_offset = counts_offset + width * height * 8
+        self.image = Image.mapped(path, pixels_offset, width, height)
+        self.sample_counts = Image.mapped(path, counts_offset, width, height, 1)
+        self.done = memoryview(self.mapping)[
+            done_offset : done_offset + self.columns * self.rows
+        ]
+
+    def __getstate__(self):
+        return self.path
+
+    def __setstate__(self, path):
+        self.__init__(path)
+
+    @classmethod
+    def create(cls, path, scene, tile_size, samples_per_pixel, seed, sampler):
+        width = scene.width
+        height = scene.height
+        columns = -(-width // tile_size)
+        rows = -(-height // tile_size)
+        size = HEADER_SIZE + width * height * 4 * 8 + columns * rows
+        with open(path, "wb") as f:
+            f.write(
+                HEADER.pack(
+                    MAGIC,
+                    VERSION,
+                    width,
+                    height,
+                    tile_size,
+                    samples_per_pixel,
+                    seed,
+                    sampler.encode(),
+                    scene_fingerprint(scene),
+                )
+            )
+            f.truncate(size)
+        return cls(path)
+
+    @classmethod
+    def open(cls, path):
+        if not os.path.exists(path):
+            raise ValueError(f"No checkpoint at {path}")
+        return cls(path)
+
+    def tile_index(self, tile):
+        xmin, ymin, _, _ = tile
+        return (ymin // self.tile_size) * self.columns + xmin // self.tile_size
+
+    def is_done(self, tile):
+        return self.done[self.tile_index(tile)] != 0
+
+    def mark(self, tile, done):
+        self.done[self.tile_index(tile)] = 1 if done else 0
+
+    def tiles_done(self):
+        return sum(1 for d in self.done if d)
+
+    def flush(self):
+        self.mapping.flush()
+
+    def close(self):
+        self.done.release()
+        self.image.close()
+        self.sample_counts.close()
+        self.mapping.close()
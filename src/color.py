@@ -2,6 +2,8 @@ from vector import Vector
 
 
 class Color(Vector):
+    __slots__ = ()
+
     @classmethod
     def from_hex(cls, hexcolor="#FFFFFF"):
         hexcolor = hexcolor.upper()
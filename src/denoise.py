@@ -0,0 +1,321 @@
+import math
+from array import array
+
+from color import Color
+from image import Image
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# B3 spline taps of the a-trous wavelet filter.
+KERNEL = (1 / 16, 1 / 4, 3 / 8, 1 / 4, 1 / 16)
+ITERATIONS = 5
+# Edge-stopping: luminance difference in standard deviations of the pixel's
+# noise, exponent on the cosine between normals, and depth difference
+# relative to depth per pixel of tap distance.
+SIGMA_LUMINANCE = 4.0
+NORMAL_POWER = 64
+SIGMA_DEPTH = 0.05
+# Below this an albedo channel is treated as black and not divided out.
+MIN_ALBEDO = 1e-3
+# Keeps the luminance weight finite where a pixel shows no noise.
+MIN_DEVIATION = 1e-4
+LUMINANCE = (0.2126, 0.7152, 0.0722)
+# Taps of the 3x3 blur applied to the variance before it is used.
+VARIANCE_KERNEL = (1 / 4, 1 / 2, 1 / 4)
+
+
+class AuxBuffers:
+    # First-hit features of each pixel, averaged over its samples: normal,
+    # albedo (the material color at the hit) and depth, plus the index of
+    # the object the pixel's first sample hit (-1 for the background), and
+    # the variance of the pixel's mean luminance, estimated from its
+    # samples. The denoiser uses them to tell noise from edges.
+
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.normal = Image(width, height)
+        self.albedo = Image(width, height)
+        self.depth = Image(width, height, channels=1)
+        self.ids = Image(width, height, channels=1)
+        self.variance = Image(width, height, channels=1)
+
+    def close(self):
+        self.normal.close()
+        self.albedo.close()
+        self.depth.close()
+        self.ids.close()
+        self.variance.close()
+
+    def write_pngs(self, fileobjs):
+        # fileobjs maps "normal", "albedo", "depth" and "id" to open files;
+        # normals are shown as 0.5 + 0.5 * n, depth and ids as heatmaps.
+        if "normal" in fileobjs:
+            shown = Image(self.width, self.height)
+            try:
+                shown.pixels[:] = array(
+                    "d", [0.5 + 0.5 * n for n in self.normal.pixels]
+                )
+                shown.write_png(fileobjs["normal"])
+            finally:
+                shown.close()
+        if "albedo" in fileobjs:
+            self.albedo.write_png(fileobjs["albedo"])
+        for name, values in (("depth", self.depth), ("id", self.ids)):
+            if name in fileobjs:
+                heatmap = Image.heatmap(values)
+                try:
+                    heatmap.write_png(fileobjs[name])
+                finally:
+                    heatmap.close()
+
+
+class PixelFeatures:
+    # Accumulates the first hits of one pixel's samples for AuxBuffers.
+
+    def __init__(self, scene):
+        self.indices = {id(obj): index for index, obj in enumerate(scene.objects)}
+        self.reset()
+
+    def reset(self):
+        self.normal = Color(0, 0, 0)
+        self.albedo = Color(0, 0, 0)
+        self.depth = 0.0
+        self.object_id = -1
+        self.count = 0
+        self.luminance = 0.0
+        self.luminance_sq = 0.0
+        self.colors = 0
+
+    def add(self, hit, pixel_spread):
+        if self.count == 0 and hit is not None:
+            self.object_id = self.indices.get(id(hit.obj), -1)
+        self.count += 1
+        if hit is None:
+            return
+        self.normal.iadd(hit.normal)
+        self.albedo.iadd(
+            hit.material.color_at(hit.point, hit.uv, hit.distance * pixel_spread)
+        )
+        self.depth += hit.distance
+
+    def add_color(self, color):
+        luminance = (
+            LUMINANCE[0] * color.x + LUMINANCE[1] * color.y + LUMINANCE[2] * color.z
+        )
+        self.luminance += luminance
+        self.luminance_sq += luminance * luminance
+        self.colors += 1
+
+    def store(self, aux, i, j):
+        scale = 1.0 / max(self.count, 1)
+        aux.normal.set_pixel(i, j, self.normal.iscale(scale))
+        aux.albedo.set_pixel(i, j, self.albedo.iscale(scale))
+        aux.depth.pixels[j * aux.width + i] = self.depth * scale
+        aux.ids.pixels[j * aux.width + i] = self.object_id
+        aux.variance.pixels[j * aux.width + i] = mean_variance(
+            self.luminance, self.luminance_sq, self.colors
+        )
+        self.reset()
+
+
+def mean_variance(total, total_sq, count):
+    # Variance of the mean of count samples from their sum and sum of
+    # squares; 0 when a single sample leaves it unknown.
+    if count < 2:
+        return 0.0
+    return max(total_sq - total * total / count, 0.0) / (count - 1) / count
+
+
+def denoise(image, aux):
+    # Edge-avoiding a-trous wavelet filter (Dammertz et al. 2010), guided by
+    # the variance of each pixel as in SVGF (Schied et al. 2017), over the
+    # float framebuffer, in place. The color is divided by the albedo first,
+    # so textures are kept sharp and only the lighting is smoothed. Then
+    # ITERATIONS passes of a 5x5 kernel with taps spread 1, 2, 4... pixels
+    # apart average each pixel with neighbours of the same object whose
+    # normal and depth are close to its own, and whose luminance is within a
+    # few standard deviations of its noise: pixels whose samples all agree
+    # are left alone. Each pass carries the variance along to the next.
+    if np is not None:
+        denoise_numpy(image, aux)
+    else:
+        denoise_python(image, aux)
+
+
+def denoise_numpy(image, aux):
+    height = image.height
+    width = image.width
+    color = np.array(image.pixels).reshape(height, width, 3)
+    albedo = np.array(aux.albedo.pixels).reshape(height, width, 3)
+    normal = np.array(aux.normal.pixels).reshape(height, width, 3)
+    depth = np.array(aux.depth.pixels).reshape(height, width)
+    ids = np.array(aux.ids.pixels).reshape(height, width)
+    variance = np.array(aux.variance.pixels).reshape(height, width)
+    albedo = np.where(albedo > MIN_ALBEDO, albedo, 1.0)
+    irradiance = color / albedo
+    variance = variance / (albedo @ LUMINANCE) ** 2
+    length = np.linalg.norm(normal, axis=2, keepdims=True)
+    normal = normal / np.maximum(length, 1e-12)
+    background = ids < 0
+    for iteration in range(ITERATIONS):
+        step = 1 << iteration
+        pad = 2 * step
+        luminance = irradiance @ LUMINANCE
+        deviation = SIGMA_LUMINANCE * np.sqrt(smooth_variance(variance))
+        deviation += MIN_DEVIATION
+        around = [
+            pad_edges(v, pad)
+            for v in (irradiance, luminance, variance, normal, depth, ids)
+        ]
+        total = np.zeros_like(irradiance)
+        total_variance = np.zeros_like(variance)
+        weights = np.zeros_like(variance)
+        for ky, ty in enumerate(KERNEL):
+            dy = pad + (ky - 2) * step
+            for kx, tx in enumerate(KERNEL):
+                dx = pad + (kx - 2) * step
+                tap = [v[dy : dy + height, dx : dx + width] for v in around]
+                (
+                    tap_irradiance,
+                    tap_luminance,
+                    tap_variance,
+                    tap_normal,
+                    tap_depth,
+                    tap_ids,
+                ) = tap
+                cosine = np.maximum((tap_normal * normal).sum(axis=2), 0.0)
+                weight = (
+                    ty
+                    * tx
+                    * np.exp(-np.abs(tap_luminance - luminance) / deviation)
+                    * np.where(background, 1.0, cosine**NORMAL_POWER)
+                    * np.exp(
+                        -np.abs(tap_depth - depth)
+                        / (SIGMA_DEPTH * step * np.maximum(depth, 1e-6))
+                    )
+                    * (tap_ids == ids)
+                )
+                total += tap_irradiance * weight[:, :, None]
+                total_variance += tap_variance * weight * weight
+                weights += weight
+        irradiance = np.divide(
+            total,
+            weights[:, :, None],
+            out=irradiance.copy(),
+            where=weights[:, :, None] > 0,
+        )
+        variance = np.divide(
+            total_variance, weights * weights, out=variance.copy(), where=weights > 0
+        )
+    image.pixels[:] = np.ascontiguousarray((irradiance * albedo).ravel())
+
+
+def pad_edges(values, pad):
+    widths = ((pad, pad), (pad, pad)) + ((0, 0),) * (values.ndim - 2)
+    return np.pad(values, widths, mode="edge")
+
+
+def smooth_variance(variance):
+    height, width = variance.shape
+    around = pad_edges(variance, 1)
+    smoothed = np.zeros_like(variance)
+    for dy, ty in enumerate(VARIANCE_KERNEL):
+        for dx, tx in enumerate(VARIANCE_KERNEL):
+            smoothed += ty * tx * around[dy : dy + height, dx : dx + width]
+    return smoothed
+
+
+def denoise_python(image, aux):
+    height = image.height
+    width = image.width
+    count = width * height
+    albedo = [a if a > MIN_ALBEDO else 1.0 for a in aux.albedo.pixels]
+    irradiance = [c / a for c, a in zip(image.pixels, albedo)]
+    variance = []
+    normal = []
+    for p in range(count):
+        a = albedo[p * 3 : p * 3 + 3]
+        scale = LUMINANCE[0] * a[0] + LUMINANCE[1] * a[1] + LUMINANCE[2] * a[2]
+        variance.append(aux.variance.pixels[p] / (scale * scale))
+        n = aux.normal.pixels[p * 3 : p * 3 + 3]
+        length = math.sqrt(n[0] * n[0] + n[1] * n[1] + n[2] * n[2])
+        normal.extend(c / length if length > 0 else 0.0 for c in n)
+    depth = list(aux.depth.pixels)
+    ids = list(aux.ids.pixels)
+    for iteration in range(ITERATIONS):
+        step = 1 << iteration
+        luminance = [
+            LUMINANCE[0] * irradiance[p * 3]
+            + LUMINANCE[1] * irradiance[p * 3 + 1]
+            + LUMINANCE[2] * irradiance[p * 3 + 2]
+            for p in range(count)
+        ]
+        smoothed = smooth_variance_python(variance, width, height)
+        result = [0.0] * (count * 3)
+        result_variance = [0.0] * count
+        for y in range(height):
+            for x in range(width):
+                p = y * width + x
+                nx, ny, nz = normal[p * 3 : p * 3 + 3]
+                l0 = luminance[p]
+                z = depth[p]
+                object_id = ids[p]
+                luminance_scale = 1.0 / (
+                    SIGMA_LUMINANCE * math.sqrt(smoothed[p]) + MIN_DEVIATION
+                )
+                depth_scale = 1.0 / (SIGMA_DEPTH * step * max(z, 1e-6))
+                r = g = b = v = total = 0.0
+                for ky, ty in enumerate(KERNEL):
+                    qy = min(max(y + (ky - 2) * step, 0), height - 1)
+                    for kx, tx in enumerate(KERNEL):
+                        qx = min(max(x + (kx - 2) * step, 0), width - 1)
+                        q = qy * width + qx
+                        if ids[q] != object_id:
+                            continue
+                        weight = (
+                            ty
+                            * tx
+                            * math.exp(
+                                -abs(luminance[q] - l0) * luminance_scale
+                                - abs(depth[q] - z) * depth_scale
+                            )
+                        )
+                        if object_id >= 0:
+                            cosine = (
+                                normal[q * 3] * nx
+                                + normal[q * 3 + 1] * ny
+                                + normal[q * 3 + 2] * nz
+                            )
+                            weight *= max(cosine, 0.0) ** NORMAL_POWER
+                        r += irradiance[q * 3] * weight
+                        g += irradiance[q * 3 + 1] * weight
+                        b += irradiance[q * 3 + 2] * weight
+                        v += variance[q] * weight * weight
+                        total += weight
+                if total > 0:
+                    result[p * 3 : p * 3 + 3] = [r / total, g / total, b / total]
+                    result_variance[p] = v / (total * total)
+                else:
+                    result[p * 3 : p * 3 + 3] = irradiance[p * 3 : p * 3 + 3]
+                    result_variance[p] = variance[p]
+        irradiance = result
+        variance = result_variance
+    image.pixels[:] = array("d", [e * a for e, a in zip(irradiance, albedo)])
+
+
+def smooth_variance_python(variance, width, height):
+    smoothed = []
+    for y in range(height):
+        for x in range(width):
+            value = 0.0
+            for dy, ty in enumerate(VARIANCE_KERNEL):
+                qy = min(max(y + dy - 1, 0), height - 1)
+                for dx, tx in enumerate(VARIANCE_KERNEL):
+                    qx = min(max(x + dx - 1, 0), width - 1)
+                    value += ty * tx * variance[qy * width + qx]
+            smoothed.append(value)
+    return smoothed
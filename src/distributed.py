@@ -0,0 +1,234 @@
+import pickle
+import queue
+import threading
+import time
+from multiprocessing.connection import Client, Listener
+
+from image import Image, TileRowWriter
+from tiles import make_tiles
+
+# A tile still running after this many times the mean tile time is handed to
+# an idle worker as well; whichever copy finishes first is kept.
+REISSUE_FACTOR = 4.0
+MIN_REISSUE_AFTER = 2.0
+
+
+def parse_address(text):
+    host, _, port = text.rpartition(":")
+    if not port.isdigit():
+        raise ValueError(f"Invalid address {text!r}, expected HOST:PORT")
+    return (host or "localhost", int(port))
+
+
+class TileScheduler:
+    def __init__(self, tiles):
+        self.pending = list(reversed(tiles))
+        self.in_flight = {}
+        self.done = set()
+        self.durations = 0.0
+        self.completed = 0
+        self.cond = threading.Condition()
+
+    def reissue_after(self):
+        if not self.completed:
+            return None
+        return max(MIN_REISSUE_AFTER, REISSUE_FACTOR * self.durations / self.completed)
+
+    def next_tile(self):
+        with self.cond:
+            while True:
+                now = time.perf_counter()
+                if self.pending:
+                    tile = self.pending.pop()
+                    self.in_flight[tile] = [now, 1]
+                    return tile
+                if not self.in_flight:
+                    return None
+                after = self.reissue_after()
+                if after is not None:
+                    tile, (started, holders) = min(
+                        self.in_flight.items(), key=lambda item: item[1][0]
+                    )
+                    if now - started > after:
+                        self.in_flight[tile] = [now, holders + 1]
+                        return tile
+                self.cond.wait(timeout=0.2)
+
+    def complete(self, tile, elapsed):
+        with self.cond:
+            if tile in self.done:
+                return False
+            self.done.add(tile)
+            self.in_flight.pop(tile, None)
+            self.durations += elapsed
+            self.completed += 1
+            self.cond.notify_all()
+            return True
+
+    def release(self, tile):
+        with self.cond:
+            entry = self.in_flight.get(tile)
+            if entry is None:
+                return
+            entry[1] -= 1
+            if not entry[1]:
+                del self.in_flight[tile]
+                self.pending.append(tile)
+                self.cond.notify_all()
+
+
+class Coordinator:
+    # Hands tiles to remote workers over TCP. The engine and scene are
+    # pickled once and sent to every worker as it connects; workers then
+    # request tiles one at a time and send back the finished pixels.
+
+    def __init__(self, engine, scene, address, authkey):
+        self.engine = engine
+        self.scene = scene
+        self.listener = Listener(address, authkey=authkey)
+        self.address = self.listener.address
+        self.payload = pickle.dumps((engine, scene), protocol=pickle.HIGHEST_PROTOCOL)
+        self.workers = []
+        self.lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def render(self, img_fileobj, raw=False, heatmap_fileobj=None):
+        scene = self.scene
+        engine = self.engine
+        tiles = make_tiles(
+            scene.width, scene.height, engine.tile_size, engine.tile_order
+        )
+        image = Image(scene.width, scene.height)
+        sample_counts = Image(scene.width, scene.height, channels=1)
+        try:
+            scheduler = TileScheduler(tiles)
+            finished = queue.Queue()
+            accepting = threading.Thread(
+                target=self.accept_workers,
+                args=(scheduler, image, sample_counts, finished),
+                daemon=True,
+            )
+            accepting.start()
+            rows = TileRowWriter(image, image.writer(img_fileobj, raw), tiles)
+            start = time.perf_counter()
+            for _ in tiles:
+                rows.tile_done(finished.get())
+            wall = time.perf_counter() - start
+            rows.close()
+            with self.lock:
+                workers = [dict(worker) for worker in self.workers]
+            for worker in workers:
+                worker["utilization"] = worker["busy"] / wall if wall > 0 else 0.0
+            if heatmap_fileobj is not None:
+                heatmap = Image.heatmap(sample_counts, engine.samples_per_pixel)
+                try:
+                    heatmap.write_png(heatmap_fileobj)
+                finally:
+                    heatmap.close()
+            return workers
+        finally:
+            image.close()
+            sample_counts.close()
+
+    def accept_workers(self, scheduler, image, sample_counts, finished):
+        while True:
+            try:
+                conn = self.listener.accept()
+            except OSError:
+                return
+            with self.lock:
+                worker = {
+                    "worker": len(self.workers),
+                    "address": self.listener.last_accepted,
+                    "tiles": 0,
+                    "samples": 0,
+                    "busy": 0.0,
+                }
+                self.workers.append(worker)
+            threading.Thread(
+                target=self.serve_worker,
+                args=(conn, worker, scheduler, image, sample_counts, finished),
+                daemon=True,
+            ).start()
+
+    def serve_worker(self, conn, worker, scheduler, image, sample_counts, finished):
+        tile = None
+        try:
+            conn.send_bytes(self.payload)
+            while True:
+                tile = scheduler.next_tile()
+                if tile is None:
+                    conn.send(None)
+                    return
+                conn.send(tile)
+                done, pixels, counts, samples, elapsed = conn.recv()
+                if done != tile:
+                    raise RuntimeError(f"Worker returned tile {done}, expected {tile}")
+                if scheduler.complete(tile, elapsed):
+                    self.store_tile(tile, pixels, counts, image, sample_counts)
+                    with self.lock:
+                        worker["tiles"] += 1
+                        worker["samples"] += samples
+                        worker["busy"] += elapsed
+                    finished.put(tile)
+                tile = None
+        except (EOFError, OSError, RuntimeError):
+            # The worker died or misbehaved; its tile goes back in the queue.
+            if tile is not None:
+                scheduler.release(tile)
+        finally:
+            conn.close()
+
+    @staticmethod
+    def store_tile(tile, pixels, counts, image, sample_counts):
+        xmin, ymin, xmax, ymax = tile
+        width = xmax - xmin
+        pixels = memoryview(pixels).cast("d")
+        counts = memoryview(counts).cast("d")
+        for k, y in enumerate(range(ymin, ymax)):
+            image.set_pixels(xmin, y, pixels[k * width * 3 : (k + 1) * width * 3])
+            sample_counts.set_pixels(xmin, y, counts[k * width : (k + 1) * width])
+
+    def close(self):
+        self.listener.close()
+
+
+def run_worker(address, authkey):
+    conn = Client(address, authkey=authkey)
+    try:
+        engine, scene = pickle.loads(conn.recv_bytes())
+        image = Image(scene.width, scene.height)
+        sample_counts = Image(scene.width, scene.height, channels=1)
+        tiles_done = 0
+        try:
+            while True:
+                try:
+                    tile = conn.recv()
+                except EOFError:
+                    # The coordinator finished without us, e.g. after handing
+                    # a tile we were slow on to another worker.
+                    tile = None
+                if tile is None:
+                    return tiles_done
+                start = time.perf_counter()
+                samples = engine.render_tile(scene, tile, image, sample_counts)
+                elapsed = time.perf_counter() - start
+                xmin, ymin, xmax, ymax = tile
+                pixels = b"".join(
+                    image.row(y)[xmin * 3 : xmax * 3] for y in range(ymin, ymax)
+                )
+                counts = b"".join(
+                    sample_counts.row(y)[xmin:xmax] for y in range(ymin, ymax)
+                )
+                conn.send((tile, pixels, counts, samples, elapsed))
+                tiles_done += 1
+        finally:
+            image.close()
+            sample_counts.close()
+    finally:
+        conn.close()
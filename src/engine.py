@@ -1,67 +1,331 @@
+import pickle
+import queue
 import random
-import shutil
-import tempfile
-from multiprocessing import Process, Value
-from pathlib import Path
+import time
 
 from color import Color
-from image import Image
+from denoise import AuxBuffers, PixelFeatures, denoise
+from executor import make_executor
+from image import Image, TileRowWriter
 from point import Point
+from progress import ConsoleBar, ProgressCounters, ProgressMonitor
 from ray import Ray
+from sampler import SAMPLERS, hash_seed
+from stats import RenderStats
+from tiles import make_tiles
 
 
 class RenderEngine:
     MAX_DEPTH = 5
     MIN_DISPLACE = 0.0001
 
-    def __init__(self, samples_per_pixel=32):
+    def __init__(
+        self,
+        samples_per_pixel=32,
+        tile_size=32,
+        tile_order="hilbert",
+        adaptive=False,
+        min_samples=4,
+        threshold=0.01,
+        collect_stats=False,
+        light_samples=0,
+        min_throughput=0.0,
+        russian_roulette=False,
+        sampler="sobol",
+        seed=0,
+        executor="process",
+        denoise=False,
+    ):
         self.samples_per_pixel = samples_per_pixel
+        self.tile_size = tile_size
+        self.tile_order = tile_order
+        self.adaptive = adaptive
+        self.min_samples = min_samples
+        self.threshold = threshold
+        self.collect_stats = collect_stats
+        self.light_samples = light_samples
+        self.min_throughput = min_throughput
+        self.russian_roulette = russian_roulette
+        self.sampler_name = sampler
+        self.seed = seed
+        self.make_sampler()
+        self.executor = executor
+        self.denoise = denoise
+        self.denoise_time = 0.0
+        # PixelFeatures of the pixel being rendered while aux buffers are
+        # filled; ray_trace adds each path's first hit to it.
+        self.features = None
+        # Reseeded by start_tile, so the jitter, light and roulette draws of
+        # a tile depend on the tile alone and not on the worker rendering it.
+        self.rng = random.Random(seed)
+        # Bounces left before MAX_DEPTH on paths cut short by min_throughput.
+        self.bounces_saved = 0
+        self.stats = None
+        self.last_occluder = {}
+        # Width of a pixel per unit of distance from the camera, so textures
+        # can pick a mip level from the hit distance.
+        self.pixel_spread = 0.0
 
-    def render_multiprocess(self, scene, processes_count, img_fileobj, raw=False):
-        def split_range(count, parts):
-            d, r = divmod(count, parts)
-            return [
-                (i * d + min(i, r), (i + 1) * d + min(i + 1, r)) for i in range(parts)
-            ]
+    def make_sampler(self):
+        # Samplers precompute their points from these, so changing any of
+        # them means a new sampler.
+        self.sampler = SAMPLERS[self.sampler_name](self.samples_per_pixel, self.seed)
 
-        width = scene.width
-        height = scene.height
-        ranges = split_range(height, processes_count)
-        temp_dir = tempfile.mkdtemp()
-        temp_files_tmpl = "render_part_{}.temp"
-        processes = []
+    def render_multiprocess(
+        self,
+        scene,
+        processes_count,
+        img_fileobj,
+        raw=False,
+        heatmap_fileobj=None,
+        tile_heatmap_fileobj=None,
+        checkpoint=None,
+        add_samples=False,
+        progress=None,
+        aux_fileobjs=None,
+    ):
+        # progress is a ProgressMonitor; by default a console bar is shown.
+        # aux_fileobjs maps aux buffer names to files to write them to, see
+        # AuxBuffers.write_pngs.
+        if progress is None:
+            progress = ProgressMonitor([ConsoleBar()])
+        aux = None
+        if self.denoise or aux_fileobjs:
+            if checkpoint is not None:
+                raise ValueError("Aux buffers and denoising do not support checkpoints")
+            aux = AuxBuffers(scene.width, scene.height)
+        tiles = make_tiles(scene.width, scene.height, self.tile_size, self.tile_order)
+        if checkpoint is None:
+            image = Image(scene.width, scene.height)
+            sample_counts = Image(scene.width, scene.height, channels=1)
+        else:
+            # Workers write straight into the checkpoint file, so the
+            # framebuffer outlives this call and a killed render can resume.
+            if not add_samples:
+                tiles = [tile for tile in tiles if not checkpoint.is_done(tile)]
+            image = checkpoint.image
+            sample_counts = checkpoint.sample_counts
+        total = sum((xmax - xmin) * (ymax - ymin) for xmin, ymin, xmax, ymax in tiles)
+        executor = make_executor(self.executor)
+        tile_queue = executor.queue()
+        result_queue = executor.queue()
         try:
-            rows_done = Value("i", 0)
-            for hmin, hmax in ranges:
-                part_file = Path(temp_dir) / temp_files_tmpl.format(hmin)
-                raw_output = Path(temp_dir) / f"raw_output.ppm"
-                processes.append(
-                    Process(
-                        target=self.render,
-                        args=(scene, hmin, hmax, part_file, rows_done),
-                    )
+            counters = ProgressCounters(processes_count)
+            for tile in tiles:
+                tile_queue.put(tile)
+            for worker_id in range(processes_count):
+                tile_queue.put(None)
+                executor.submit(
+                    self,
+                    (
+                        scene,
+                        image if checkpoint is None else None,
+                        sample_counts if checkpoint is None else None,
+                        checkpoint,
+                        tile_queue,
+                        result_queue,
+                        counters,
+                        worker_id,
+                        aux,
+                    ),
                 )
-            for p in processes:
-                p.start()
-            for p in processes:
-                p.join()
-            with open(raw_output, "w") as f:
-                Image.write_ppm_header(f, width=width, height=height)
-            for hmin, _ in ranges:
-                part_file = Path(temp_dir) / temp_files_tmpl.format(hmin)
-                with open(raw_output, "a") as f:
-                    f.write(open(part_file, "r").read())
-            if raw:
-                with open(raw_output, "r") as f:
-                    img_fileobj.write(f.read())
-            else:
-                Image.ppm2png(raw_output, img_fileobj)
+            writer = image.writer(img_fileobj, raw)
+            # A denoised image is only written once every tile is in.
+            rows = None if self.denoise else TileRowWriter(image, writer, tiles)
+            start = time.perf_counter()
+            try:
+                executor.launch(lambda: progress.start(counters, total))
+                workers = []
+                while len(workers) < processes_count:
+                    try:
+                        message = result_queue.get(timeout=1)
+                    except queue.Empty:
+                        # A worker killed outright, e.g. by the OOM killer,
+                        # never posts a result.
+                        if executor.failed():
+                            raise RuntimeError("A render worker exited unexpectedly")
+                        continue
+                    if isinstance(message, BaseException):
+                        raise message
+                    if isinstance(message, dict):
+                        workers.append(message)
+                    elif rows is not None:
+                        rows.tile_done(message)
+            finally:
+                progress.stop()
+            wall = time.perf_counter() - start
+            if self.denoise:
+                denoise_start = time.perf_counter()
+                denoise(image, aux)
+                self.denoise_time = time.perf_counter() - denoise_start
+                rows = TileRowWriter(image, writer, [])
+            rows.close()
+            if aux_fileobjs:
+                aux.write_pngs(aux_fileobjs)
+            executor.join()
+            if checkpoint is not None:
+                checkpoint.flush()
+            workers.sort(key=lambda w: w["worker"])
+            for worker in workers:
+                worker["utilization"] = worker["busy"] / wall if wall > 0 else 0.0
+            if self.collect_stats:
+                self.stats = RenderStats()
+                for worker in workers:
+                    self.stats.merge(worker.pop("stats"))
+                self.stats.times["png"] = rows.encode_time
+            if heatmap_fileobj is not None:
+                heatmap = Image.heatmap(sample_counts, self.samples_per_pixel)
+                try:
+                    heatmap.write_png(heatmap_fileobj)
+                finally:
+                    heatmap.close()
+            if tile_heatmap_fileobj is not None and self.collect_stats:
+                heatmap = self.stats.tile_heatmap(scene.width, scene.height)
+                try:
+                    heatmap.write_png(tile_heatmap_fileobj)
+                finally:
+                    heatmap.close()
+            return workers
         finally:
-            for p in processes:
-                p.terminate()
-            shutil.rmtree(temp_dir, ignore_errors=True)
+            executor.stop(tile_queue)
+            if checkpoint is None:
+                image.close()
+                sample_counts.close()
+            if aux is not None:
+                aux.close()
 
-    def render(self, scene, hmin, hmax, part_file, rows_done):
+    def render_worker(
+        self,
+        scene,
+        image,
+        sample_counts,
+        checkpoint,
+        tile_queue,
+        result_queue,
+        counters,
+        worker_id,
+        aux=None,
+    ):
+        # Whatever a worker raises goes to the caller, which re-raises it,
+        # instead of leaving it waiting for this worker's result.
+        try:
+            self.render_tiles(
+                scene,
+                image,
+                sample_counts,
+                checkpoint,
+                tile_queue,
+                result_queue,
+                counters,
+                worker_id,
+                aux,
+            )
+        except BaseException as e:
+            try:
+                pickle.dumps(e)
+            except Exception:
+                # A process queue would drop it and the caller would wait.
+                e = RuntimeError(f"{type(e).__name__}: {e}")
+            result_queue.put(e)
+
+    def render_tiles(
+        self,
+        scene,
+        image,
+        sample_counts,
+        checkpoint,
+        tile_queue,
+        result_queue,
+        counters,
+        worker_id,
+        aux=None,
+    ):
+        start = time.perf_counter()
+        busy = 0.0
+        tiles_done = 0
+        samples = 0
+        if checkpoint is not None:
+            image = checkpoint.image
+            sample_counts = checkpoint.sample_counts
+        stats = None
+        if self.collect_stats:
+            stats = RenderStats()
+            stats.instrument(self, scene, image)
+        while True:
+            tile = tile_queue.get()
+            if tile is None:
+                break
+            tile_start = time.perf_counter()
+            if checkpoint is None:
+                tile_samples = self.render_tile(
+                    scene, tile, image, sample_counts, aux=aux
+                )
+            else:
+                tile_samples = self.render_checkpoint_tile(scene, tile, checkpoint)
+            samples += tile_samples
+            elapsed = time.perf_counter() - tile_start
+            busy += elapsed
+            if stats is not None:
+                stats.add_tile(tile, elapsed)
+            tiles_done += 1
+            result_queue.put(tile)
+            xmin, ymin, xmax, ymax = tile
+            counters.add(worker_id, (xmax - xmin) * (ymax - ymin), tile_samples)
+        result = {
+            "worker": worker_id,
+            "tiles": tiles_done,
+            "samples": samples,
+            "busy": busy,
+            "wall": time.perf_counter() - start,
+            "bounces_saved": self.bounces_saved,
+        }
+        if stats is not None:
+            stats.finish_worker()
+            result["stats"] = stats
+        result_queue.put(result)
+
+    def render_checkpoint_tile(self, scene, tile, checkpoint):
+        image = checkpoint.image
+        sample_counts = checkpoint.sample_counts
+        if not checkpoint.is_done(tile):
+            samples = self.render_tile(scene, tile, image, sample_counts)
+            checkpoint.mark(tile, True)
+            return samples
+        xmin, ymin, xmax, ymax = tile
+        first_sample = int(
+            max(
+                sample_counts.pixels[j * image.width + i]
+                for j in range(ymin, ymax)
+                for i in range(xmin, xmax)
+            )
+        )
+        previous = [
+            (image.get_pixel(i, j), sample_counts.pixels[j * image.width + i])
+            for j in range(ymin, ymax)
+            for i in range(xmin, xmax)
+        ]
+        # Until the merge below is complete the tile's pixels hold only the
+        # new samples, so a render killed in between starts the tile over.
+        checkpoint.mark(tile, False)
+        # The new samples continue the sequences where the finished ones
+        # stopped instead of repeating them.
+        samples = self.render_tile(scene, tile, image, sample_counts, first_sample)
+        k = 0
+        for j in range(ymin, ymax):
+            for i in range(xmin, xmax):
+                old_color, old_count = previous[k]
+                k += 1
+                index = j * image.width + i
+                count = sample_counts.pixels[index]
+                color = image.get_pixel(i, j).iscale(count)
+                color.iadd_scaled(old_color, old_count)
+                image.set_pixel(i, j, color.iscale(1.0 / (old_count + count)))
+                sample_counts.pixels[index] = old_count + count
+        checkpoint.mark(tile, True)
+        return samples
+
+    @staticmethod
+    def screen(scene):
         width = scene.width
         height = scene.height
         aspect_ratio = width / height
@@ -71,92 +335,177 @@ class RenderEngine:
         y0 = -1 / aspect_ratio
         y1 = 1 / aspect_ratio
         ystep = (y1 - y0) / (height - 1)
+        return (x0, y0, xstep, ystep)
+
+    def start_tile(self, tile, first_sample=0):
+        xmin, ymin, _, _ = tile
+        self.rng.seed(hash_seed(self.seed, xmin, ymin, first_sample))
+
+    def render_tile(self, scene, tile, image, sample_counts, first_sample=0, aux=None):
+        x0, y0, xstep, ystep = self.screen(scene)
+        xmin, ymin, xmax, ymax = tile
         camera = scene.camera
-        pixels = Image(width, hmax - hmin)
-        for j in range(hmin, hmax):
+        self.pixel_spread = xstep / max(abs(camera.z), self.MIN_DISPLACE)
+        self.start_tile(tile, first_sample)
+        sampler = self.sampler
+        if aux is not None:
+            self.features = PixelFeatures(scene)
+        total = 0
+        for j in range(ymin, ymax):
             y = y0 + j * ystep
-            for i in range(width):
+            for i in range(xmin, xmax):
                 x = x0 + i * xstep
-                pixel_color = Color(0, 0, 0)
                 if self.samples_per_pixel == 1:
-                    ray = Ray(camera, Point(x, y) - camera)
+                    ray = Ray(camera, camera.direction_to(Point(x, y)), normalized=True)
                     pixel_color = self.ray_trace(ray, scene)
+                    count = 1
+                elif self.adaptive:
+                    sampler.start_pixel(self.rng, i, j)
+                    pixel_color, count = self.sample_adaptive(
+                        scene, x, y, xstep, ystep, first_sample
+                    )
                 else:
-                    for _ in range(self.samples_per_pixel):
-                        jitter_x = x + random.uniform(-0.5, 0.5) * xstep
-                        jitter_y = y + random.uniform(-0.5, 0.5) * ystep
-                        ray = Ray(camera, Point(jitter_x, jitter_y) - camera)
-                        pixel_color += self.ray_trace(ray, scene)
-                pixel_color *= 1.0 / self.samples_per_pixel
-                pixels.set_pixel(i, j - hmin, pixel_color)
-            with rows_done.get_lock():
-                rows_done.value += 1
-                print(
-                    f"\rProcess: [{('#' * int(float(rows_done.value) / float(height) * 50)).ljust(50, '.')}"
-                    f"] {float(rows_done.value) / float(height) * 100:5.2f}%",
-                    end="",
-                )
-                if (
-                    float(f"{float(rows_done.value) / float(height) * 100:5.2f}")
-                    == 100.00
-                ):
-                    print()
-        with open(part_file, "w") as f:
-            pixels.write_ppm_raw(f)
+                    sampler.start_pixel(self.rng, i, j)
+                    pixel_color = Color(0, 0, 0)
+                    for index in range(
+                        first_sample, first_sample + self.samples_per_pixel
+                    ):
+                        pixel_color.iadd(self.sample(scene, x, y, xstep, ystep, index))
+                    pixel_color.iscale(1.0 / self.samples_per_pixel)
+                    count = self.samples_per_pixel
+                image.set_pixel(i, j, pixel_color)
+                sample_counts.pixels[j * sample_counts.width + i] = count
+                total += count
+                if aux is not None:
+                    self.features.store(aux, i, j)
+        self.features = None
+        return total
+
+    def sample(self, scene, x, y, xstep, ystep, index):
+        # index is the sample's position in the pixel's sequence, started by
+        # sampler.start_pixel.
+        camera = scene.camera
+        u, v = self.sampler.get(index)
+        jitter_x = x + (u - 0.5) * xstep
+        jitter_y = y + (v - 0.5) * ystep
+        ray = Ray(
+            camera, camera.direction_to(Point(jitter_x, jitter_y)), normalized=True
+        )
+        color = self.ray_trace(ray, scene)
+        if self.features is not None:
+            self.features.add_color(color)
+        return color
 
-    def ray_trace(self, ray, scene, depth=0):
+    def sample_adaptive(self, scene, x, y, xstep, ystep, first_sample=0):
+        mean = Color(0, 0, 0)
+        m2 = Color(0, 0, 0)
+        count = 0
+        batch = min(self.min_samples, self.samples_per_pixel)
+        while batch > 0:
+            for _ in range(batch):
+                color = self.sample(scene, x, y, xstep, ystep, first_sample + count)
+                count += 1
+                delta = color - mean
+                mean.iadd_scaled(delta, 1.0 / count)
+                m2.iadd_product(delta, color - mean, 1.0)
+            if count > 1:
+                error = max(m2.x, m2.y, m2.z) / (count - 1) / count
+                if error <= self.threshold * self.threshold:
+                    break
+            batch = min(self.min_samples, self.samples_per_pixel - count)
+        return (mean, count)
+
+    def ray_trace(self, ray, scene):
+        # Follows the reflection path iteratively, carrying the product of
+        # the reflection coefficients so far. Once it drops below
+        # min_throughput the path ends, or with russian_roulette survives
+        # with probability throughput / min_throughput and is weighted up to
+        # min_throughput, which keeps the estimate unbiased.
         color = Color(0, 0, 0)
-        dist_hit, obj_hit = self.find_nearest(ray, scene)
-        if obj_hit is None:
-            return color
-        hit_pos = ray.origin + ray.direction * dist_hit
-        hit_normal = obj_hit.normal(hit_pos)
-        color += self.color_at(obj_hit, hit_pos, hit_normal, scene)
-        if depth < self.MAX_DEPTH:
-            new_ray_pos = hit_pos + hit_normal * self.MIN_DISPLACE
-            new_ray_dir = (
-                ray.direction - 2 * ray.direction.dot_product(hit_normal) * hit_normal
-            )
-            new_ray = Ray(new_ray_pos, new_ray_dir)
-            color += (
-                self.ray_trace(new_ray, scene, depth + 1) * obj_hit.material.reflection
+        throughput = 1.0
+        for depth in range(self.MAX_DEPTH + 1):
+            hit = self.find_nearest(ray, scene)
+            if depth == 0 and self.features is not None:
+                self.features.add(hit, self.pixel_spread)
+            if hit is None:
+                break
+            color.iadd_scaled(self.color_at(hit, scene), throughput)
+            if depth == self.MAX_DEPTH:
+                break
+            throughput *= hit.material.reflection
+            if throughput < self.min_throughput:
+                if (
+                    not self.russian_roulette
+                    or self.rng.random() * self.min_throughput >= throughput
+                ):
+                    self.bounces_saved += self.MAX_DEPTH - depth
+                    break
+                throughput = self.min_throughput
+            ray = Ray(
+                hit.point.add_scaled(hit.normal, self.MIN_DISPLACE),
+                ray.direction.reflect(hit.normal),
+                normalized=True,
             )
         return color
 
     def find_nearest(self, ray, scene):
-        dist_min = None
-        obj_hit = None
-        for obj in scene.objects:
-            dist = obj.intersects(ray)
-            if dist is not None and (obj_hit is None or dist < dist_min):
-                dist_min = dist
-                obj_hit = obj
-        return (dist_min, obj_hit)
-
-    def color_at(self, obj_hit, hit_pos, normal, scene):
-        material = obj_hit.material
-        obj_color = material.color_at(hit_pos)
+        return scene.bvh.find_nearest(ray)
+
+    def occluded(self, ray, scene, max_dist, light_index):
+        last = self.last_occluder.get(light_index)
+        if last is not None and last.occludes(ray, max_dist):
+            return True
+        occluder = scene.bvh.occluded(ray, max_dist)
+        if occluder is None:
+            return False
+        self.last_occluder[light_index] = occluder
+        return True
+
+    def color_at(self, hit, scene):
+        material = hit.material
+        hit_pos = hit.point
+        normal = hit.normal
+        obj_color = material.color_at(
+            hit_pos, hit.uv, hit.distance * self.pixel_spread
+        )
         to_cam = scene.camera - hit_pos
         specular_k = 50
-        color = Color.from_hex("#000000")
-        for light in scene.lights:
-            color += material.ambient * obj_color * light.color
-            to_light = Ray(hit_pos, light.position - hit_pos)
-            shadow_ray = Ray(
-                hit_pos + normal * self.MIN_DISPLACE, light.position - hit_pos
-            )
-            dist_to_light, _ = self.find_nearest(shadow_ray, scene)
-            if dist_to_light is not None and dist_to_light < to_light.length():
+        color = Color(0, 0, 0)
+        shadow_origin = hit_pos.add_scaled(normal, self.MIN_DISPLACE)
+        lights = scene.lights
+        sampled = 0 < self.light_samples < len(lights)
+        if sampled:
+            # A few lights drawn by power, each weighted by the inverse of its
+            # probability, stand in for all of them.
+            sampler = scene.light_sampler
+            color.iadd_product(obj_color, sampler.ambient, material.ambient)
+            chosen = []
+            for _ in range(self.light_samples):
+                light_index = sampler.sample(self.rng.random())
+                chosen.append(
+                    (light_index, 1.0 / (self.light_samples * sampler.pdf[light_index]))
+                )
+        else:
+            chosen = [(light_index, 1.0) for light_index in range(len(lights))]
+        for light_index, weight in chosen:
+            light = lights[light_index]
+            if not sampled:
+                color.iadd_product(obj_color, light.color, material.ambient)
+            to_light = hit_pos.direction_to(light.position)
+            shadow_ray = Ray(shadow_origin, to_light, normalized=True)
+            # Only what lies between the surface and the light casts a shadow.
+            light_dist = hit_pos.distance_to(light.position)
+            if self.occluded(shadow_ray, scene, light_dist, light_index):
                 continue
-            color += (
-                obj_color
-                * material.diffuse
-                * max(normal.dot_product(to_light.direction), 0)
+            color.iadd_scaled(
+                obj_color,
+                weight * material.diffuse * max(normal.dot_product(to_light), 0),
             )
-            half_vector = (to_light.direction + to_cam).normalize()
-            color += (
-                light.color
+            half_vector = (to_light + to_cam).inormalize()
+            color.iadd_scaled(
+                light.color,
+                weight
                 * material.specular
-                * max(normal.dot_product(half_vector), 0) ** specular_k
+                * max(normal.dot_product(half_vector), 0) ** specular_k,
             )
         return color
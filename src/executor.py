@@ -0,0 +1,132 @@
+import copy
+import multiprocessing
+import queue
+import threading
+
+# Every executor runs engine.render_worker as its workers' entry point; it
+# puts anything a worker raises on the result queue for the caller to
+# re-raise, whether the worker is a process, a thread or inline.
+EXECUTORS = ("process", "thread", "inline")
+
+
+class ProcessExecutor:
+    # One process per worker. Each gets its own copy of the engine and scene
+    # by fork or pickling; framebuffers and progress counters are shared
+    # memory.
+
+    def __init__(self):
+        self.workers = []
+
+    def queue(self):
+        return multiprocessing.Queue()
+
+    def submit(self, engine, args):
+        self.workers.append(
+            multiprocessing.Process(target=engine.render_worker, args=args)
+        )
+
+    def launch(self, started):
+        for worker in self.workers:
+            worker.start()
+        # Called after the fork so no worker inherits a lock held by the
+        # caller's threads.
+        started()
+
+    def join(self):
+        for worker in self.workers:
+            worker.join()
+
+    def failed(self):
+        # Workers that raise exit normally once the error is posted.
+        return any(worker.exitcode not in (None, 0) for worker in self.workers)
+
+    def stop(self, tile_queue):
+        for worker in self.workers:
+            worker.terminate()
+
+
+class ThreadExecutor:
+    # One thread per worker, sharing the scene and framebuffers in memory:
+    # no startup copies, and on free-threaded builds the workers run in
+    # parallel. Each thread renders with its own copy of the engine, whose
+    # samplers and caches are per-worker state.
+
+    def __init__(self):
+        self.workers = []
+
+    def queue(self):
+        return queue.Queue()
+
+    def submit(self, engine, args):
+        if engine.collect_stats:
+            # Stats wrap the methods of the objects they count, which the
+            # threads share.
+            raise ValueError("Render statistics need the process or inline executor")
+        self.workers.append(
+            threading.Thread(
+                target=copy.deepcopy(engine).render_worker, args=args, daemon=True
+            )
+        )
+
+    def launch(self, started):
+        started()
+        for worker in self.workers:
+            worker.start()
+
+    def join(self):
+        for worker in self.workers:
+            worker.join()
+
+    def failed(self):
+        # A thread cannot die without render_worker posting what it raised.
+        return False
+
+    def stop(self, tile_queue):
+        # Threads cannot be killed; replacing the tiles left with one None
+        # per worker makes every worker finish after its current tile, which
+        # is waited for so the caller can release the framebuffers.
+        while True:
+            try:
+                tile_queue.get_nowait()
+            except queue.Empty:
+                break
+        for _ in self.workers:
+            tile_queue.put(None)
+        for worker in self.workers:
+            if worker.is_alive():
+                worker.join()
+
+
+class InlineExecutor(ThreadExecutor):
+    # Renders in the calling thread, one worker at a time, so profilers and
+    # debuggers see the whole render.
+
+    def submit(self, engine, args):
+        # Copies, as a process would get, so rendering and stats leave the
+        # caller's engine and scene as they were.
+        engine = copy.deepcopy(engine)
+        if engine.collect_stats:
+            args = (copy.deepcopy(args[0]),) + args[1:]
+        self.workers.append((engine, args))
+
+    def launch(self, started):
+        started()
+        for engine, args in self.workers:
+            engine.render_worker(*args)
+
+    def join(self):
+        pass
+
+    def stop(self, tile_queue):
+        # Every worker has returned by the time launch does.
+        pass
+
+
+def make_executor(name):
+    if name == "process":
+        return ProcessExecutor()
+    if name == "thread":
+        return ThreadExecutor()
+    if name == "inline":
+        return InlineExecutor()
+    raise ValueError(f"Executor must be one of: {', '.join(EXECUTORS)}")
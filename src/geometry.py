@@ -1,8 +1,23 @@
 import math
 
+from hit import Hit
 from point import Point
 from vector import Vector
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+BOX_NORMALS = {
+    1: Vector(1, 0, 0),
+    -1: Vector(-1, 0, 0),
+    2: Vector(0, 1, 0),
+    -2: Vector(0, -1, 0),
+    3: Vector(0, 0, 1),
+    -3: Vector(0, 0, -1),
+}
+
 
 class Sphere:
     def __init__(self, center, radius, material):
@@ -11,9 +26,14 @@ class Sphere:
         self.material = material
 
     def intersects(self, ray):
-        sphere_to_ray = ray.origin - self.center
-        b = 2 * ray.direction.dot_product(sphere_to_ray)
-        c = sphere_to_ray.dot_product(sphere_to_ray) - self.radius * self.radius
+        origin = ray.origin
+        direction = ray.direction
+        center = self.center
+        sx = origin.x - center.x
+        sy = origin.y - center.y
+        sz = origin.z - center.z
+        b = 2 * (direction.x * sx + direction.y * sy + direction.z * sz)
+        c = sx * sx + sy * sy + sz * sz - self.radius * self.radius
         discriminant = b * b - 4 * c
         if discriminant >= 0:
             dist = (-b - math.sqrt(discriminant)) / 2
@@ -21,8 +41,40 @@ class Sphere:
                 return dist
         return None
 
-    def normal(self, surface_point):
-        return (surface_point - self.center).normalize()
+    def hit(self, ray, max_dist=float("inf")):
+        dist = self.intersects(ray)
+        if dist is None or dist >= max_dist:
+            return None
+        point = ray.at(dist)
+        normal = self.center.direction_to(point)
+        # Longitude and latitude; v runs from the top of the sphere (-y).
+        uv = (
+            0.5 + math.atan2(normal.z, normal.x) / (2 * math.pi),
+            0.5 + math.asin(max(-1.0, min(1.0, normal.y))) / math.pi,
+        )
+        return Hit(dist, point, normal, self, uv=uv)
+
+    def occludes(self, ray, max_dist):
+        dist = self.intersects(ray)
+        return dist is not None and dist < max_dist
+
+    def bounds(self):
+        extent = Vector(self.radius, self.radius, self.radius)
+        return (self.center - extent, self.center + extent)
+
+    def intersects_packet(self, origins, directions):
+        center = np.array(tuple(self.center))
+        sphere_to_ray = origins - center
+        b = 2 * np.einsum("ij,ij->i", directions, sphere_to_ray)
+        c = np.einsum("ij,ij->i", sphere_to_ray, sphere_to_ray) - self.radius**2
+        discriminant = b * b - 4 * c
+        dist = (-b - np.sqrt(np.maximum(discriminant, 0))) / 2
+        return np.where((discriminant >= 0) & (dist > 0), dist, np.inf)
+
+    def normal_packet(self, surface_points):
+        center = np.array(tuple(self.center))
+        normals = surface_points - center
+        return normals / np.linalg.norm(normals, axis=1)[:, None]
 
 
 class Rectangle:
@@ -36,23 +88,74 @@ class Rectangle:
         self.right = self.normal_vector.cross_product(self.u).normalize()
         self.up = self.right.cross_product(self.normal_vector)
 
-    def intersects(self, ray):
-        denom = ray.direction.dot_product(self.normal_vector)
+    def project(self, ray, max_dist):
+        origin = ray.origin
+        direction = ray.direction
+        center = self.center
+        n = self.normal_vector
+        denom = direction.x * n.x + direction.y * n.y + direction.z * n.z
         if abs(denom) < 0.0001:
             return None
-        t = (self.center - ray.origin).dot_product(self.normal_vector) / denom
-        if t < 0:
+        lx = center.x - origin.x
+        ly = center.y - origin.y
+        lz = center.z - origin.z
+        t = (lx * n.x + ly * n.y + lz * n.z) / denom
+        if t < 0 or t >= max_dist:
             return None
-        hit_point = ray.origin + ray.direction * t
-        local_point = hit_point - self.center
-        right_proj = local_point.dot_product(self.right)
-        up_proj = local_point.dot_product(self.up)
+        lx = direction.x * t - lx
+        ly = direction.y * t - ly
+        lz = direction.z * t - lz
+        right = self.right
+        up = self.up
+        right_proj = lx * right.x + ly * right.y + lz * right.z
+        up_proj = lx * up.x + ly * up.y + lz * up.z
         if abs(right_proj) <= self.width / 2 and abs(up_proj) <= self.height / 2:
-            return t
+            return (t, right_proj, up_proj)
         return None
 
-    def normal(self, _):
-        return self.normal_vector
+    def intersects(self, ray):
+        projection = self.project(ray, float("inf"))
+        return projection[0] if projection else None
+
+    def hit(self, ray, max_dist=float("inf")):
+        projection = self.project(ray, max_dist)
+        if projection is None:
+            return None
+        t, right_proj, up_proj = projection
+        uv = (right_proj / self.width + 0.5, up_proj / self.height + 0.5)
+        return Hit(t, ray.at(t), self.normal_vector, self, uv=uv)
+
+    def occludes(self, ray, max_dist):
+        return self.project(ray, max_dist) is not None
+
+    def bounds(self):
+        half_right = self.right * (self.width / 2)
+        half_up = self.up * (self.height / 2)
+        extent = Vector(
+            abs(half_right.x) + abs(half_up.x),
+            abs(half_right.y) + abs(half_up.y),
+            abs(half_right.z) + abs(half_up.z),
+        )
+        return (self.center - extent, self.center + extent)
+
+    def intersects_packet(self, origins, directions):
+        normal = np.array(tuple(self.normal_vector))
+        center = np.array(tuple(self.center))
+        right = np.array(tuple(self.right))
+        up = np.array(tuple(self.up))
+        denom = directions @ normal
+        valid = np.abs(denom) >= 0.0001
+        with np.errstate(divide="ignore", invalid="ignore"):
+            t = ((center - origins) @ normal) / denom
+        valid &= t >= 0
+        local_points = origins + directions * np.where(valid, t, 0)[:, None] - center
+        valid &= np.abs(local_points @ right) <= self.width / 2
+        valid &= np.abs(local_points @ up) <= self.height / 2
+        return np.where(valid, t, np.inf)
+
+    def normal_packet(self, surface_points):
+        normal = np.array(tuple(self.normal_vector))
+        return np.broadcast_to(normal, surface_points.shape)
 
 
 class Box:
@@ -62,78 +165,109 @@ class Box:
         self.height = height
         self.depth = depth
         self.material = material
-        self.faces = [
-            Rectangle(
-                Point(center.x, center.y, center.z - depth / 2),
-                width,
-                height,
-                Vector(0, 0, -1),
-                material,
-            ),
-            Rectangle(
-                Point(center.x, center.y, center.z + depth / 2),
-                width,
-                height,
-                Vector(0, 0, 1),
-                material,
-            ),
-            Rectangle(
-                Point(center.x - width / 2, center.y, center.z),
-                depth,
-                height,
-                Vector(-1, 0, 0),
-                material,
-            ),
-            Rectangle(
-                Point(center.x + width / 2, center.y, center.z),
-                depth,
-                height,
-                Vector(1, 0, 0),
-                material,
-            ),
-            Rectangle(
-                Point(center.x, center.y + height / 2, center.z),
-                width,
-                depth,
-                Vector(0, 1, 0),
-                material,
-            ),
-            Rectangle(
-                Point(center.x, center.y - height / 2, center.z),
-                width,
-                depth,
-                Vector(0, -1, 0),
-                material,
-            ),
-        ]
-        self._last_hit_face = None
+        self.min_corner = Point(
+            center.x - width / 2, center.y - height / 2, center.z - depth / 2
+        )
+        self.max_corner = Point(
+            center.x + width / 2, center.y + height / 2, center.z + depth / 2
+        )
+
+    def slab(self, ray):
+        # Returns the entry and exit distances with the signed axis (1, 2, 3
+        # for +x, +y, +z) of the outward normal of the face crossed at each.
+        origin = ray.origin
+        direction = ray.direction
+        lo = self.min_corner
+        hi = self.max_corner
+        t_near = float("-inf")
+        t_far = float("inf")
+        near_axis = far_axis = 0
+        for axis, o, d, a, b in (
+            (1, origin.x, direction.x, lo.x, hi.x),
+            (2, origin.y, direction.y, lo.y, hi.y),
+            (3, origin.z, direction.z, lo.z, hi.z),
+        ):
+            if d == 0:
+                if o < a or o > b:
+                    return None
+                continue
+            t0 = (a - o) / d
+            t1 = (b - o) / d
+            if d > 0:
+                if t0 > t_near:
+                    t_near = t0
+                    near_axis = -axis
+                if t1 < t_far:
+                    t_far = t1
+                    far_axis = axis
+            else:
+                if t1 > t_near:
+                    t_near = t1
+                    near_axis = axis
+                if t0 < t_far:
+                    t_far = t0
+                    far_axis = -axis
+            if t_near > t_far:
+                return None
+        if t_far < 0:
+            return None
+        return (t_near, near_axis, t_far, far_axis)
 
     def intersects(self, ray):
-        nearest = float("inf")
-        hit_face = None
-
-        for face in self.faces:
-            dist = face.intersects(ray)
-            if dist is not None and dist < nearest:
-                nearest = dist
-                hit_face = face
-
-        if hit_face:
-            self._last_hit_face = hit_face
-            return nearest
-        return None
+        slab = self.slab(ray)
+        if slab is None:
+            return None
+        return slab[0] if slab[0] >= 0 else slab[2]
+
+    def hit(self, ray, max_dist=float("inf")):
+        slab = self.slab(ray)
+        if slab is None:
+            return None
+        t_near, near_axis, t_far, far_axis = slab
+        t, axis = (t_near, near_axis) if t_near >= 0 else (t_far, far_axis)
+        if t >= max_dist:
+            return None
+        point = ray.at(t)
+        return Hit(t, point, BOX_NORMALS[axis], self, uv=self.face_uv(point, axis))
+
+    def face_uv(self, point, axis):
+        # Each face is mapped over its own extent, across the two axes it
+        # spans.
+        lo = self.min_corner
+        if axis in (1, -1):
+            return ((point.z - lo.z) / self.depth, (point.y - lo.y) / self.height)
+        if axis in (2, -2):
+            return ((point.x - lo.x) / self.width, (point.z - lo.z) / self.depth)
+        return ((point.x - lo.x) / self.width, (point.y - lo.y) / self.height)
 
-    def normal(self, surface_point):
-        if self._last_hit_face:
-            return self._last_hit_face.normal_vector
+    def occludes(self, ray, max_dist):
+        dist = self.intersects(ray)
+        return dist is not None and dist < max_dist
 
-        nearest_face = None
-        min_dist = float("inf")
+    def bounds(self):
+        return (self.min_corner, self.max_corner)
 
-        for face in self.faces:
-            dist = abs((surface_point - face.center).dot_product(face.normal_vector))
-            if dist < min_dist:
-                min_dist = dist
-                nearest_face = face
+    def intersects_packet(self, origins, directions):
+        lo = np.array(tuple(self.min_corner))
+        hi = np.array(tuple(self.max_corner))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            t0 = (lo - origins) / directions
+            t1 = (hi - origins) / directions
+        inside = (origins >= lo) & (origins <= hi)
+        parallel = directions == 0
+        t0 = np.where(parallel, np.where(inside, -np.inf, np.inf), t0)
+        t1 = np.where(parallel, np.where(inside, np.inf, -np.inf), t1)
+        t_near = np.minimum(t0, t1).max(axis=1)
+        t_far = np.maximum(t0, t1).min(axis=1)
+        dist = np.where(t_near >= 0, t_near, t_far)
+        return np.where((t_near <= t_far) & (t_far >= 0), dist, np.inf)
 
-        return nearest_face.normal_vector if nearest_face else Vector(0, 1, 0)
+    def normal_packet(self, surface_points):
+        center = np.array(tuple(self.center))
+        half = np.array([self.width, self.height, self.depth]) / 2
+        local = (surface_points - center) / half
+        axis = np.argmax(np.abs(local), axis=1)
+        normals = np.zeros_like(surface_points)
+        rows = np.arange(len(surface_points))
+        normals[rows, axis] = np.sign(local[rows, axis])
+        return normals
@@ -0,0 +1,10 @@
+class Hit:
+    __slots__ = ("distance", "point", "normal", "obj", "material", "uv")
+
+    def __init__(self, distance, point, normal, obj, material=None, uv=None):
+        self.distance = distance
+        self.point = point
+        self.normal = normal
+        self.obj = obj
+        self.material = obj.material if material is None else material
+        self.uv = uv
@@ -1,61 +1,138 @@
+import mmap
+import time
 import zlib
 import struct
+from multiprocessing import shared_memory
+
+from color import Color
+
+HEATMAP_COLORS = (
+    (0.0, 0.0, 0.5),
+    (0.0, 0.0, 1.0),
+    (0.0, 1.0, 1.0),
+    (0.0, 1.0, 0.0),
+    (1.0, 1.0, 0.0),
+    (1.0, 0.0, 0.0),
+)
 
 
 class Image:
-    def __init__(self, width, height):
+    def __init__(self, width, height, channels=3):
         self.width = width
         self.height = height
-        self.pixels = [[None for _ in range(width)] for _ in range(height)]
+        self.channels = channels
+        self.shm = shared_memory.SharedMemory(
+            create=True, size=max(width * height * channels * 8, 8)
+        )
+        self.owner = True
+        self.mapping = None
+        self.pixels = self.shm.buf.cast("d")
+
+    def __getstate__(self):
+        return self.handle()
+
+    def __setstate__(self, state):
+        self.width, self.height, self.channels, name = state
+        self.owner = False
+        if isinstance(name, tuple):
+            # A region of a file, mapped shared so that writes from any
+            # process land in the file and survive the process being killed.
+            path, offset = name
+            with open(path, "r+b") as f:
+                self.mapping = mmap.mmap(f.fileno(), 0)
+            self.shm = None
+            self.location = name
+            size = self.width * self.height * self.channels * 8
+            self.pixels = memoryview(self.mapping)[offset : offset + size].cast("d")
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+            self.mapping = None
+            self.pixels = self.shm.buf.cast("d")
+
+    def handle(self):
+        name = self.shm.name if self.shm is not None else self.location
+        return (self.width, self.height, self.channels, name)
+
+    @classmethod
+    def attach(cls, handle):
+        image = cls.__new__(cls)
+        image.__setstate__(handle)
+        return image
+
+    @classmethod
+    def mapped(cls, path, offset, width, height, channels=3):
+        return cls.attach((width, height, channels, (path, offset)))
+
+    def close(self):
+        self.pixels.release()
+        if self.mapping is not None:
+            self.mapping.close()
+            return
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
 
     def set_pixel(self, x, y, color):
-        self.pixels[y][x] = color
+        i = (y * self.width + x) * self.channels
+        self.pixels[i] = color.x
+        self.pixels[i + 1] = color.y
+        self.pixels[i + 2] = color.z
+
+    def get_pixel(self, x, y):
+        i = (y * self.width + x) * self.channels
+        return Color(self.pixels[i], self.pixels[i + 1], self.pixels[i + 2])
+
+    def set_pixels(self, x, y, values):
+        i = (y * self.width + x) * self.channels
+        self.pixels[i : i + len(values)] = values
+
+    @classmethod
+    def heatmap(cls, values, vmax=None):
+        if vmax is None:
+            vmax = max(values.pixels)
+        heatmap = cls(values.width, values.height)
+        last = len(HEATMAP_COLORS) - 1
+        for i, value in enumerate(values.pixels):
+            t = min(max(value / vmax, 0.0), 1.0) * last if vmax > 0 else 0.0
+            k = min(int(t), last - 1)
+            f = t - k
+            low = HEATMAP_COLORS[k]
+            high = HEATMAP_COLORS[k + 1]
+            for c in range(3):
+                heatmap.pixels[i * 3 + c] = low[c] + (high[c] - low[c]) * f
+        return heatmap
 
-    def write_ppm(self, filename):
-        Image.write_ppm_header(filename, self.width, self.height)
-        self.write_ppm_raw(filename)
+    def row(self, y):
+        start = y * self.width * self.channels
+        return self.pixels[start : start + self.width * self.channels]
+
+    def row_bytes(self, y):
+        return bytes(
+            [255 if c >= 1 else 0 if c <= 0 else round(c * 255) for c in self.row(y)]
+        )
+
+    def write_ppm(self, im_fileobj):
+        Image.write_ppm_header(im_fileobj, width=self.width, height=self.height)
+        self.write_ppm_raw(im_fileobj)
 
     @staticmethod
     def write_ppm_header(im_fileobj, width=None, height=None):
-        im_fileobj.write(f"P3 {width} {height}\n255\n")
+        im_fileobj.write(f"P6 {width} {height}\n255\n".encode())
 
-    def write_ppm_raw(self, filename):
-        def to_byte(c):
-            return round(max(min(c * 255, 255), 0))
+    def write_ppm_raw(self, im_fileobj):
+        for y in range(self.height):
+            im_fileobj.write(self.row_bytes(y))
 
-        for row in self.pixels:
-            for color in row:
-                filename.write(
-                    f"{to_byte(color.x)} {to_byte(color.y)} {to_byte(color.z)} "
-                )
-            filename.write("\n")
+    def write_png(self, img_fileobj):
+        writer = PngWriter(img_fileobj, self.width, self.height)
+        for y in range(self.height):
+            writer.write_row(self.row_bytes(y))
+        writer.close()
 
-    @classmethod
-    def ppm2png(cls, ppm_file, img_fileobj):
-        try:
-            with open(ppm_file, "r") as f:
-                dimensions = f.readline().strip().split()
-                width, height = int(dimensions[1]), int(dimensions[2])
-                f.readline()
-                pixels = []
-                for line in f:
-                    pixels.extend(map(int, line.strip().split()))
-            png_header = b"\x89PNG\r\n\x1a\n"
-            img_fileobj.write(png_header)
-            ihdr_data = struct.pack(">IIBBBBB", width, height, 8, 6, 0, 0, 0)
-            img_fileobj.write(cls.create_png_chunk(b"IHDR", ihdr_data))
-            pixel_data = bytearray()
-            for y in range(height):
-                pixel_data.append(0)
-                for x in range(width):
-                    i = (y * width + x) * 3
-                    r, g, b = pixels[i : i + 3]
-                    pixel_data.extend([r, g, b, 255])
-            compressed_data = zlib.compress(pixel_data)
-            img_fileobj.write(cls.create_png_chunk(b"IDAT", compressed_data))
-            img_fileobj.write(cls.create_png_chunk(b"IEND", b""))
-        except Exception as e:
-            raise RuntimeError(f"Error converting PPM to PNG: {str(e)}")
+    def writer(self, img_fileobj, raw=False):
+        if raw:
+            return PpmWriter(img_fileobj, self.width, self.height)
+        return PngWriter(img_fileobj, self.width, self.height)
 
     @staticmethod
     def create_png_chunk(chunk_type, data):
@@ -64,3 +141,230 @@ class Image:
         crc = zlib.crc32(chunk[4:])
         chunk += struct.pack(">I", crc)
         return chunk
+
+
+class TileRowWriter:
+    # Feeds rows of a framebuffer to a PPM/PNG writer as soon as every tile
+    # covering them is done, so encoding overlaps with rendering.
+
+    def __init__(self, image, writer, tiles):
+        self.image = image
+        self.writer = writer
+        self.rows_pending = [0] * image.height
+        for xmin, ymin, xmax, ymax in tiles:
+            for y in range(ymin, ymax):
+                self.rows_pending[y] += xmax - xmin
+        self.next_row = 0
+        self.encode_time = 0.0
+        self.write_ready_rows()
+
+    def tile_done(self, tile):
+        xmin, ymin, xmax, ymax = tile
+        for y in range(ymin, ymax):
+            self.rows_pending[y] -= xmax - xmin
+        self.write_ready_rows()
+
+    def write_ready_rows(self):
+        start = time.perf_counter()
+        rows_pending = self.rows_pending
+        while self.next_row < self.image.height and not rows_pending[self.next_row]:
+            self.writer.write_row(self.image.row_bytes(self.next_row))
+            self.next_row += 1
+        self.encode_time += time.perf_counter() - start
+
+    def close(self):
+        start = time.perf_counter()
+        self.writer.close()
+        self.encode_time += time.perf_counter() - start
+
+
+class PpmWriter:
+    def __init__(self, img_fileobj, width, height):
+        self.fileobj = img_fileobj
+        Image.write_ppm_header(img_fileobj, width=width, height=height)
+
+    def write_row(self, row):
+        self.fileobj.write(row)
+
+    def close(self):
+        pass
+
+
+# Signed magnitude of a filtered byte, for the minimum-sum filter heuristic.
+FILTER_COST = bytes(i if i < 128 else 256 - i for i in range(256))
+
+
+class PngWriter:
+    # Encodes RGB rows one at a time: each row is filtered, fed to an
+    # incremental compressor, and flushed as an IDAT chunk once enough
+    # compressed data has built up, so only two rows are held at once.
+    IDAT_SIZE = 1 << 16
+
+    def __init__(self, img_fileobj, width, height, level=6, filters=True):
+        self.fileobj = img_fileobj
+        self.width = width
+        self.height = height
+        self.filters = filters
+        self.rows = 0
+        self.compressor = zlib.compressobj(level)
+        self.pending = bytearray()
+        size = width * 3
+        self.row_size = size
+        self.prev = 0
+        self.high = int.from_bytes(b"\x80" * size, "big")
+        self.low = int.from_bytes(b"\x7f" * size, "big")
+        self.even = int.from_bytes(b"\xfe" * size, "big")
+        try:
+            img_fileobj.write(b"\x89PNG\r\n\x1a\n")
+            ihdr_data = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+            img_fileobj.write(Image.create_png_chunk(b"IHDR", ihdr_data))
+        except Exception as e:
+            raise RuntimeError(f"Error writing PNG: {str(e)}")
+
+    def subtract(self, x, y):
+        # Byte-wise (x - y) mod 256 over whole rows packed into one integer.
+        high = self.high
+        return ((x | high) - (y & self.low)) ^ (((x ^ y) & high) ^ high)
+
+    def filter_row(self, row):
+        if not self.filters:
+            return b"\x00" + row
+        size = self.row_size
+        current = int.from_bytes(row, "big")
+        left = current >> 24
+        up = self.prev
+        self.prev = current
+        average = (left & up) + (((left ^ up) & self.even) >> 1)
+        best = row
+        best_type = 0
+        best_cost = sum(row.translate(FILTER_COST))
+        # Paeth is left out: it needs a per-byte choice that cannot be done
+        # on the packed rows, and costs more in pure python than it saves.
+        for filter_type, predictor in ((1, left), (2, up), (3, average)):
+            filtered = self.subtract(current, predictor).to_bytes(size, "big")
+            cost = sum(filtered.translate(FILTER_COST))
+            if cost < best_cost:
+                best, best_type, best_cost = filtered, filter_type, cost
+        return bytes((best_type,)) + best
+
+    def write_row(self, row):
+        try:
+            self.pending += self.compressor.compress(self.filter_row(row))
+            self.rows += 1
+            if len(self.pending) >= self.IDAT_SIZE:
+                self.flush_idat()
+        except Exception as e:
+            raise RuntimeError(f"Error writing PNG: {str(e)}")
+
+    def flush_idat(self):
+        if self.pending:
+            self.fileobj.write(Image.create_png_chunk(b"IDAT", bytes(self.pending)))
+            self.pending = bytearray()
+
+    def close(self):
+        if self.rows != self.height:
+            raise RuntimeError(
+                f"Error writing PNG: {self.rows} of {self.height} rows written"
+            )
+        try:
+            self.pending += self.compressor.flush()
+            self.flush_idat()
+            self.fileobj.write(Image.create_png_chunk(b"IEND", b""))
+        except Exception as e:
+            raise RuntimeError(f"Error writing PNG: {str(e)}")
+
+
+# Samples per pixel of each PNG colour type.
+PNG_CHANNELS = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}
+
+
+def read_png(fileobj):
+    # Decodes an 8-bit, non-interlaced PNG of any colour type into packed RGB
+    # rows; alpha is dropped. Returns (width, height, pixels).
+    if fileobj.read(8) != b"\x89PNG\r\n\x1a\n":
+        raise ValueError("Not a PNG file")
+    header = None
+    palette = b""
+    decompressor = zlib.decompressobj()
+    data = bytearray()
+    while True:
+        chunk_header = fileobj.read(8)
+        if len(chunk_header) < 8:
+            raise ValueError("Truncated PNG file")
+        length, chunk_type = struct.unpack(">I4s", chunk_header)
+        body = fileobj.read(length)
+        fileobj.read(4)
+        if chunk_type == b"IHDR":
+            header = struct.unpack(">IIBBBBB", body)
+        elif chunk_type == b"PLTE":
+            palette = body
+        elif chunk_type == b"IDAT":
+            data += decompressor.decompress(body)
+        elif chunk_type == b"IEND":
+            break
+    if header is None:
+        raise ValueError("PNG file has no IHDR chunk")
+    width, height, depth, color_type, _, _, interlace = header
+    if depth != 8 or interlace or color_type not in PNG_CHANNELS:
+        raise ValueError("Only 8-bit, non-interlaced PNG files are supported")
+    channels = PNG_CHANNELS[color_type]
+    stride = width * channels
+    if len(data) < (stride + 1) * height:
+        raise ValueError("Truncated PNG image data")
+    colors = [palette[i : i + 3] for i in range(0, len(palette), 3)]
+    pixels = bytearray()
+    prev = bytearray(stride)
+    for y in range(height):
+        start = y * (stride + 1)
+        row = unfilter_png_row(
+            data[start], data[start + 1 : start + 1 + stride], prev, channels
+        )
+        if color_type == 3:
+            pixels += b"".join([colors[i] for i in row])
+        elif channels < 3:
+            rgb = bytearray(width * 3)
+            rgb[0::3] = rgb[1::3] = rgb[2::3] = row[0::channels]
+            pixels += rgb
+        elif channels == 4:
+            rgb = bytearray(width * 3)
+            rgb[0::3] = row[0::4]
+            rgb[1::3] = row[1::4]
+            rgb[2::3] = row[2::4]
+            pixels += rgb
+        else:
+            pixels += row
+        prev = row
+    return (width, height, bytes(pixels))
+
+
+def unfilter_png_row(filter_type, row, prev, bpp):
+    size = len(row)
+    if filter_type == 1:
+        for i in range(bpp, size):
+            row[i] = (row[i] + row[i - bpp]) & 255
+    elif filter_type == 2:
+        for i in range(size):
+            row[i] = (row[i] + prev[i]) & 255
+    elif filter_type == 3:
+        for i in range(bpp):
+            row[i] = (row[i] + (prev[i] >> 1)) & 255
+        for i in range(bpp, size):
+            row[i] = (row[i] + ((row[i - bpp] + prev[i]) >> 1)) & 255
+    elif filter_type == 4:
+        for i in range(size):
+            a = row[i - bpp] if i >= bpp else 0
+            b = prev[i]
+            c = prev[i - bpp] if i >= bpp else 0
+            p = a + b - c
+            pa = abs(p - a)
+            pb = abs(p - b)
+            pc = abs(p - c)
+            if pa <= pb and pa <= pc:
+                row[i] = (row[i] + a) & 255
+            elif pb <= pc:
+                row[i] = (row[i] + b) & 255
+            else:
+                row[i] = (row[i] + c) & 255
+    elif filter_type != 0:
+        raise ValueError(f"Unknown PNG filter type {filter_type}")
+    return row
@@ -0,0 +1,156 @@
+import math
+
+from hit import Hit
+from point import Point
+from ray import Ray
+from vector import Vector
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+def transform_matrix(rotate, scale):
+    # Row-major 3x3 matrix that scales, then rotates about x, y and z in
+    # turn, by angles in degrees.
+    rx, ry, rz = (math.radians(angle) for angle in rotate)
+    cx, sx = math.cos(rx), math.sin(rx)
+    cy, sy = math.cos(ry), math.sin(ry)
+    cz, sz = math.cos(rz), math.sin(rz)
+    rotation = (
+        (cz * cy, cz * sy * sx - sz * cx, cz * sy * cx + sz * sx),
+        (sz * cy, sz * sy * sx + cz * cx, sz * sy * cx - cz * sx),
+        (-sy, cy * sx, cy * cx),
+    )
+    return tuple(row[c] * scale[c] for row in rotation for c in range(3))
+
+
+def invert(m):
+    a, b, c, d, e, f, g, h, i = m
+    det = a * (e * i - f * h) - b * (d * i - f * g) + c * (d * h - e * g)
+    if abs(det) < 1e-12:
+        raise ValueError("Instance transform must not be singular")
+    inv = 1.0 / det
+    return (
+        (e * i - f * h) * inv,
+        (c * h - b * i) * inv,
+        (b * f - c * e) * inv,
+        (f * g - d * i) * inv,
+        (a * i - c * g) * inv,
+        (c * d - a * f) * inv,
+        (d * h - e * g) * inv,
+        (b * g - a * h) * inv,
+        (a * e - b * d) * inv,
+    )
+
+
+class Instance:
+    # A shared prototype object placed by an affine transform: a point p of
+    # the prototype is at matrix * p + translate in the scene. Many instances
+    # can share one prototype, such as a mesh, so memory and what is pickled
+    # to each worker grow with the unique geometry rather than the object
+    # count. Rays are moved into the prototype's space, with directions
+    # renormalized and distances scaled back; normals go out through the
+    # inverse transpose. Hits report the instance as their object and its
+    # material, which defaults to the prototype's.
+
+    def __init__(
+        self, prototype, material=None, translate=(0, 0, 0), rotate=(0, 0, 0), scale=1
+    ):
+        if isinstance(scale, (int, float)):
+            scale = (scale, scale, scale)
+        self.prototype = prototype
+        self.material = prototype.material if material is None else material
+        self.translate = tuple(float(t) for t in translate)
+        self.matrix = transform_matrix(rotate, scale)
+        self.inverse = invert(self.matrix)
+
+    def local_ray(self, ray):
+        # The ray in the prototype's space, and the length there of one unit
+        # of distance along the scene ray.
+        m = self.inverse
+        tx, ty, tz = self.translate
+        origin = ray.origin
+        direction = ray.direction
+        ox = origin.x - tx
+        oy = origin.y - ty
+        oz = origin.z - tz
+        dx = m[0] * direction.x + m[1] * direction.y + m[2] * direction.z
+        dy = m[3] * direction.x + m[4] * direction.y + m[5] * direction.z
+        dz = m[6] * direction.x + m[7] * direction.y + m[8] * direction.z
+        scale = math.sqrt(dx * dx + dy * dy + dz * dz)
+        inv = 1.0 / scale
+        origin = Point(
+            m[0] * ox + m[1] * oy + m[2] * oz,
+            m[3] * ox + m[4] * oy + m[5] * oz,
+            m[6] * ox + m[7] * oy + m[8] * oz,
+        )
+        local = Ray(origin, Vector(dx * inv, dy * inv, dz * inv), normalized=True)
+        return (local, scale)
+
+    def world_normal(self, normal):
+        m = self.inverse
+        return Vector(
+            m[0] * normal.x + m[3] * normal.y + m[6] * normal.z,
+            m[1] * normal.x + m[4] * normal.y + m[7] * normal.z,
+            m[2] * normal.x + m[5] * normal.y + m[8] * normal.z,
+        ).inormalize()
+
+    def intersects(self, ray):
+        local, scale = self.local_ray(ray)
+        dist = self.prototype.intersects(local)
+        return dist / scale if dist is not None else None
+
+    def hit(self, ray, max_dist=float("inf")):
+        local, scale = self.local_ray(ray)
+        hit = self.prototype.hit(local, max_dist * scale)
+        if hit is None:
+            return None
+        dist = hit.distance / scale
+        return Hit(
+            dist,
+            ray.at(dist),
+            self.world_normal(hit.normal),
+            self,
+            self.material,
+            hit.uv,
+        )
+
+    def occludes(self, ray, max_dist):
+        local, scale = self.local_ray(ray)
+        return self.prototype.occludes(local, max_dist * scale)
+
+    def bounds(self):
+        lo, hi = self.prototype.bounds()
+        m = self.matrix
+        tx, ty, tz = self.translate
+        corners = []
+        for x in (lo.x, hi.x):
+            for y in (lo.y, hi.y):
+                for z in (lo.z, hi.z):
+                    corners.append(
+                        (
+                            m[0] * x + m[1] * y + m[2] * z + tx,
+                            m[3] * x + m[4] * y + m[5] * z + ty,
+                            m[6] * x + m[7] * y + m[8] * z + tz,
+                        )
+                    )
+        xs, ys, zs = zip(*corners)
+        return (Point(min(xs), min(ys), min(zs)), Point(max(xs), max(ys), max(zs)))
+
+    def intersects_packet(self, origins, directions):
+        inverse = np.array(self.inverse).reshape(3, 3)
+        local_origins = (origins - np.array(self.translate)) @ inverse.T
+        local_directions = directions @ inverse.T
+        scale = np.linalg.norm(local_directions, axis=1)
+        dist = self.prototype.intersects_packet(
+            local_origins, local_directions / scale[:, None]
+        )
+        return dist / scale
+
+    def normal_packet(self, surface_points):
+        inverse = np.array(self.inverse).reshape(3, 3)
+        local_points = (surface_points - np.array(self.translate)) @ inverse.T
+        normals = self.prototype.normal_packet(local_points) @ inverse
+        return normals / np.linalg.norm(normals, axis=1)[:, None]
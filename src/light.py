@@ -5,3 +5,47 @@ class Light:
     def __init__(self, position, color=Color.from_hex("#FFFFFF")):
         self.position = position
         self.color = color
+
+
+class LightSampler:
+    # Walker's alias table over the importance of the lights, so a light is
+    # drawn in constant time however many there are. Dividing a drawn light's
+    # contribution by its probability keeps the sum over all lights
+    # unbiased. The shading has no distance falloff and adds a diffuse term
+    # that does not scale with the light's color plus a specular term in it,
+    # so a light's importance is 1 plus its luminance: every light that
+    # contributes, black ones included, can be drawn.
+
+    def __init__(self, lights):
+        count = len(lights)
+        importances = [
+            1.0
+            + 0.2126 * light.color.x
+            + 0.7152 * light.color.y
+            + 0.0722 * light.color.z
+            for light in lights
+        ]
+        total = sum(importances)
+        self.pdf = [importance / total for importance in importances]
+        # The ambient term needs no shadow ray, so it is summed exactly.
+        self.ambient = Color(0, 0, 0)
+        for light in lights:
+            self.ambient.iadd(light.color)
+        self.probability = [1.0] * count
+        self.alias = list(range(count))
+        scaled = [p * count for p in self.pdf]
+        small = [i for i, p in enumerate(scaled) if p < 1.0]
+        large = [i for i, p in enumerate(scaled) if p >= 1.0]
+        while small and large:
+            low = small.pop()
+            high = large.pop()
+            self.probability[low] = scaled[low]
+            self.alias[low] = high
+            scaled[high] += scaled[low] - 1.0
+            (small if scaled[high] < 1.0 else large).append(high)
+
+    def sample(self, u):
+        # Maps u in [0, 1) to a light index.
+        x = u * len(self.alias)
+        i = min(int(x), len(self.alias) - 1)
+        return i if x - i < self.probability[i] else self.alias[i]
@@ -0,0 +1,189 @@
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+
+from color import Color
+from geometry import Box, Rectangle, Sphere
+from instance import Instance
+from light import Light
+from material import ChequeredMaterial, Material, MirrorMaterial, TextureMaterial
+from mesh import TriangleMesh
+from point import Point
+from scene import Scene
+from vector import Vector
+
+# Bump whenever the pickled layout of a Scene, its objects or its BVH changes,
+# so stale caches are rebuilt instead of loaded.
+CACHE_VERSION = 4
+
+MATERIALS = {
+    "material": Material,
+    "chequered": ChequeredMaterial,
+    "mirror": MirrorMaterial,
+    "texture": TextureMaterial.load,
+}
+GEOMETRY = {
+    "sphere": Sphere,
+    "box": Box,
+    "rectangle": Rectangle,
+    "mesh": TriangleMesh.load_obj,
+    "instance": Instance,
+}
+POINT_KEYS = ("center", "position")
+VECTOR_KEYS = ("normal",)
+COLOR_KEYS = ("color", "color1", "color2")
+PATH_KEYS = ("path",)
+
+
+def default_cache_dir():
+    root = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    return os.path.join(root, "pray")
+
+
+def convert(key, value, base_dir):
+    if key in PATH_KEYS:
+        return os.path.join(base_dir, value)
+    if key in POINT_KEYS:
+        return Point(*value)
+    if key in VECTOR_KEYS:
+        return Vector(*value)
+    if key in COLOR_KEYS:
+        return Color.from_hex(value)
+    return value
+
+
+def build(kinds, spec, what, base_dir="", **extra):
+    spec = dict(spec)
+    kind = spec.pop("type", None)
+    if kind not in kinds:
+        raise ValueError(
+            f"Unknown {what} type {kind!r}, expected one of {', '.join(kinds)}"
+        )
+    kwargs = {key: convert(key, value, base_dir) for key, value in spec.items()}
+    kwargs.update(extra)
+    try:
+        return kinds[kind](**kwargs)
+    except TypeError as e:
+        raise ValueError(f"Invalid {kind} {what}: {e}")
+
+
+def build_material(spec, materials, base_dir="", cache_dir=None):
+    if isinstance(spec, str):
+        if spec not in materials:
+            raise ValueError(f"Unknown material {spec!r}")
+        return materials[spec]
+    extra = {"cache_dir": cache_dir} if spec.get("type") == "texture" else {}
+    return build(MATERIALS, spec, "material", base_dir, **extra)
+
+
+def referenced_files(data, base_dir):
+    objects = list(data.get("objects", []))
+    objects += data.get("prototypes", {}).values()
+    specs = list(objects)
+    specs += data.get("materials", {}).values()
+    specs += [spec.get("material") for spec in objects]
+    return [
+        os.path.join(base_dir, spec["path"])
+        for spec in specs
+        if isinstance(spec, dict) and "path" in spec
+    ]
+
+
+def build_object(spec, materials, prototypes, base_dir="", cache_dir=None):
+    spec = dict(spec)
+    extra = {}
+    if spec.get("type") == "instance":
+        name = spec.pop("prototype", None)
+        if name not in prototypes:
+            raise ValueError(f"Unknown prototype {name!r}")
+        extra["prototype"] = prototypes[name]
+        # Instances default to their prototype's material.
+        if "material" in spec:
+            extra["material"] = build_material(
+                spec.pop("material"), materials, base_dir, cache_dir
+            )
+    else:
+        extra["material"] = build_material(
+            spec.pop("material"), materials, base_dir, cache_dir
+        )
+    if spec.get("type") == "mesh":
+        extra["cache_dir"] = cache_dir
+    return build(GEOMETRY, spec, "object", base_dir, **extra)
+
+
+def build_scene(data, base_dir="", cache_dir=None):
+    try:
+        materials = {
+            name: build_material(spec, {}, base_dir, cache_dir)
+            for name, spec in data.get("materials", {}).items()
+        }
+        # Prototypes are objects that are not in the scene themselves, only
+        # placed by instances; an instance may place an earlier prototype.
+        prototypes = {}
+        for name, spec in data.get("prototypes", {}).items():
+            prototypes[name] = build_object(
+                spec, materials, prototypes, base_dir, cache_dir
+            )
+        objects = [
+            build_object(spec, materials, prototypes, base_dir, cache_dir)
+            for spec in data["objects"]
+        ]
+        lights = [
+            Light(
+                Point(*spec["position"]), Color.from_hex(spec.get("color", "#FFFFFF"))
+            )
+            for spec in data["lights"]
+        ]
+        scene = Scene(
+            Vector(*data["camera"]),
+            objects,
+            lights,
+            int(data["width"]),
+            int(data["height"]),
+        )
+    except KeyError as e:
+        raise ValueError(f"Missing scene field {e}")
+    return scene
+
+
+def load_scene(path, cache_dir=None, use_cache=True):
+    with open(path, "rb") as f:
+        source = f.read()
+    base_dir = os.path.dirname(os.path.abspath(path))
+    cache_dir = cache_dir or default_cache_dir()
+    try:
+        data = json.loads(source)
+        # Files the scene refers to, such as meshes and textures, are part of
+        # the key so that editing them invalidates the cached scene.
+        digest = hashlib.sha256(source)
+        for referenced in referenced_files(data, base_dir):
+            with open(referenced, "rb") as f:
+                for block in iter(lambda: f.read(1 << 20), b""):
+                    digest.update(block)
+        digest.update(f"pray-scene-{CACHE_VERSION}".encode())
+        cache_path = os.path.join(cache_dir, digest.hexdigest())
+        if use_cache and os.path.exists(cache_path):
+            try:
+                with open(cache_path, "rb") as f:
+                    return pickle.load(f)
+            except Exception:
+                # Rebuilt rather than failing the render: e.g. a mesh cache file
+                # the scene points to was cleaned up, or the pickle refers to a
+                # module, class or attribute that has since been renamed.
+                pass
+        scene = build_scene(data, base_dir, cache_dir if use_cache else None)
+    except (OSError, ValueError) as e:
+        raise ValueError(f"Error: {path}: {e}")
+    base = os.path.splitext(os.path.basename(path))[0]
+    loaded = (scene, data.get("output", base + ".png"))
+    if use_cache:
+        # Written to a temporary file first so concurrent renders never read
+        # a half-written cache entry.
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(cache_path))
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump(loaded, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, cache_path)
+    return loaded
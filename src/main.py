@@ -1,15 +1,38 @@
 import argparse
+import contextlib
 import importlib
 import os
 from multiprocessing import cpu_count
 
+from checkpoint import Checkpoint, scene_fingerprint
+from distributed import Coordinator, parse_address
 from engine import RenderEngine
+from executor import EXECUTORS
+from loader import load_scene
+from preview import serve_preview
+from sampler import SAMPLERS
 from scene import Scene
+from tiles import TILE_ORDERS
+
+
+def read_scene(name, use_cache=True, reload=False):
+    # Returns the scene, its output file name and the file it was read from.
+    if name.endswith(".json"):
+        scene, rendered_img = load_scene(name, use_cache=use_cache)
+        return (scene, rendered_img, os.path.abspath(name))
+    mod = importlib.import_module(name)
+    if reload:
+        mod = importlib.reload(mod)
+    scene = Scene(mod.CAMERA, mod.OBJECTS, mod.LIGHTS, mod.WIDTH, mod.HEIGHT)
+    return (scene, mod.RENDERED_IMG, os.path.abspath(mod.__file__))
 
 
 def main():
     parser = argparse.ArgumentParser()
-    parser.add_argument("scene", help="Path to scene file (without .py extension)")
+    parser.add_argument(
+        "scene",
+        help="Scene module (without .py extension) or path to a .json scene file",
+    )
     parser.add_argument(
         "-s",
         "--samples",
@@ -24,12 +47,159 @@ def main():
         default=0,
         help="Number of processes to use (default: number of CPUs)",
     )
+    parser.add_argument(
+        "-e",
+        "--executor",
+        choices=EXECUTORS,
+        default="process",
+        help="Run local workers as processes, as threads sharing the scene (parallel "
+        "on free-threaded Python), or inline in this thread for profiling "
+        "(default: process)",
+    )
     parser.add_argument(
         "-r",
         "--raw",
         action="store_true",
         help="Output raw PPM instead of PNG",
     )
+    parser.add_argument(
+        "-b",
+        "--backend",
+        choices=["python", "numpy"],
+        default="python",
+        help="Trace rays one by one in python or as numpy packets (default: python)",
+    )
+    parser.add_argument(
+        "-t",
+        "--tile-size",
+        type=int,
+        default=32,
+        help="Width and height of the tiles handed to workers (default: 32)",
+    )
+    parser.add_argument(
+        "--tile-order",
+        choices=TILE_ORDERS,
+        default="hilbert",
+        help="Order in which tiles are queued (default: hilbert)",
+    )
+    parser.add_argument(
+        "-u",
+        "--utilization",
+        action="store_true",
+        help="Print per-worker utilization after rendering",
+    )
+    parser.add_argument(
+        "-a",
+        "--adaptive",
+        action="store_true",
+        help="Spend samples only where the per-pixel error is above the threshold",
+    )
+    parser.add_argument(
+        "--min-samples",
+        type=int,
+        default=4,
+        help="Samples per adaptive batch, and the minimum per pixel (default: 4)",
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.01,
+        help="Adaptive standard error threshold per color channel (default: 0.01)",
+    )
+    parser.add_argument(
+        "--light-samples",
+        type=int,
+        default=0,
+        help="Lights sampled by power per shading point instead of all of them "
+        "(default: 0, every light)",
+    )
+    parser.add_argument(
+        "--min-throughput",
+        type=float,
+        default=0.0,
+        help="End reflection paths whose weight falls below this (default: 0, "
+        "always trace to the maximum depth)",
+    )
+    parser.add_argument(
+        "--russian-roulette",
+        action="store_true",
+        help="Continue paths below --min-throughput at random instead of ending "
+        "them, without bias",
+    )
+    parser.add_argument(
+        "--sampler",
+        choices=SAMPLERS,
+        default="sobol",
+        help="Sequence the anti-aliasing samples of a pixel are drawn from "
+        "(default: sobol)",
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=0,
+        help="Seed of the samplers; a render is the same for a given seed "
+        "whatever the process count (default: 0)",
+    )
+    parser.add_argument(
+        "--denoise",
+        action="store_true",
+        help="Filter the finished image guided by first-hit normals, albedo, depth, "
+        "object ids and the variance of each pixel's samples",
+    )
+    parser.add_argument(
+        "--aux-buffers",
+        metavar="PREFIX",
+        help="Write the normal, albedo, depth and object id buffers to "
+        "PREFIX_normal.png, PREFIX_albedo.png, PREFIX_depth.png and PREFIX_id.png",
+    )
+    parser.add_argument(
+        "--heatmap",
+        help="Write a PNG heatmap of the samples taken per pixel to this file",
+    )
+    parser.add_argument(
+        "--stats",
+        action="store_true",
+        help="Print ray, intersection test and phase timing statistics",
+    )
+    parser.add_argument(
+        "--tile-heatmap",
+        help="Write a PNG heatmap of the render time per tile to this file",
+    )
+    parser.add_argument(
+        "--checkpoint",
+        help="Render into this checkpoint file so an interrupted render can resume",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Continue the render in --checkpoint, rendering only missing tiles",
+    )
+    parser.add_argument(
+        "--add-samples",
+        action="store_true",
+        help="With --resume, also add --samples more samples to finished tiles",
+    )
+    parser.add_argument(
+        "--listen",
+        metavar="HOST:PORT",
+        help="Render on remote workers (src/worker.py) connecting to this address",
+    )
+    parser.add_argument(
+        "--authkey",
+        default=os.environ.get("PRAY_AUTHKEY"),
+        help="Shared secret that workers must present (default: $PRAY_AUTHKEY)",
+    )
+    parser.add_argument(
+        "--preview",
+        metavar="HOST:PORT",
+        help="Serve a progressive live preview on this address instead of rendering "
+        "to a file; the render restarts when the scene file changes",
+    )
+    parser.add_argument(
+        "--no-scene-cache",
+        action="store_true",
+        help="Rebuild a .json scene instead of loading it from the scene cache",
+    )
     args = parser.parse_args()
     samples = args.samples
     process = args.process
@@ -40,18 +210,215 @@ def main():
         process = cpu_count()
     else:
         process = min(process, cpu_count())
+    if args.executor == "inline":
+        process = 1
     if samples < 1:
         raise ValueError("Error: samples must be at least 1")
-    mod = importlib.import_module(args.scene)
-    scene = Scene(mod.CAMERA, mod.OBJECTS, mod.LIGHTS, mod.WIDTH, mod.HEIGHT)
-    engine = RenderEngine(samples_per_pixel=samples)
-    os.chdir(os.path.dirname(os.path.abspath(mod.__file__)))
-    if raw:
-        with open(mod.RENDERED_IMG, "w") as img_file:
-            engine.render_multiprocess(scene, process, img_file, raw)
+    if args.tile_size < 1:
+        raise ValueError("Error: tile size must be at least 1")
+    if args.min_samples < 1:
+        raise ValueError("Error: min samples must be at least 1")
+    if args.threshold < 0:
+        raise ValueError("Error: threshold must be at least 0")
+    if args.light_samples < 0:
+        raise ValueError("Error: light samples must be at least 0")
+    if args.seed < 0:
+        raise ValueError("Error: seed must be at least 0")
+    if args.min_throughput < 0:
+        raise ValueError("Error: min throughput must be at least 0")
+    if args.russian_roulette and not args.min_throughput:
+        raise ValueError("Error: --russian-roulette requires --min-throughput above 0")
+    if args.resume and not args.checkpoint:
+        raise ValueError("Error: --resume requires --checkpoint")
+    if args.add_samples and not args.resume:
+        raise ValueError("Error: --add-samples requires --resume")
+    if args.checkpoint and args.seed >= 1 << 64:
+        raise ValueError("Error: --checkpoint supports seeds below 2^64")
+    if args.listen and not args.authkey:
+        raise ValueError("Error: --listen requires --authkey or $PRAY_AUTHKEY")
+    if args.listen and (args.checkpoint or args.stats or args.tile_heatmap):
+        raise ValueError(
+            "Error: --listen does not support --checkpoint, --stats or --tile-heatmap"
+        )
+    if args.executor == "thread" and (args.stats or args.tile_heatmap):
+        raise ValueError(
+            "Error: --executor thread does not support --stats or --tile-heatmap"
+        )
+    if (args.denoise or args.aux_buffers) and (
+        args.listen or args.checkpoint or args.preview
+    ):
+        raise ValueError(
+            "Error: --denoise and --aux-buffers do not support --listen, "
+            "--checkpoint or --preview"
+        )
+    if args.denoise and args.samples < 2:
+        # The variance guiding the filter is estimated from each pixel's
+        # samples.
+        raise ValueError("Error: --denoise requires at least 2 samples")
+    if args.preview and (args.listen or args.checkpoint or args.stats):
+        raise ValueError(
+            "Error: --preview does not support --listen, --checkpoint or --stats"
+        )
+    scene, rendered_img, scene_path = read_scene(
+        args.scene, use_cache=not args.no_scene_cache
+    )
+    scene_dir = os.path.dirname(scene_path)
+    if args.backend == "numpy":
+        for obj in scene.objects:
+            shape = obj
+            while hasattr(shape, "prototype"):
+                # An instance supports packets if what it places does.
+                shape = shape.prototype
+            if not hasattr(shape, "intersects_packet"):
+                raise ValueError(
+                    f"Error: the numpy backend does not support {type(shape).__name__}"
+                )
+            if not hasattr(obj.material, "color_at_packet"):
+                raise ValueError(
+                    "Error: the numpy backend does not support "
+                    f"{type(obj.material).__name__}"
+                )
+        try:
+            from packet import PacketRenderEngine
+        except ImportError:
+            raise ValueError("Error: the numpy backend requires numpy to be installed")
+        engine_cls = PacketRenderEngine
     else:
-        with open(mod.RENDERED_IMG, "wb") as img_file:
-            engine.render_multiprocess(scene, process, img_file, raw)
+        engine_cls = RenderEngine
+    engine = engine_cls(
+        samples_per_pixel=samples,
+        tile_size=args.tile_size,
+        tile_order=args.tile_order,
+        adaptive=args.adaptive,
+        min_samples=args.min_samples,
+        threshold=args.threshold,
+        collect_stats=args.stats or bool(args.tile_heatmap),
+        light_samples=args.light_samples,
+        min_throughput=args.min_throughput,
+        russian_roulette=args.russian_roulette,
+        sampler=args.sampler,
+        seed=args.seed,
+        executor=args.executor,
+        denoise=args.denoise,
+    )
+    heatmap = os.path.abspath(args.heatmap) if args.heatmap else None
+    tile_heatmap = os.path.abspath(args.tile_heatmap) if args.tile_heatmap else None
+    checkpoint_path = os.path.abspath(args.checkpoint) if args.checkpoint else None
+    aux_prefix = os.path.abspath(args.aux_buffers) if args.aux_buffers else None
+    os.chdir(scene_dir)
+    if args.preview:
+        scene_name = scene_path if args.scene.endswith(".json") else args.scene
+        serve_preview(
+            engine,
+            scene,
+            lambda: read_scene(scene_name, not args.no_scene_cache, reload=True)[0],
+            scene_path,
+            process,
+            parse_address(args.preview),
+        )
+        return
+    with contextlib.ExitStack() as stack:
+        checkpoint = None
+        if args.resume:
+            checkpoint = Checkpoint.open(checkpoint_path)
+            stack.callback(checkpoint.close)
+            if (checkpoint.width, checkpoint.height) != (scene.width, scene.height):
+                raise ValueError(
+                    f"Error: checkpoint is for a {checkpoint.width}x"
+                    f"{checkpoint.height} render, the scene is "
+                    f"{scene.width}x{scene.height}"
+                )
+            # Resumed tiles must continue the same sample sequences over the
+            # same scene, or the checkpoint mixes two different renders.
+            if checkpoint.samples_per_pixel != engine.samples_per_pixel:
+                raise ValueError(
+                    f"Error: checkpoint is for {checkpoint.samples_per_pixel} "
+                    f"samples per pixel, not {engine.samples_per_pixel}"
+                )
+            if checkpoint.seed != engine.seed:
+                raise ValueError(
+                    f"Error: checkpoint is for seed {checkpoint.seed}, "
+                    f"not {engine.seed}"
+                )
+            if checkpoint.sampler != engine.sampler_name:
+                raise ValueError(
+                    f"Error: checkpoint is for the {checkpoint.sampler} sampler, "
+                    f"not {engine.sampler_name}"
+                )
+            if checkpoint.fingerprint != scene_fingerprint(scene):
+                raise ValueError(
+                    "Error: checkpoint is for a different scene or scene version"
+                )
+            engine.tile_size = checkpoint.tile_size
+            print(
+                f"Resuming: {checkpoint.tiles_done()} of {len(checkpoint.done)} "
+                "tiles already rendered"
+            )
+        elif checkpoint_path:
+            checkpoint = Checkpoint.create(
+                checkpoint_path,
+                scene,
+                args.tile_size,
+                engine.samples_per_pixel,
+                engine.seed,
+                engine.sampler_name,
+            )
+            stack.callback(checkpoint.close)
+        img_file = stack.enter_context(open(rendered_img, "wb"))
+        heatmap_file = stack.enter_context(open(heatmap, "wb")) if heatmap else None
+        tile_heatmap_file = (
+            stack.enter_context(open(tile_heatmap, "wb")) if tile_heatmap else None
+        )
+        aux_files = None
+        if aux_prefix:
+            aux_files = {
+                name: stack.enter_context(open(f"{aux_prefix}_{name}.png", "wb"))
+                for name in ("normal", "albedo", "depth", "id")
+            }
+        if args.listen:
+            coordinator = stack.enter_context(
+                Coordinator(
+                    engine, scene, parse_address(args.listen), args.authkey.encode()
+                )
+            )
+            host, port = coordinator.address
+            print(f"Waiting for workers on {host}:{port}")
+            workers = coordinator.render(img_file, raw, heatmap_file)
+        else:
+            workers = engine.render_multiprocess(
+                scene,
+                process,
+                img_file,
+                raw,
+                heatmap_file,
+                tile_heatmap_file,
+                checkpoint,
+                args.add_samples,
+                aux_fileobjs=aux_files,
+            )
+    if args.adaptive:
+        samples_taken = sum(worker["samples"] for worker in workers)
+        print(
+            f"Adaptive sampling: {samples_taken / (scene.width * scene.height):.2f} "
+            f"samples per pixel on average (cap {samples})"
+        )
+    if args.min_throughput and not args.listen:
+        print(
+            "Bounces saved by the throughput cutoff: "
+            f"{sum(worker['bounces_saved'] for worker in workers)}"
+        )
+    if args.denoise:
+        print(f"Denoised in {engine.denoise_time:.3f}s")
+    if args.utilization:
+        for worker in workers:
+            print(
+                f"Worker {worker['worker']}: {worker['tiles']} tiles, "
+                f"{worker['samples']} samples, "
+                f"busy {worker['busy']:.2f}s, "
+                f"utilization {worker['utilization'] * 100:5.1f}%"
+            )
+    if args.stats:
+        print(engine.stats.summary())
 
 
 if __name__ == "__main__":
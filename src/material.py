@@ -1,4 +1,10 @@
 from color import Color
+from texture import Texture
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 
 class Material:
@@ -16,9 +22,13 @@ class Material:
         self.specular = specular
         self.reflection = reflection
 
-    def color_at(self, _):
+    def color_at(self, position, uv=None, footprint=0.0):
         return self.color
 
+    def color_at_packet(self, positions):
+        color = np.array(tuple(self.color))
+        return np.broadcast_to(color, positions.shape)
+
 
 class ChequeredMaterial(Material):
     def __init__(
@@ -37,12 +47,19 @@ class ChequeredMaterial(Material):
         self.reflection = reflection
         self.specular = specular
 
-    def color_at(self, position):
+    def color_at(self, position, uv=None, footprint=0.0):
         if int((position.x + 5.0) * 3.0) % 2 == int(position.z * 3.0) % 2:
             return self.color1
         else:
             return self.color2
 
+    def color_at_packet(self, positions):
+        color1 = np.array(tuple(self.color1))
+        color2 = np.array(tuple(self.color2))
+        check_x = np.trunc((positions[:, 0] + 5.0) * 3.0).astype(np.int64) % 2
+        check_z = np.trunc(positions[:, 2] * 3.0).astype(np.int64) % 2
+        return np.where((check_x == check_z)[:, None], color1, color2)
+
 
 class MirrorMaterial(Material):
     def __init__(
@@ -66,7 +83,39 @@ class MirrorMaterial(Material):
             raise ValueError("Specular should be at least 0.9 for mirror material")
         if ambient > 0.1:
             raise ValueError("Ambient should be less than 0.1 for mirror material")
-        
 
-    def color_at(self, _):
+    def color_at(self, position, uv=None, footprint=0.0):
         return self.color
+
+
+class TextureMaterial:
+    # Colors a surface from an image texture through the hit's uv
+    # coordinates. size is the world-space width one repeat of the texture
+    # covers, which turns the pixel footprint at the hit into texels to pick
+    # the mip level; there is no packet version.
+
+    def __init__(
+        self,
+        texture,
+        size=1.0,
+        ambient=0.1,
+        diffuse=0.7,
+        specular=0.3,
+        reflection=0.1,
+    ):
+        self.texture = texture
+        self.size = size
+        self.ambient = ambient
+        self.diffuse = diffuse
+        self.specular = specular
+        self.reflection = reflection
+        self.texels_per_unit = texture.width / size
+
+    @classmethod
+    def load(cls, path, cache_dir=None, **kwargs):
+        return cls(Texture.load(path, cache_dir), **kwargs)
+
+    def color_at(self, position, uv=None, footprint=0.0):
+        if uv is None:
+            return self.texture.average()
+        return self.texture.sample(uv[0], uv[1], footprint * self.texels_per_unit)
@@ -0,0 +1,491 @@
+import hashlib
+import mmap
+import os
+import struct
+import tempfile
+import warnings
+from array import array
+
+from bvh import BVH, INV_EPSILON
+from hit import Hit
+from point import Point
+from vector import Vector
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+MAGIC = b"PRAYMESH"
+VERSION = 2
+HEADER = struct.Struct("<8sIIIIII")
+HEADER_SIZE = 64
+EPSILON = 1e-9
+# Meshes with more triangles than this are built with numpy, when it is
+# installed: the SAH build in Python takes about a second per 10000 triangles.
+BULK_TRIANGLES = 20000
+
+
+def read_obj(path):
+    # Only vertex positions, texture coordinates and faces are read, and
+    # polygons are split into triangle fans. Texture coordinates are kept
+    # only if every face has them.
+    if np is not None:
+        arrays = read_obj_numpy(path)
+        if arrays is not None:
+            return arrays
+    return read_obj_lines(path)
+
+
+def parse_rows(lines, dtype):
+    # The numbers of lines that all hold the same number of single-spaced
+    # fields, as rows, or None for anything else.
+    if not lines:
+        return None
+    if len({line.count(" ") for line in lines}) != 1:
+        return None
+    columns = lines[0].count(" ") + 1
+    try:
+        with warnings.catch_warnings():
+            # Raised when the text holds something other than numbers.
+            warnings.simplefilter("error", DeprecationWarning)
+            values = np.fromstring(" ".join(lines), dtype=dtype, sep=" ")
+    except (ValueError, DeprecationWarning):
+        return None
+    if len(values) != len(lines) * columns:
+        return None
+    return values.reshape(len(lines), columns)
+
+
+def read_obj_numpy(path):
+    # Parses whole blocks of lines at once for files whose vertices and faces
+    # are each written the same way, as exporters do. Returns None for the
+    # rest, including invalid files, which read_obj_lines reads or reports.
+    with open(path) as f:
+        lines = f.read().splitlines()
+    vertex_lines = []
+    uv_lines = []
+    face_lines = []
+    # How many vertices and texture coordinates precede each face, as
+    # relative and forward references are left to read_obj_lines.
+    preceding = []
+    preceding_uvs = []
+    for line in lines:
+        if line.startswith("v "):
+            vertex_lines.append(line[2:].strip())
+        elif line.startswith("vt "):
+            uv_lines.append(line[3:].strip())
+        elif line.startswith("f "):
+            face_lines.append(line[2:].strip())
+            preceding.append(len(vertex_lines))
+            preceding_uvs.append(len(uv_lines))
+    del lines
+    vertices = parse_rows(vertex_lines, np.float64)
+    if vertices is None or vertices.shape[1] < 3 or not face_lines:
+        return None
+    if len({line.count("/") for line in face_lines}) != 1:
+        return None
+    corners = face_lines[0].count(" ") + 1
+    # Corners are v, v/vt, v/vt/vn or v//vn.
+    textured = "/" in face_lines[0] and "//" not in face_lines[0]
+    if "//" in face_lines[0]:
+        if not all("//" in line for line in face_lines):
+            return None
+        face_lines = [line.replace("//", " ") for line in face_lines]
+    else:
+        face_lines = [line.replace("/", " ") for line in face_lines]
+    faces = parse_rows(face_lines, np.int64)
+    if corners < 3 or faces is None or faces.shape[1] % corners:
+        return None
+    faces = faces.reshape(len(faces), corners, -1)
+    ids = faces[:, :, 0]
+    if ids.min() < 1 or (ids.max(axis=1) > np.array(preceding)).any():
+        return None
+    fans = np.arange(1, corners - 1)
+    triangles = np.stack((ids[:, np.zeros_like(fans)], ids[:, fans], ids[:, fans + 1]))
+    triangles = triangles.transpose(1, 2, 0).reshape(-1, 3) - 1
+    vertex_array = array("d", vertices[:, :3].tobytes())
+    triangle_array = array("i", triangles.astype(np.intc).tobytes())
+    if not textured:
+        return (vertex_array, triangle_array, array("d"), array("i"))
+    uvs = parse_rows(uv_lines, np.float64)
+    uv_ids = faces[:, :, 1]
+    if (
+        uvs is None
+        or uv_ids.min() < 1
+        or (uv_ids.max(axis=1) > np.array(preceding_uvs)).any()
+    ):
+        return None
+    texcoords = np.empty((len(uvs), 2))
+    texcoords[:, 0] = uvs[:, 0]
+    # OBJ puts v = 0 at the bottom of the image, textures at the top.
+    texcoords[:, 1] = 1.0 - uvs[:, 1] if uvs.shape[1] > 1 else 1.0
+    uv_triangles = np.stack(
+        (uv_ids[:, np.zeros_like(fans)], uv_ids[:, fans], uv_ids[:, fans + 1])
+    )
+    uv_triangles = uv_triangles.transpose(1, 2, 0).reshape(-1, 3) - 1
+    return (
+        vertex_array,
+        triangle_array,
+        array("d", texcoords.tobytes()),
+        array("i", uv_triangles.astype(np.intc).tobytes()),
+    )
+
+
+def read_obj_lines(path):
+    # Streams the file line by line into flat arrays.
+    vertices = array("d")
+    texcoords = array("d")
+    triangles = array("i")
+    uv_triangles = array("i")
+    textured = True
+    with open(path) as f:
+        for number, line in enumerate(f, 1):
+            if line.startswith("v "):
+                parts = line.split()
+                vertices.extend((float(parts[1]), float(parts[2]), float(parts[3])))
+            elif line.startswith("vt "):
+                parts = line.split()
+                v = float(parts[2]) if len(parts) > 2 else 0.0
+                # OBJ puts v = 0 at the bottom of the image, textures at the top.
+                texcoords.extend((float(parts[1]), 1.0 - v))
+            elif line.startswith("f "):
+                count = len(vertices) // 3
+                uv_count = len(texcoords) // 2
+                ids = []
+                uv_ids = []
+                for part in line.split()[1:]:
+                    fields = part.split("/")
+                    i = int(fields[0])
+                    ids.append(i - 1 if i > 0 else count + i)
+                    if len(fields) > 1 and fields[1]:
+                        j = int(fields[1])
+                        uv_ids.append(j - 1 if j > 0 else uv_count + j)
+                if len(ids) < 3 or min(ids) < 0 or max(ids) >= count:
+                    raise ValueError(f"{path}:{number}: invalid face")
+                if len(uv_ids) != len(ids):
+                    textured = False
+                elif min(uv_ids) < 0 or max(uv_ids) >= uv_count:
+                    raise ValueError(f"{path}:{number}: invalid texture coordinate")
+                for k in range(1, len(ids) - 1):
+                    triangles.extend((ids[0], ids[k], ids[k + 1]))
+                    if textured:
+                        uv_triangles.extend((uv_ids[0], uv_ids[k], uv_ids[k + 1]))
+    if not textured:
+        return (vertices, triangles, array("d"), array("i"))
+    return (vertices, triangles, texcoords, uv_triangles)
+
+
+class TriangleMesh:
+    # Vertices and triangles live in flat arrays, and triangles are stored in
+    # the order of the leaves of the mesh's own BVH, so a leaf covers a
+    # contiguous range of triangles. A mesh loaded from a cache file maps the
+    # arrays straight from the file; worker processes share the pages and a
+    # pickled mesh is just the path of that file. Meshes without texture
+    # coordinates have empty texcoords and uv_triangles arrays.
+
+    def __init__(self, vertices, triangles, material, texcoords=(), uv_triangles=()):
+        self.material = material
+        self.path = None
+        self.mapping = None
+        self.vertices = vertices
+        self.texcoords = array("d", texcoords)
+        if np is not None and len(triangles) // 3 > BULK_TRIANGLES:
+            self.build_numpy(triangles, uv_triangles)
+            return
+        boxes = []
+        for t in range(0, len(triangles), 3):
+            a = triangles[t] * 3
+            b = triangles[t + 1] * 3
+            c = triangles[t + 2] * 3
+            xs = (vertices[a], vertices[b], vertices[c])
+            ys = (vertices[a + 1], vertices[b + 1], vertices[c + 1])
+            zs = (vertices[a + 2], vertices[b + 2], vertices[c + 2])
+            boxes.append((min(xs), min(ys), min(zs), max(xs), max(ys), max(zs)))
+        self.bvh = BVH.from_boxes(boxes)
+        order = self.bvh.indices
+        self.triangles = array("i")
+        self.uv_triangles = array("i")
+        for t in order:
+            self.triangles.extend(triangles[t * 3 : t * 3 + 3])
+            if len(uv_triangles):
+                self.uv_triangles.extend(uv_triangles[t * 3 : t * 3 + 3])
+        self.bvh.indices = None
+
+    def build_numpy(self, triangles, uv_triangles):
+        vertices = np.asarray(self.vertices, dtype=np.float64).reshape(-1, 3)
+        triangles = np.asarray(triangles, dtype=np.intc).reshape(-1, 3)
+        corners = vertices[triangles]
+        self.bvh = BVH.from_box_arrays(corners.min(axis=1), corners.max(axis=1))
+        order = np.asarray(self.bvh.indices)
+        self.triangles = array("i", triangles[order].tobytes())
+        self.uv_triangles = array("i")
+        if len(uv_triangles):
+            uv_triangles = np.asarray(uv_triangles, dtype=np.intc).reshape(-1, 3)
+            self.uv_triangles.frombytes(uv_triangles[order].tobytes())
+        self.bvh.indices = None
+
+    @classmethod
+    def load_obj(cls, path, material, cache_dir=None):
+        if cache_dir is None:
+            vertices, triangles, texcoords, uv_triangles = read_obj(path)
+            return cls(vertices, triangles, material, texcoords, uv_triangles)
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        digest.update(f"pray-mesh-{VERSION}".encode())
+        cache_path = os.path.join(cache_dir, digest.hexdigest() + ".mesh")
+        if not os.path.exists(cache_path):
+            vertices, triangles, texcoords, uv_triangles = read_obj(path)
+            mesh = cls(vertices, triangles, material, texcoords, uv_triangles)
+            os.makedirs(cache_dir, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=cache_dir)
+            with os.fdopen(fd, "wb") as f:
+                mesh.save(f)
+            os.replace(tmp_path, cache_path)
+        return cls.mapped(cache_path, material)
+
+    def save(self, fileobj):
+        bvh = self.bvh
+        node_count = len(bvh.counts)
+        fileobj.write(
+            HEADER.pack(
+                MAGIC,
+                VERSION,
+                len(self.vertices) // 3,
+                len(self.triangles) // 3,
+                len(self.texcoords) // 2,
+                node_count,
+                bvh.depth,
+            ).ljust(HEADER_SIZE, b"\0")
+        )
+        # Doubles first so every array stays aligned to its item size.
+        for values in (
+            self.vertices,
+            self.texcoords,
+            bvh.bounds,
+            self.triangles,
+            self.uv_triangles,
+            bvh.offsets,
+            bvh.counts,
+        ):
+            fileobj.write(memoryview(values).cast("B"))
+
+    @classmethod
+    def mapped(cls, path, material):
+        mesh = cls.__new__(cls)
+        mesh.material = material
+        mesh.path = path
+        with open(path, "rb") as f:
+            mesh.mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (
+            magic,
+            version,
+            vertex_count,
+            triangle_count,
+            uv_count,
+            node_count,
+            depth,
+        ) = HEADER.unpack_from(mesh.mapping)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a mesh cache file")
+        view = memoryview(mesh.mapping)
+        offset = HEADER_SIZE
+        arrays = []
+        for fmt, count in (
+            ("d", vertex_count * 3),
+            ("d", uv_count * 2),
+            ("d", node_count * 6),
+            ("i", triangle_count * 3),
+            ("i", triangle_count * 3 if uv_count else 0),
+            ("i", node_count),
+            ("i", node_count),
+        ):
+            size = count * struct.calcsize(fmt)
+            arrays.append(view[offset : offset + size].cast(fmt))
+            offset += size
+        vertices, texcoords, bounds, triangles, uv_triangles, offsets, counts = arrays
+        mesh.vertices = vertices
+        mesh.texcoords = texcoords
+        mesh.triangles = triangles
+        mesh.uv_triangles = uv_triangles
+        mesh.bvh = BVH.from_arrays(None, bounds, offsets, counts, depth)
+        return mesh
+
+    def __getstate__(self):
+        if self.path is not None:
+            return (self.path, self.material)
+        state = self.__dict__.copy()
+        state["bvh"] = (
+            self.bvh.bounds,
+            self.bvh.offsets,
+            self.bvh.counts,
+            self.bvh.depth,
+        )
+        return state
+
+    def __setstate__(self, state):
+        if isinstance(state, tuple):
+            path, material = state
+            self.__dict__.update(TriangleMesh.mapped(path, material).__dict__)
+            return
+        bounds, offsets, counts, depth = state["bvh"]
+        state["bvh"] = BVH.from_arrays(None, bounds, offsets, counts, depth)
+        self.__dict__.update(state)
+
+    def triangle_count(self):
+        return len(self.triangles) // 3
+
+    def bounds(self):
+        b = self.bvh.bounds
+        if not len(b):
+            return (Point(0, 0, 0), Point(0, 0, 0))
+        return (Point(b[0], b[1], b[2]), Point(b[3], b[4], b[5]))
+
+    def intersect_leaf(self, node, ox, oy, oz, dx, dy, dz, best):
+        # Moller-Trumbore against every triangle of a leaf; returns the
+        # nearest distance below best, its triangle and the barycentric
+        # coordinates of the hit, or (best, -1, 0, 0).
+        vertices = self.vertices
+        triangles = self.triangles
+        start = self.bvh.offsets[node]
+        nearest = -1
+        best_u = best_v = 0.0
+        for t in range(start * 3, (start + self.bvh.counts[node]) * 3, 3):
+            a = triangles[t] * 3
+            b = triangles[t + 1] * 3
+            c = triangles[t + 2] * 3
+            v0x = vertices[a]
+            v0y = vertices[a + 1]
+            v0z = vertices[a + 2]
+            e1x = vertices[b] - v0x
+            e1y = vertices[b + 1] - v0y
+            e1z = vertices[b + 2] - v0z
+            e2x = vertices[c] - v0x
+            e2y = vertices[c + 1] - v0y
+            e2z = vertices[c + 2] - v0z
+            px = dy * e2z - dz * e2y
+            py = dz * e2x - dx * e2z
+            pz = dx * e2y - dy * e2x
+            det = e1x * px + e1y * py + e1z * pz
+            if -EPSILON < det < EPSILON:
+                continue
+            inv = 1.0 / det
+            tx = ox - v0x
+            ty = oy - v0y
+            tz = oz - v0z
+            u = (tx * px + ty * py + tz * pz) * inv
+            if u < 0.0 or u > 1.0:
+                continue
+            qx = ty * e1z - tz * e1y
+            qy = tz * e1x - tx * e1z
+            qz = tx * e1y - ty * e1x
+            v = (dx * qx + dy * qy + dz * qz) * inv
+            if v < 0.0 or u + v > 1.0:
+                continue
+            dist = (e2x * qx + e2y * qy + e2z * qz) * inv
+            if EPSILON < dist < best:
+                best = dist
+                nearest = t
+                best_u = u
+                best_v = v
+        return (best, nearest, best_u, best_v)
+
+    def nearest(self, ray, max_dist, any_hit=False):
+        origin = ray.origin
+        direction = ray.direction
+        ox, oy, oz = origin.x, origin.y, origin.z
+        dx, dy, dz = direction.x, direction.y, direction.z
+        ix = 1 / dx if dx else INV_EPSILON
+        iy = 1 / dy if dy else INV_EPSILON
+        iz = 1 / dz if dz else INV_EPSILON
+        counts = self.bvh.counts
+        offsets = self.bvh.offsets
+        entry = self.bvh.entry_distance
+        best = max_dist
+        nearest = -1
+        u = v = 0.0
+        t_root = entry(0, ox, oy, oz, ix, iy, iz, best) if len(counts) else None
+        stack = [(0, t_root)] if t_root is not None else []
+        while stack:
+            node, t_node = stack.pop()
+            if t_node > best:
+                continue
+            if counts[node]:
+                best, t, leaf_u, leaf_v = self.intersect_leaf(
+                    node, ox, oy, oz, dx, dy, dz, best
+                )
+                if t >= 0:
+                    nearest = t
+                    u = leaf_u
+                    v = leaf_v
+                    if any_hit:
+                        break
+                continue
+            left = node + 1
+            right = offsets[node]
+            t_left = entry(left, ox, oy, oz, ix, iy, iz, best)
+            t_right = entry(right, ox, oy, oz, ix, iy, iz, best)
+            if t_left is not None and t_right is not None:
+                if t_left <= t_right:
+                    stack.append((right, t_right))
+                    stack.append((left, t_left))
+                else:
+                    stack.append((left, t_left))
+                    stack.append((right, t_right))
+            elif t_left is not None:
+                stack.append((left, t_left))
+            elif t_right is not None:
+                stack.append((right, t_right))
+        return (best, nearest, u, v)
+
+    def normal(self, t, direction):
+        vertices = self.vertices
+        a = self.triangles[t] * 3
+        b = self.triangles[t + 1] * 3
+        c = self.triangles[t + 2] * 3
+        e1 = Vector(
+            vertices[b] - vertices[a],
+            vertices[b + 1] - vertices[a + 1],
+            vertices[b + 2] - vertices[a + 2],
+        )
+        e2 = Vector(
+            vertices[c] - vertices[a],
+            vertices[c + 1] - vertices[a + 1],
+            vertices[c + 2] - vertices[a + 2],
+        )
+        normal = e1.cross_product(e2).inormalize()
+        # Meshes are often open, so triangles are shaded from either side.
+        if normal.dot_product(direction) > 0:
+            normal.iscale(-1)
+        return normal
+
+    def uv(self, t, u, v):
+        # Interpolates the triangle's texture coordinates, or falls back to
+        # the barycentric coordinates for meshes without any.
+        if not len(self.texcoords):
+            return (u, v)
+        texcoords = self.texcoords
+        a = self.uv_triangles[t] * 2
+        b = self.uv_triangles[t + 1] * 2
+        c = self.uv_triangles[t + 2] * 2
+        w = 1.0 - u - v
+        return (
+            w * texcoords[a] + u * texcoords[b] + v * texcoords[c],
+            w * texcoords[a + 1] + u * texcoords[b + 1] + v * texcoords[c + 1],
+        )
+
+    def intersects(self, ray):
+        dist, t, _, _ = self.nearest(ray, float("inf"))
+        return dist if t >= 0 else None
+
+    def hit(self, ray, max_dist=float("inf")):
+        dist, t, u, v = self.nearest(ray, max_dist)
+        if t < 0:
+            return None
+        normal = self.normal(t, ray.direction)
+        return Hit(dist, ray.at(dist), normal, self, uv=self.uv(t, u, v))
+
+    def occludes(self, ray, max_dist):
+        return self.nearest(ray, max_dist, any_hit=True)[1] >= 0
@@ -0,0 +1,338 @@
+import numpy as np
+
+from denoise import LUMINANCE
+from engine import RenderEngine
+
+
+class PacketRenderEngine(RenderEngine):
+    PACKET_SIZE = 65536
+    # While aux buffers are filled, ray_trace_packet appends the first-hit
+    # features of each packet here: per ray a normal, albedo, depth, object
+    # index (-1 for a miss) and the luminance of the ray's color.
+    first_hits = None
+
+    def start_tile(self, tile, first_sample=0):
+        super().start_tile(tile, first_sample)
+        self.packet_rng = np.random.default_rng(self.rng.getrandbits(64))
+
+    def render_tile(self, scene, tile, image, sample_counts, first_sample=0, aux=None):
+        xmin, ymin, xmax, ymax = tile
+        width = xmax - xmin
+        samples = self.samples_per_pixel
+        self.start_tile(tile, first_sample)
+        self.first_hits = None if aux is None else []
+        if self.adaptive and samples > 1:
+            return self.render_tile_adaptive(
+                scene, tile, image, sample_counts, first_sample, aux
+            )
+        rows_per_packet = max(1, self.PACKET_SIZE // (width * samples))
+        for jmin in range(ymin, ymax, rows_per_packet):
+            jmax = min(jmin + rows_per_packet, ymax)
+            packet = (xmin, jmin, xmax, jmax)
+            xs, ys = self.pixel_centers(scene, packet)
+            colors = self.sample_packet(
+                scene, xs, ys, self.pixel_indices(packet), first_sample, samples
+            )
+            colors = colors.reshape(jmax - jmin, width, 3)
+            for j, row in enumerate(colors, jmin):
+                image.set_pixels(xmin, j, row.ravel())
+                sample_counts.set_pixels(xmin, j, np.full(width, float(samples)))
+            if aux is not None:
+                self.store_features(aux, packet, self.first_hits.pop(), samples)
+        self.first_hits = None
+        return width * (ymax - ymin) * samples
+
+    def render_tile_adaptive(
+        self, scene, tile, image, sample_counts, first_sample, aux=None
+    ):
+        xmin, ymin, xmax, ymax = tile
+        width = xmax - xmin
+        xs, ys = self.pixel_centers(scene, tile)
+        pixels = self.pixel_indices(tile)
+        total = np.zeros((len(xs), 3))
+        total_sq = np.zeros((len(xs), 3))
+        counts = np.zeros(len(xs))
+        active = np.arange(len(xs))
+        batch = min(self.min_samples, self.samples_per_pixel)
+        while len(active) and batch > 0:
+            colors = self.sample_packet(
+                scene,
+                xs[active],
+                ys[active],
+                [pixels[k] for k in active],
+                first_sample + int(counts[active[0]]),
+                batch,
+                average=False,
+            )
+            if self.first_hits:
+                # Every pixel is in the first batch; later ones add no
+                # features.
+                self.store_features(aux, tile, self.first_hits.pop(), batch)
+                self.first_hits = None
+            total[active] += colors.sum(axis=1)
+            total_sq[active] += (colors * colors).sum(axis=1)
+            counts[active] += batch
+            count = counts[active][:, None]
+            if count[0, 0] > 1:
+                variance = (total_sq[active] - total[active] ** 2 / count) / (count - 1)
+                error = (variance / count).max(axis=1)
+                active = active[error > self.threshold * self.threshold]
+            batch = min(self.min_samples, self.samples_per_pixel - int(count[0, 0]))
+        colors = (total / counts[:, None]).reshape(ymax - ymin, width, 3)
+        counts = counts.reshape(ymax - ymin, width)
+        for j in range(ymin, ymax):
+            image.set_pixels(xmin, j, colors[j - ymin].ravel())
+            sample_counts.set_pixels(xmin, j, counts[j - ymin])
+        return int(counts.sum())
+
+    @staticmethod
+    def store_features(aux, tile, features, samples):
+        xmin, ymin, xmax, ymax = tile
+        width = xmax - xmin
+        features = features.reshape(ymax - ymin, width, samples, 9)
+        means = features[:, :, :, :7].mean(axis=2)
+        luminance = features[:, :, :, 8]
+        if samples > 1:
+            variance = luminance.var(axis=2, ddof=1) / samples
+        else:
+            variance = np.zeros_like(luminance[:, :, 0])
+        for j in range(ymin, ymax):
+            row = means[j - ymin]
+            aux.normal.set_pixels(xmin, j, row[:, 0:3].ravel())
+            aux.albedo.set_pixels(xmin, j, row[:, 3:6].ravel())
+            aux.depth.set_pixels(xmin, j, np.ascontiguousarray(row[:, 6]))
+            aux.ids.set_pixels(
+                xmin, j, np.ascontiguousarray(features[j - ymin, :, 0, 7])
+            )
+            aux.variance.set_pixels(xmin, j, variance[j - ymin])
+
+    def pixel_centers(self, scene, tile):
+        x0, y0, xstep, ystep = self.screen(scene)
+        xmin, ymin, xmax, ymax = tile
+        ys, xs = np.meshgrid(
+            y0 + np.arange(ymin, ymax) * ystep,
+            x0 + np.arange(xmin, xmax) * xstep,
+            indexing="ij",
+        )
+        return (xs.ravel(), ys.ravel())
+
+    @staticmethod
+    def pixel_indices(tile):
+        xmin, ymin, xmax, ymax = tile
+        return [(i, j) for j in range(ymin, ymax) for i in range(xmin, xmax)]
+
+    def sample_packet(self, scene, xs, ys, pixels, first_sample, samples, average=True):
+        # Traces samples rays per pixel, numbered from first_sample in each
+        # pixel's sampler sequence.
+        _, _, xstep, ystep = self.screen(scene)
+        camera = np.array(tuple(scene.camera))
+        xs = np.repeat(xs, samples)
+        ys = np.repeat(ys, samples)
+        if self.samples_per_pixel > 1:
+            sampler = self.sampler
+            offsets = []
+            for i, j in pixels:
+                sampler.start_pixel(self.rng, i, j)
+                for index in range(first_sample, first_sample + samples):
+                    offsets.extend(sampler.get(index))
+            offsets = np.array(offsets).reshape(-1, 2) - 0.5
+            xs = xs + offsets[:, 0] * xstep
+            ys = ys + offsets[:, 1] * ystep
+        directions = np.stack([xs, ys, np.zeros_like(xs)], axis=1) - camera
+        directions /= np.linalg.norm(directions, axis=1)[:, None]
+        origins = np.broadcast_to(camera, directions.shape)
+        colors = self.ray_trace_packet(origins, directions, scene)
+        if self.first_hits:
+            self.first_hits[-1][:, 8] = colors @ LUMINANCE
+        colors = colors.reshape(-1, samples, 3)
+        return colors.mean(axis=1) if average else colors
+
+    def ray_trace_packet(self, origins, directions, scene):
+        colors = np.zeros((len(origins), 3))
+        weights = np.ones(len(origins))
+        ray_ids = np.arange(len(origins))
+        features = None
+        if self.first_hits is not None:
+            features = np.zeros((len(origins), 9))
+            features[:, 7] = -1
+            self.first_hits.append(features)
+        reflection = np.array([obj.material.reflection for obj in scene.objects])
+        for depth in range(self.MAX_DEPTH + 1):
+            dist_hit, obj_hit = self.find_nearest_packet(origins, directions, scene)
+            hit = obj_hit >= 0
+            if not hit.any():
+                break
+            origins = origins[hit]
+            directions = directions[hit]
+            dist_hit = dist_hit[hit]
+            obj_hit = obj_hit[hit]
+            weights = weights[hit]
+            ray_ids = ray_ids[hit]
+            hit_pos = origins + directions * dist_hit[:, None]
+            hit_normal = self.normal_packet(obj_hit, hit_pos, scene)
+            if depth == 0 and features is not None:
+                features[ray_ids, 0:3] = hit_normal
+                features[ray_ids, 3:6] = self.albedo_packet(obj_hit, hit_pos, scene)
+                features[ray_ids, 6] = dist_hit
+                features[ray_ids, 7] = obj_hit
+            colors[ray_ids] += (
+                self.color_at_packet(obj_hit, hit_pos, hit_normal, scene)
+                * weights[:, None]
+            )
+            if depth == self.MAX_DEPTH:
+                break
+            weights = weights * reflection[obj_hit]
+            if self.min_throughput > 0:
+                low = weights < self.min_throughput
+                if self.russian_roulette:
+                    survive = (
+                        self.packet_rng.random(len(weights)) * self.min_throughput
+                        < weights
+                    )
+                    weights = np.where(low & survive, self.min_throughput, weights)
+                    low &= ~survive
+                self.bounces_saved += int(np.count_nonzero(low)) * (
+                    self.MAX_DEPTH - depth
+                )
+                if low.any():
+                    keep = ~low
+                    hit_pos = hit_pos[keep]
+                    hit_normal = hit_normal[keep]
+                    directions = directions[keep]
+                    weights = weights[keep]
+                    ray_ids = ray_ids[keep]
+                    if not len(weights):
+                        break
+            origins = hit_pos + hit_normal * self.MIN_DISPLACE
+            directions = directions - 2 * (
+                np.einsum("ij,ij->i", directions, hit_normal)[:, None] * hit_normal
+            )
+            directions /= np.linalg.norm(directions, axis=1)[:, None]
+        return colors
+
+    def find_nearest_packet(self, origins, directions, scene):
+        dist_min = np.full(len(origins), np.inf)
+        obj_hit = np.full(len(origins), -1)
+        for index, obj in enumerate(scene.objects):
+            dist = obj.intersects_packet(origins, directions)
+            closer = dist < dist_min
+            dist_min[closer] = dist[closer]
+            obj_hit[closer] = index
+        return (dist_min, obj_hit)
+
+    def occluded_packet(self, origins, directions, max_dist, scene, light_index):
+        occluded = np.zeros(len(origins), dtype=bool)
+        pending = np.arange(len(origins))
+        last = self.last_occluder.get(light_index)
+        objects = sorted(scene.objects, key=lambda obj: obj is not last)
+        best = (0, None)
+        for obj in objects:
+            if not len(pending):
+                break
+            dist = obj.intersects_packet(origins[pending], directions[pending])
+            blocked = dist < max_dist[pending]
+            count = np.count_nonzero(blocked)
+            if count:
+                occluded[pending[blocked]] = True
+                pending = pending[~blocked]
+                if count > best[0]:
+                    best = (count, obj)
+        if best[1] is not None:
+            self.last_occluder[light_index] = best[1]
+        return occluded
+
+    def normal_packet(self, obj_hit, hit_pos, scene):
+        normals = np.empty_like(hit_pos)
+        for index, obj in enumerate(scene.objects):
+            mask = obj_hit == index
+            if mask.any():
+                normals[mask] = obj.normal_packet(hit_pos[mask])
+        return normals
+
+    def color_at_packet(self, obj_hit, hit_pos, normal, scene):
+        materials = [obj.material for obj in scene.objects]
+        ambient = np.array([m.ambient for m in materials])[obj_hit, None]
+        diffuse = np.array([m.diffuse for m in materials])[obj_hit, None]
+        specular = np.array([m.specular for m in materials])[obj_hit, None]
+        obj_color = self.albedo_packet(obj_hit, hit_pos, scene)
+        to_cam = np.array(tuple(scene.camera)) - hit_pos
+        specular_k = 50
+        color = np.zeros_like(hit_pos)
+        sampled = 0 < self.light_samples < len(scene.lights)
+        if sampled:
+            color += ambient * obj_color * np.array(tuple(scene.light_sampler.ambient))
+            lights = self.sample_lights_packet(scene, len(hit_pos))
+        else:
+            lights = (
+                (
+                    light_index,
+                    np.array(tuple(light.position)),
+                    np.broadcast_to(np.array(tuple(light.color)), hit_pos.shape),
+                    1.0,
+                )
+                for light_index, light in enumerate(scene.lights)
+            )
+        for light_index, light_position, light_color, weight in lights:
+            if not sampled:
+                color += ambient * obj_color * light_color
+            to_light = light_position - hit_pos
+            light_dist = np.linalg.norm(to_light, axis=1)
+            to_light /= light_dist[:, None]
+            lit = ~self.occluded_packet(
+                hit_pos + normal * self.MIN_DISPLACE,
+                to_light,
+                light_dist,
+                scene,
+                light_index,
+            )
+            if not lit.any():
+                continue
+            if sampled:
+                weight = weight[lit]
+            lit_normal = normal[lit]
+            color[lit] += (
+                obj_color[lit]
+                * diffuse[lit]
+                * np.maximum(np.einsum("ij,ij->i", lit_normal, to_light[lit]), 0)[
+                    :, None
+                ]
+                * weight
+            )
+            half_vector = to_light[lit] + to_cam[lit]
+            half_vector /= np.linalg.norm(half_vector, axis=1)[:, None]
+            color[lit] += (
+                light_color[lit]
+                * specular[lit]
+                * np.maximum(np.einsum("ij,ij->i", lit_normal, half_vector), 0)[
+                    :, None
+                ]
+                ** specular_k
+                * weight
+            )
+        return color
+
+    def albedo_packet(self, obj_hit, hit_pos, scene):
+        obj_color = np.empty_like(hit_pos)
+        for index, obj in enumerate(scene.objects):
+            mask = obj_hit == index
+            if mask.any():
+                obj_color[mask] = obj.material.color_at_packet(hit_pos[mask])
+        return obj_color
+
+    def sample_lights_packet(self, scene, count):
+        # Draws light_samples lights per point from the scene's alias table;
+        # yields the drawn positions, colors and inverse-probability weights.
+        sampler = scene.light_sampler
+        positions = np.array([tuple(light.position) for light in scene.lights])
+        colors = np.array([tuple(light.color) for light in scene.lights])
+        probability = np.array(sampler.probability)
+        alias = np.array(sampler.alias)
+        pdf = np.array(sampler.pdf)
+        size = len(alias)
+        for _ in range(self.light_samples):
+            x = self.packet_rng.random(count) * size
+            i = np.minimum(x.astype(np.int64), size - 1)
+            index = np.where(x - i < probability[i], i, alias[i])
+            weight = 1.0 / (self.light_samples * pdf[index])
+            # Mixed lights share one last-occluder slot.
+            yield (None, positions[index], colors[index], weight[:, None])
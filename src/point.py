@@ -2,4 +2,4 @@ from vector import Vector
 
 
 class Point(Vector):
-    pass
+    __slots__ = ()
@@ -0,0 +1,180 @@
+import pickle
+import queue
+import time
+from multiprocessing import Process, Queue
+
+from image import Image
+from sampler import SAMPLERS
+from tiles import make_tiles
+
+SCENE_SETTINGS = ("camera", "width", "height")
+# Settings the engine's sampler is built from.
+SAMPLER_SETTINGS = ("sampler", "samples_per_pixel", "seed")
+
+
+def apply_settings(engine, scene, settings):
+    for key, value in settings.items():
+        if key in SCENE_SETTINGS:
+            setattr(scene, key, value)
+        elif key == "sampler":
+            if value not in SAMPLERS:
+                raise ValueError(f"Unknown sampler: {value}")
+            engine.sampler_name = value
+        elif hasattr(engine, key):
+            setattr(engine, key, value)
+        else:
+            raise ValueError(f"Unknown render setting: {key}")
+    if any(key in settings for key in SAMPLER_SETTINGS):
+        engine.make_sampler()
+
+
+def pool_worker(engine, scene, task_queue, job_queue, result_queue, worker_id):
+    job = None
+    buffers = None
+    try:
+        while True:
+            task = task_queue.get()
+            if task is None:
+                break
+            job_id, tile = task
+            if job is not None and job_id < job["id"]:
+                # Left over from a job that failed; its caller has moved on.
+                continue
+            try:
+                while job is None or job["id"] != job_id:
+                    job = job_queue.get()
+                    apply_settings(engine, scene, job["settings"])
+                if buffers is None or buffers[0] != job_id:
+                    # Framebuffers are attached only for jobs this worker
+                    # renders tiles of, since the ones it skipped may already
+                    # be released.
+                    if buffers is not None:
+                        buffers[1].close()
+                        buffers[2].close()
+                        buffers = None
+                    buffers = (
+                        job_id,
+                        Image.attach(job["image"]),
+                        Image.attach(job["sample_counts"]),
+                    )
+                start = time.perf_counter()
+                samples = engine.render_tile(scene, tile, buffers[1], buffers[2])
+                busy = time.perf_counter() - start
+                result_queue.put((job_id, worker_id, samples, busy))
+            except Exception as e:
+                # The caller re-raises it, and the worker stays up for the
+                # next job.
+                try:
+                    pickle.dumps(e)
+                except Exception:
+                    e = RuntimeError(f"{type(e).__name__}: {e}")
+                result_queue.put((job_id, worker_id, e, 0.0))
+    finally:
+        if buffers is not None:
+            buffers[1].close()
+            buffers[2].close()
+
+
+class RenderPool:
+    def __init__(self, engine, scene, processes_count):
+        self.engine = engine
+        self.scene = scene
+        self.task_queue = Queue()
+        self.result_queue = Queue()
+        self.job_queues = [Queue() for _ in range(processes_count)]
+        self.jobs_done = 0
+        self.workers = []
+        self.processes = [
+            Process(
+                target=pool_worker,
+                args=(
+                    engine,
+                    scene,
+                    self.task_queue,
+                    job_queue,
+                    self.result_queue,
+                    worker_id,
+                ),
+                daemon=True,
+            )
+            for worker_id, job_queue in enumerate(self.job_queues)
+        ]
+        for p in self.processes:
+            p.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def render(self, **settings):
+        apply_settings(self.engine, self.scene, settings)
+        width = self.scene.width
+        height = self.scene.height
+        self.jobs_done += 1
+        image = Image(width, height)
+        sample_counts = Image(width, height, channels=1)
+        try:
+            job = {
+                "id": self.jobs_done,
+                "settings": settings,
+                "image": image.handle(),
+                "sample_counts": sample_counts.handle(),
+            }
+            for job_queue in self.job_queues:
+                job_queue.put(job)
+            tiles = make_tiles(
+                width, height, self.engine.tile_size, self.engine.tile_order
+            )
+            for tile in tiles:
+                self.task_queue.put((job["id"], tile))
+            workers = [
+                {"worker": i, "tiles": 0, "samples": 0, "busy": 0.0}
+                for i in range(len(self.processes))
+            ]
+            start = time.perf_counter()
+            remaining = len(tiles)
+            while remaining:
+                try:
+                    job_id, worker_id, samples, busy = self.result_queue.get(timeout=1)
+                except queue.Empty:
+                    if not all(p.is_alive() for p in self.processes):
+                        raise RuntimeError("A render pool worker exited unexpectedly")
+                    continue
+                if job_id != job["id"]:
+                    # A tile of an earlier, failed job.
+                    continue
+                if isinstance(samples, BaseException):
+                    raise samples
+                remaining -= 1
+                worker = workers[worker_id]
+                worker["tiles"] += 1
+                worker["samples"] += samples
+                worker["busy"] += busy
+            wall = time.perf_counter() - start
+            for worker in workers:
+                worker["utilization"] = worker["busy"] / wall if wall > 0 else 0.0
+            self.workers = workers
+        except BaseException:
+            # Workers skip tiles of jobs older than their current one, but the
+            # tiles no worker has taken yet are dropped here.
+            try:
+                while True:
+                    self.task_queue.get_nowait()
+            except queue.Empty:
+                pass
+            image.close()
+            raise
+        finally:
+            sample_counts.close()
+        return image
+
+    def close(self):
+        for _ in self.processes:
+            self.task_queue.put(None)
+        for p in self.processes:
+            p.join(timeout=5)
+            if p.is_alive():
+                p.terminate()
+        self.processes = []
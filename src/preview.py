@@ -0,0 +1,392 @@
+import asyncio
+import io
+import json
+import os
+import time
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+
+from color import Color
+from image import Image, PngWriter
+from point import Point
+from ray import Ray
+from tiles import make_tiles
+
+# Block sizes of the 1 spp passes run before the first full resolution one.
+COARSE_STEPS = (8, 4, 2)
+# A frame is also pushed mid-pass once this many seconds passed since the last.
+PUBLISH_INTERVAL = 0.5
+WATCH_INTERVAL = 0.5
+
+PAGE = b"""<!DOCTYPE html>
+<html>
+<head><title>pray preview</title></head>
+<body style="background: #202020; color: #d0d0d0; font-family: sans-serif">
+<p>
+<button onclick="fetch('/restart', {method: 'POST'})">Restart</button>
+<button onclick="fetch('/cancel', {method: 'POST'})">Cancel</button>
+<span id="state">connecting</span> <span id="progress"></span>
+</p>
+<img id="frame" style="image-rendering: pixelated">
+<script>
+const events = new EventSource("/events");
+events.addEventListener("frame", (event) => {
+  const info = JSON.parse(event.data);
+  document.getElementById("frame").src = "/frame.png?" + info.frame;
+  document.getElementById("progress").textContent =
+    `pass ${info.pass}/${info.passes}, ${info.samples} spp, ` +
+    `${info.elapsed.toFixed(2)}s`;
+});
+events.addEventListener("status", (event) => {
+  document.getElementById("state").textContent = JSON.parse(event.data).state;
+});
+</script>
+</body>
+</html>
+"""
+
+worker_state = {}
+
+
+def preview_passes(samples_per_pixel, width, height):
+    # (step, samples, jitter) per pass: coarse passes trace one unjittered
+    # ray per step x step block, then full resolution passes add samples
+    # until samples_per_pixel, doubling the total each time.
+    passes = [(step, 1, False) for step in COARSE_STEPS if step < min(width, height)]
+    passes.append((1, 1, False))
+    total = 1
+    while total < samples_per_pixel:
+        added = min(max(total, 3), samples_per_pixel - total)
+        passes.append((1, added, True))
+        total += added
+    return passes
+
+
+def init_preview_worker(engine, scene):
+    worker_state["engine"] = engine
+    worker_state["scene"] = scene
+
+
+def render_preview_tile(tile, step, samples, jitter, first_sample):
+    # Returns the mean color of the first pixel of every step x step block
+    # of the tile as packed doubles. Jittered passes take samples from
+    # first_sample on in each pixel's sampler sequence.
+    engine = worker_state["engine"]
+    scene = worker_state["scene"]
+    x0, y0, xstep, ystep = engine.screen(scene)
+    xmin, ymin, xmax, ymax = tile
+    camera = scene.camera
+    engine.pixel_spread = xstep * step / max(abs(camera.z), engine.MIN_DISPLACE)
+    engine.start_tile(tile, first_sample)
+    values = array("d")
+    for j in range(ymin, ymax, step):
+        y = y0 + j * ystep
+        for i in range(xmin, xmax, step):
+            x = x0 + i * xstep
+            if jitter:
+                engine.sampler.start_pixel(engine.rng, i, j)
+                color = Color(0, 0, 0)
+                for index in range(first_sample, first_sample + samples):
+                    color.iadd(engine.sample(scene, x, y, xstep, ystep, index))
+                color.iscale(1.0 / samples)
+            else:
+                ray = Ray(camera, camera.direction_to(Point(x, y)), normalized=True)
+                color = engine.ray_trace(ray, scene)
+            values.extend((color.x, color.y, color.z))
+    return (tile, values)
+
+
+class PreviewRenderer:
+    # Renders one scene pass by pass into a framebuffer kept in this process;
+    # workers only trace tiles. Cancelling run() drops the tiles not started.
+
+    def __init__(self, engine, scene, processes_count):
+        self.engine = engine
+        self.scene = scene
+        self.executor = ProcessPoolExecutor(
+            processes_count,
+            initializer=init_preview_worker,
+            initargs=(engine, scene),
+        )
+        self.image = Image(scene.width, scene.height)
+        self.counts = array("d", bytes(8 * scene.width * scene.height))
+        self.frames = 0
+
+    async def run(self, publish):
+        loop = asyncio.get_running_loop()
+        width = self.scene.width
+        height = self.scene.height
+        passes = preview_passes(self.engine.samples_per_pixel, width, height)
+        start = last_publish = time.perf_counter()
+        samples_done = 0
+        for number, (step, samples, jitter) in enumerate(passes, 1):
+            tiles = make_tiles(
+                width, height, self.engine.tile_size * step, self.engine.tile_order
+            )
+            futures = [
+                loop.run_in_executor(
+                    self.executor,
+                    render_preview_tile,
+                    tile,
+                    step,
+                    samples,
+                    jitter,
+                    samples_done,
+                )
+                for tile in tiles
+            ]
+            try:
+                for done, future in enumerate(asyncio.as_completed(futures), 1):
+                    tile, values = await future
+                    if step > 1:
+                        self.fill_blocks(tile, step, values)
+                    else:
+                        self.merge(tile, samples, values)
+                    now = time.perf_counter()
+                    if done < len(futures) and now - last_publish >= PUBLISH_INTERVAL:
+                        info = self.info(number, passes, samples_done, now - start)
+                        info["partial"] = True
+                        publish(self.encode(), info)
+                        last_publish = now
+            finally:
+                for future in futures:
+                    future.cancel()
+            if step == 1:
+                samples_done += samples
+            now = time.perf_counter()
+            publish(self.encode(), self.info(number, passes, samples_done, now - start))
+            last_publish = time.perf_counter()
+
+    def fill_blocks(self, tile, step, values):
+        xmin, ymin, xmax, ymax = tile
+        k = 0
+        for j in range(ymin, ymax, step):
+            for i in range(xmin, xmax, step):
+                block = values[k : k + 3] * (min(i + step, xmax) - i)
+                for y in range(j, min(j + step, ymax)):
+                    self.image.set_pixels(i, y, block)
+                k += 3
+
+    def merge(self, tile, samples, values):
+        # Running mean weighted by the samples behind each side.
+        xmin, ymin, xmax, ymax = tile
+        pixels = self.image.pixels
+        counts = self.counts
+        width = self.image.width
+        k = 0
+        for j in range(ymin, ymax):
+            for i in range(xmin, xmax):
+                p = j * width + i
+                count = counts[p]
+                weight = samples / (count + samples)
+                for c in range(p * 3, p * 3 + 3):
+                    pixels[c] += (values[k] - pixels[c]) * weight
+                    k += 1
+                counts[p] = count + samples
+
+    def info(self, number, passes, samples_done, elapsed):
+        self.frames += 1
+        return {
+            "frame": self.frames,
+            "pass": number,
+            "passes": len(passes),
+            "step": passes[number - 1][0],
+            "samples": samples_done,
+            "elapsed": elapsed,
+            "partial": False,
+        }
+
+    def encode(self):
+        # Fast settings: frames go over a local connection and are replaced
+        # within a second.
+        buffer = io.BytesIO()
+        writer = PngWriter(
+            buffer, self.image.width, self.image.height, level=1, filters=False
+        )
+        for y in range(self.image.height):
+            writer.write_row(self.image.row_bytes(y))
+        writer.close()
+        return buffer.getvalue()
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.image.close()
+
+
+class PreviewServer:
+    # Serves the preview page, the latest frame as /frame.png and a
+    # server-sent event stream announcing frames and render state. The
+    # scene file is polled, and a change cancels the render and restarts it
+    # on the reloaded scene.
+
+    def __init__(self, engine, scene, load, watch_path, processes_count):
+        self.engine = engine
+        self.scene = scene
+        self.load = load
+        self.watch_path = watch_path
+        self.processes_count = processes_count
+        self.task = None
+        self.frame = None
+        self.frame_info = None
+        self.clients = set()
+        self.state = "idle"
+
+    async def serve(self, host, port):
+        server = await asyncio.start_server(self.handle, host, port)
+        host, port = server.sockets[0].getsockname()[:2]
+        print(f"Preview on http://{host}:{port}/")
+        await self.restart()
+        watcher = asyncio.create_task(self.watch())
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            watcher.cancel()
+            self.cancel()
+
+    async def restart(self, reload=False):
+        if reload:
+            loop = asyncio.get_running_loop()
+            try:
+                scene = await loop.run_in_executor(None, self.load)
+            except Exception as e:
+                # Typically a scene file saved halfway through an edit; keep
+                # showing the last good render.
+                self.set_state("error", str(e))
+                return
+            self.scene = scene
+        self.cancel()
+        renderer = PreviewRenderer(self.engine, self.scene, self.processes_count)
+        self.task = asyncio.create_task(self.render(renderer))
+
+    async def render(self, renderer):
+        self.set_state("rendering")
+        try:
+            await renderer.run(self.publish)
+            self.set_state("done")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.set_state("error", str(e))
+        finally:
+            renderer.close()
+
+    def cancel(self):
+        if self.task is not None and not self.task.done():
+            self.task.cancel()
+            self.set_state("cancelled")
+
+    async def watch(self):
+        mtime = self.mtime()
+        while True:
+            await asyncio.sleep(WATCH_INTERVAL)
+            current = self.mtime()
+            if current != mtime:
+                mtime = current
+                await self.restart(reload=True)
+
+    def mtime(self):
+        try:
+            return os.stat(self.watch_path).st_mtime_ns
+        except OSError:
+            return None
+
+    def publish(self, frame, info):
+        self.frame = frame
+        self.frame_info = info
+        self.broadcast("frame", info)
+
+    def set_state(self, state, message=None):
+        self.state = state
+        data = {"state": state}
+        if message is not None:
+            data["message"] = message
+        self.broadcast("status", data)
+
+    def broadcast(self, event, data):
+        message = self.event(event, data)
+        for client in self.clients:
+            client.put_nowait(message)
+
+    @staticmethod
+    def event(event, data):
+        return f"event: {event}\ndata: {json.dumps(data)}\n\n".encode()
+
+    async def handle(self, reader, writer):
+        try:
+            request = (await reader.readline()).decode("latin-1").split()
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                name, _, value = line.decode("latin-1").partition(":")
+                headers[name.strip().lower()] = value.strip()
+            await reader.readexactly(int(headers.get("content-length", 0)))
+            if len(request) < 2:
+                return
+            method = request[0]
+            path = request[1].split("?", 1)[0]
+            if method == "GET" and path == "/":
+                await self.respond(writer, 200, "text/html; charset=utf-8", PAGE)
+            elif method == "GET" and path == "/frame.png":
+                if self.frame is None:
+                    await self.respond(writer, 404, "text/plain", b"No frame yet\n")
+                else:
+                    await self.respond(writer, 200, "image/png", self.frame)
+            elif method == "GET" and path == "/events":
+                await self.stream_events(writer)
+            elif method == "POST" and path == "/restart":
+                await self.restart(reload=True)
+                await self.respond(writer, 204)
+            elif method == "POST" and path == "/cancel":
+                self.cancel()
+                await self.respond(writer, 204)
+            else:
+                await self.respond(writer, 404, "text/plain", b"Not found\n")
+        except (ConnectionError, ValueError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def respond(writer, status, content_type=None, body=b""):
+        reasons = {200: "OK", 204: "No Content", 404: "Not Found"}
+        head = [
+            f"HTTP/1.1 {status} {reasons[status]}",
+            f"Content-Length: {len(body)}",
+            "Cache-Control: no-store",
+            "Connection: close",
+        ]
+        if content_type is not None:
+            head.append(f"Content-Type: {content_type}")
+        writer.write(("\r\n".join(head) + "\r\n\r\n").encode() + body)
+        await writer.drain()
+
+    async def stream_events(self, writer):
+        writer.write(
+            b"HTTP/1.1 200 OK\r\n"
+            b"Content-Type: text/event-stream\r\n"
+            b"Cache-Control: no-store\r\n"
+            b"Connection: close\r\n\r\n"
+        )
+        client = asyncio.Queue()
+        self.clients.add(client)
+        try:
+            # A client joining mid-render gets the current state at once.
+            client.put_nowait(self.event("status", {"state": self.state}))
+            if self.frame_info is not None:
+                client.put_nowait(self.event("frame", self.frame_info))
+            while True:
+                writer.write(await client.get())
+                await writer.drain()
+        finally:
+            self.clients.discard(client)
+
+
+def serve_preview(engine, scene, load, watch_path, processes_count, address):
+    server = PreviewServer(engine, scene, load, watch_path, processes_count)
+    try:
+        asyncio.run(server.serve(*address))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,151 @@
+import queue
+import sys
+import threading
+import time
+from multiprocessing.sharedctypes import RawArray
+
+# Counters kept per worker, in this order.
+FIELDS = ("pixels", "samples", "tiles")
+
+
+class ProgressCounters:
+    # One row of counters per worker in shared memory. Each worker only adds
+    # to its own row, so no lock is needed; the monitor may read a row
+    # mid-update and is at most one tile behind.
+
+    def __init__(self, workers):
+        self.workers = workers
+        self.values = RawArray("q", workers * len(FIELDS))
+
+    def add(self, worker_id, pixels, samples):
+        base = worker_id * len(FIELDS)
+        self.values[base] += pixels
+        self.values[base + 1] += samples
+        self.values[base + 2] += 1
+
+    def read(self):
+        values = self.values[:]
+        return [
+            dict(zip(FIELDS, values[w * len(FIELDS) : (w + 1) * len(FIELDS)]))
+            for w in range(self.workers)
+        ]
+
+
+class ProgressMonitor:
+    # Polls the counters of a render from a thread of the parent process and
+    # hands snapshots to the subscribed callbacks, and to iterators over the
+    # monitor, until the render stops. A snapshot is a dict:
+    #   pixels, total_pixels, fraction, samples, samples_per_second (camera
+    #   samples, each a path of primary, shadow and reflection rays),
+    #   elapsed, eta (seconds, None until the first tile), done, and workers,
+    #   a list of per-worker dicts with worker, pixels, samples and tiles.
+    # Iterate from another thread than the one rendering.
+
+    def __init__(self, callbacks=(), interval=0.25):
+        self.callbacks = list(callbacks)
+        self.interval = interval
+        self.listeners = []
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+        self.counters = None
+        self.total_pixels = 0
+        self.start_time = 0.0
+        self.last = None
+
+    def subscribe(self, callback):
+        self.callbacks.append(callback)
+
+    def __iter__(self):
+        listener = queue.Queue()
+        with self.lock:
+            if self.last is not None and self.last["done"]:
+                listener.put(self.last)
+            else:
+                self.listeners.append(listener)
+        while True:
+            snapshot = listener.get()
+            yield snapshot
+            if snapshot["done"]:
+                return
+
+    def start(self, counters, total_pixels):
+        self.counters = counters
+        self.total_pixels = total_pixels
+        self.start_time = time.perf_counter()
+        self.last = None
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        if self.thread is None:
+            return
+        self.stopped.set()
+        self.thread.join()
+        self.thread = None
+        self.publish(self.snapshot(done=True))
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.publish(self.snapshot())
+
+    def snapshot(self, done=False):
+        workers = self.counters.read()
+        elapsed = time.perf_counter() - self.start_time
+        pixels = sum(worker["pixels"] for worker in workers)
+        samples = sum(worker["samples"] for worker in workers)
+        eta = None
+        if done:
+            eta = 0.0
+        elif pixels:
+            eta = elapsed * (self.total_pixels - pixels) / pixels
+        for worker_id, worker in enumerate(workers):
+            worker["worker"] = worker_id
+        return {
+            "pixels": pixels,
+            "total_pixels": self.total_pixels,
+            "fraction": pixels / self.total_pixels if self.total_pixels else 1.0,
+            "samples": samples,
+            "samples_per_second": samples / elapsed if elapsed > 0 else 0.0,
+            "elapsed": elapsed,
+            "eta": eta,
+            "done": done,
+            "workers": workers,
+        }
+
+    def publish(self, snapshot):
+        with self.lock:
+            self.last = snapshot
+            for listener in self.listeners:
+                listener.put(snapshot)
+            if snapshot["done"]:
+                self.listeners = []
+        for callback in self.callbacks:
+            callback(snapshot)
+
+
+class ConsoleBar:
+    # The progress bar printed during renders, as a monitor callback.
+
+    def __init__(self, stream=None, width=50):
+        self.stream = stream
+        self.width = width
+        self.shown = None
+
+    def __call__(self, snapshot):
+        stream = self.stream or sys.stdout
+        fraction = snapshot["fraction"]
+        eta = snapshot["eta"]
+        line = (
+            f"\rProcess: [{('#' * int(fraction * self.width)).ljust(self.width, '.')}"
+            f"] {fraction * 100:5.2f}% {snapshot['samples_per_second']:9.0f} "
+            "samples/s"
+            + (f" ETA {eta:6.1f}s" if eta is not None else "")
+        )
+        if line != self.shown:
+            stream.write(line)
+            self.shown = line
+        if snapshot["done"]:
+            stream.write("\n")
+        stream.flush()
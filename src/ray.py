@@ -1,7 +1,18 @@
 class Ray:
-    def __init__(self, origin, direction):
+    __slots__ = ("origin", "direction")
+
+    def __init__(self, origin, direction, normalized=False):
         self.origin = origin
-        self.direction = direction.normalize()
-        
+        self.direction = direction if normalized else direction.normalize()
+
+    def __getstate__(self):
+        return (self.origin, self.direction)
+
+    def __setstate__(self, state):
+        self.origin, self.direction = state
+
     def length(self):
         return self.direction.magnitude()
+
+    def at(self, dist):
+        return self.origin.add_scaled(self.direction, dist)
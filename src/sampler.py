@@ -0,0 +1,181 @@
+import math
+
+MASK32 = 0xFFFFFFFF
+MASK64 = 0xFFFFFFFFFFFFFFFF
+
+# Direction numbers of the second Sobol dimension (primitive polynomial x + 1);
+# the first dimension is the base 2 radical inverse.
+SOBOL_DIRECTIONS = [1 << 31]
+for _ in range(31):
+    SOBOL_DIRECTIONS.append(SOBOL_DIRECTIONS[-1] ^ (SOBOL_DIRECTIONS[-1] >> 1))
+
+# Generalized golden ratio constants of the R2 sequence.
+R2_A1 = 0.7548776662466927
+R2_A2 = 0.5698402909980532
+
+
+def hash_seed(*values):
+    # splitmix64 finalizer folded over the values: a stable seed for a tile
+    # or pixel, the same in every process (unlike hash(), which is salted).
+    h = 0
+    for value in values:
+        h = (h + 0x9E3779B97F4A7C15 + value) & MASK64
+        h = ((h ^ (h >> 30)) * 0xBF58476D1CE4E5B9) & MASK64
+        h = ((h ^ (h >> 27)) * 0x94D049BB133111EB) & MASK64
+        h ^= h >> 31
+    return h
+
+
+def radical_inverse(base, index):
+    result = 0.0
+    scale = 1.0 / base
+    while index:
+        index, digit = divmod(index, base)
+        result += digit * scale
+        scale /= base
+    return result
+
+
+def sobol_point(index):
+    # First two Sobol dimensions as 32-bit integers.
+    x = y = 0
+    bit = 0
+    while index:
+        if index & 1:
+            x ^= 1 << (31 - bit)
+            y ^= SOBOL_DIRECTIONS[bit]
+        index >>= 1
+        bit += 1
+    return (x, y)
+
+
+class RandomSampler:
+    # Independent uniform samples: the previous behaviour, but drawn from
+    # the engine's per-tile generator so renders are reproducible.
+
+    def __init__(self, samples_per_pixel, seed=0):
+        self.samples_per_pixel = samples_per_pixel
+        self.seed = seed
+        self.rng = None
+
+    def start_pixel(self, rng, i, j):
+        self.rng = rng
+
+    def get(self, index):
+        return (self.rng.random(), self.rng.random())
+
+
+class StratifiedSampler(RandomSampler):
+    # One jittered sample per cell of a grid with at least samples_per_pixel
+    # cells. The cells are visited with a per-pixel offset and a stride
+    # coprime to their count, so any prefix of the samples, as taken by
+    # adaptive batches and preview passes, is spread over the pixel.
+
+    def __init__(self, samples_per_pixel, seed=0):
+        super().__init__(samples_per_pixel, seed)
+        self.columns = max(1, round(math.sqrt(samples_per_pixel)))
+        self.rows = -(-samples_per_pixel // self.columns)
+        self.cells = self.columns * self.rows
+        stride = max(1, round(self.cells * 0.618))
+        while math.gcd(stride, self.cells) != 1:
+            stride += 1
+        self.stride = stride
+        self.offset = 0
+
+    def start_pixel(self, rng, i, j):
+        self.rng = rng
+        self.offset = hash_seed(self.seed, i, j) % self.cells
+
+    def get(self, index):
+        cell = (self.offset + index * self.stride) % self.cells
+        row, column = divmod(cell, self.columns)
+        return (
+            (column + self.rng.random()) / self.columns,
+            (row + self.rng.random()) / self.rows,
+        )
+
+
+class HaltonSampler:
+    # Halton points in bases 2 and 3, toroidally shifted by a per-pixel
+    # offset (Cranley-Patterson rotation) so neighbouring pixels do not
+    # share their error.
+
+    def __init__(self, samples_per_pixel, seed=0):
+        self.samples_per_pixel = samples_per_pixel
+        self.seed = seed
+        self.points = [
+            (radical_inverse(2, k), radical_inverse(3, k))
+            for k in range(samples_per_pixel)
+        ]
+        self.shift = (0.0, 0.0)
+
+    def start_pixel(self, rng, i, j):
+        h = hash_seed(self.seed, i, j)
+        self.shift = ((h & MASK32) / 2**32, (h >> 32) / 2**32)
+
+    def point(self, index):
+        if index < len(self.points):
+            return self.points[index]
+        return (radical_inverse(2, index), radical_inverse(3, index))
+
+    def get(self, index):
+        u, v = self.point(index)
+        su, sv = self.shift
+        return ((u + su) % 1.0, (v + sv) % 1.0)
+
+
+class SobolSampler:
+    # The first two Sobol dimensions, a (0, 2)-sequence: every power of two
+    # prefix has one sample in each elementary interval of that size. A
+    # per-pixel random XOR of the bits (digital shift) decorrelates pixels
+    # and keeps that property.
+
+    def __init__(self, samples_per_pixel, seed=0):
+        self.samples_per_pixel = samples_per_pixel
+        self.seed = seed
+        self.points = [sobol_point(k) for k in range(samples_per_pixel)]
+        self.scramble = (0, 0)
+
+    def start_pixel(self, rng, i, j):
+        h = hash_seed(self.seed, i, j)
+        self.scramble = (h & MASK32, h >> 32)
+
+    def get(self, index):
+        if index < len(self.points):
+            x, y = self.points[index]
+        else:
+            x, y = sobol_point(index)
+        sx, sy = self.scramble
+        return ((x ^ sx) / 2**32, (y ^ sy) / 2**32)
+
+
+class BlueNoiseSampler(SobolSampler):
+    # Sobol points shifted per pixel by an R2 dither of the pixel position
+    # instead of a hash: neighbouring pixels get well-separated shifts, which
+    # pushes the remaining error to high frequencies where it reads as fine
+    # grain rather than blotches. The dither stands in for a precomputed
+    # blue-noise mask.
+
+    def start_pixel(self, rng, i, j):
+        h = hash_seed(self.seed)
+        base = (h & MASK32) / 2**32
+        su = (base + i * R2_A1 + j * R2_A2) % 1.0
+        sv = (base + 0.5 + i * R2_A2 + j * R2_A1) % 1.0
+        self.scramble = (su, sv)
+
+    def get(self, index):
+        if index < len(self.points):
+            x, y = self.points[index]
+        else:
+            x, y = sobol_point(index)
+        su, sv = self.scramble
+        return ((x / 2**32 + su) % 1.0, (y / 2**32 + sv) % 1.0)
+
+
+SAMPLERS = {
+    "random": RandomSampler,
+    "stratified": StratifiedSampler,
+    "halton": HaltonSampler,
+    "sobol": SobolSampler,
+    "blue-noise": BlueNoiseSampler,
+}
@@ -1,3 +1,7 @@
+from bvh import BVH
+from light import LightSampler
+
+
 class Scene:
     def __init__(self, camera, objects, lights, width, height):
         self.camera = camera
@@ -5,3 +9,5 @@ class Scene:
         self.lights = lights
         self.width = width
         self.height = height
+        self.bvh = BVH(objects)
+        self.light_sampler = LightSampler(lights)
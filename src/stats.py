@@ -0,0 +1,170 @@
+import time
+from array import array
+from collections import Counter
+
+from image import Image
+
+
+class RenderStats:
+    # Counters are only collected when a worker calls instrument(), which
+    # swaps counting wrappers in for the hot methods of its own copies of the
+    # engine, scene objects and framebuffer. An engine rendering without
+    # stats runs the plain methods and pays nothing per ray.
+
+    def __init__(self):
+        self.rays = Counter()
+        self.tests = Counter()
+        self.depths = Counter()
+        self.times = Counter()
+        self.tile_times = []
+
+    def instrument(self, engine, scene, image):
+        if hasattr(engine, "ray_trace_packet"):
+            self.instrument_packet(engine)
+        else:
+            self.instrument_python(engine)
+        for obj in scene.objects:
+            self.instrument_object(obj)
+        self.instrument_image(image)
+
+    def instrument_python(self, engine):
+        ray_trace = engine.ray_trace
+        find_nearest = engine.find_nearest
+        occluded = engine.occluded
+        rays = self.rays
+        depths = self.depths
+        # ray_trace calls find_nearest once per bounce of the path.
+        depth = [0]
+
+        def counted_ray_trace(ray, scene):
+            depth[0] = 0
+            return ray_trace(ray, scene)
+
+        def counted_find_nearest(ray, scene):
+            rays["primary" if depth[0] == 0 else "reflection"] += 1
+            depths[depth[0]] += 1
+            depth[0] += 1
+            return find_nearest(ray, scene)
+
+        def counted_occluded(ray, scene, max_dist, light_index):
+            rays["shadow"] += 1
+            return occluded(ray, scene, max_dist, light_index)
+
+        engine.ray_trace = counted_ray_trace
+        engine.find_nearest = counted_find_nearest
+        engine.occluded = counted_occluded
+
+    def instrument_packet(self, engine):
+        ray_trace_packet = engine.ray_trace_packet
+        find_nearest_packet = engine.find_nearest_packet
+        occluded_packet = engine.occluded_packet
+        rays = self.rays
+        depths = self.depths
+        # ray_trace_packet calls find_nearest_packet once per bounce, with the
+        # rays that survived the previous one.
+        depth = [0]
+
+        def counted_ray_trace_packet(origins, directions, scene):
+            depth[0] = 0
+            return ray_trace_packet(origins, directions, scene)
+
+        def counted_find_nearest_packet(origins, directions, scene):
+            count = len(origins)
+            rays["primary" if depth[0] == 0 else "reflection"] += count
+            depths[depth[0]] += count
+            depth[0] += 1
+            return find_nearest_packet(origins, directions, scene)
+
+        def counted_occluded_packet(origins, directions, max_dist, scene, index):
+            rays["shadow"] += len(origins)
+            return occluded_packet(origins, directions, max_dist, scene, index)
+
+        engine.ray_trace_packet = counted_ray_trace_packet
+        engine.find_nearest_packet = counted_find_nearest_packet
+        engine.occluded_packet = counted_occluded_packet
+
+    def instrument_object(self, obj):
+        hit = obj.hit
+        occludes = obj.occludes
+        intersects_packet = getattr(obj, "intersects_packet", None)
+        tests = self.tests
+        name = type(obj).__name__
+
+        def counted_hit(ray, max_dist=float("inf")):
+            tests[name] += 1
+            return hit(ray, max_dist)
+
+        def counted_occludes(ray, max_dist):
+            tests[name] += 1
+            return occludes(ray, max_dist)
+
+        def counted_intersects_packet(origins, directions):
+            tests[name] += len(origins)
+            return intersects_packet(origins, directions)
+
+        obj.hit = counted_hit
+        obj.occludes = counted_occludes
+        if intersects_packet is not None:
+            obj.intersects_packet = counted_intersects_packet
+
+    def instrument_image(self, image):
+        set_pixel = image.set_pixel
+        set_pixels = image.set_pixels
+        times = self.times
+
+        def timed_set_pixel(x, y, color):
+            start = time.perf_counter()
+            set_pixel(x, y, color)
+            times["framebuffer"] += time.perf_counter() - start
+
+        def timed_set_pixels(x, y, values):
+            start = time.perf_counter()
+            set_pixels(x, y, values)
+            times["framebuffer"] += time.perf_counter() - start
+
+        image.set_pixel = timed_set_pixel
+        image.set_pixels = timed_set_pixels
+
+    def add_tile(self, tile, seconds):
+        self.tile_times.append((tile, seconds))
+
+    def finish_worker(self):
+        # Framebuffer writes happen inside the tile timings.
+        busy = sum(seconds for _, seconds in self.tile_times)
+        self.times["trace"] = busy - self.times["framebuffer"]
+
+    def merge(self, other):
+        self.rays.update(other.rays)
+        self.tests.update(other.tests)
+        self.depths.update(other.depths)
+        self.times.update(other.times)
+        self.tile_times.extend(other.tile_times)
+        return self
+
+    def tile_heatmap(self, width, height):
+        seconds_per_pixel = Image(width, height, channels=1)
+        try:
+            for (xmin, ymin, xmax, ymax), seconds in self.tile_times:
+                per_pixel = seconds / ((xmax - xmin) * (ymax - ymin))
+                row = array("d", [per_pixel] * (xmax - xmin))
+                for j in range(ymin, ymax):
+                    seconds_per_pixel.set_pixels(xmin, j, row)
+            return Image.heatmap(seconds_per_pixel)
+        finally:
+            seconds_per_pixel.close()
+
+    def summary(self):
+        total_rays = sum(self.rays.values())
+        lines = [f"Rays: {total_rays}"]
+        for kind in ("primary", "reflection", "shadow"):
+            lines.append(f"  {kind:<12} {self.rays[kind]:>12}")
+        lines.append(f"Intersection tests: {sum(self.tests.values())}")
+        for name, count in sorted(self.tests.items()):
+            lines.append(f"  {name:<12} {count:>12}")
+        lines.append("Recursion depth:")
+        for depth in sorted(self.depths):
+            lines.append(f"  {depth:<12} {self.depths[depth]:>12}")
+        lines.append("Phase times (summed over workers):")
+        for phase in ("trace", "framebuffer", "png"):
+            lines.append(f"  {phase:<12} {self.times[phase]:>11.3f}s")
+        return "\n".join(lines)
@@ -0,0 +1,236 @@
+import hashlib
+import io
+import math
+import mmap
+import os
+import struct
+import tempfile
+import threading
+from array import array
+from collections import OrderedDict
+
+from color import Color
+from image import read_png
+
+MAGIC = b"PRAYTEXR"
+VERSION = 1
+HEADER = struct.Struct("<8sIIIII")
+HEADER_SIZE = 64
+LEVEL = struct.Struct("<IIQ")
+TILE_SHIFT = 5
+TILE_SIZE = 1 << TILE_SHIFT
+TILE_MASK = TILE_SIZE - 1
+TILE_BYTES = TILE_SIZE * TILE_SIZE * 3
+
+
+class TileCache:
+    # Decoded tiles of every texture in the process, least recently used
+    # first. Tiles are dropped once their total size exceeds the budget, so
+    # a large texture set costs each worker at most the budget on top of the
+    # mapped files, whose pages the workers share. The lock keeps the LRU
+    # order and size consistent under the thread executor.
+
+    def __init__(self, budget):
+        self.budget = budget
+        self.lock = threading.Lock()
+        self.tiles = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            tile = self.tiles.get(key)
+            if tile is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.tiles.move_to_end(key)
+            return tile
+
+    def put(self, key, tile):
+        with self.lock:
+            if key in self.tiles:
+                return
+            self.tiles[key] = tile
+            self.size += len(tile) * tile.itemsize
+            while self.size > self.budget and len(self.tiles) > 1:
+                _, old = self.tiles.popitem(last=False)
+                self.size -= len(old) * old.itemsize
+
+
+tile_cache = TileCache(int(os.environ.get("PRAY_TEXTURE_CACHE_MB", "64")) << 20)
+
+
+def downsample(pixels, width, height):
+    # Box filters packed RGB rows down to half size; an odd last row or
+    # column is dropped.
+    half_width = max(width // 2, 1)
+    half_height = max(height // 2, 1)
+    stride = width * 3
+    step = 6 if width > 1 else 3
+    result = bytearray()
+    for y in range(half_height):
+        top = pixels[2 * y * stride : (2 * y + 1) * stride]
+        start = min(2 * y + 1, height - 1) * stride
+        bottom = pixels[start : start + stride]
+        row = bytearray(half_width * 3)
+        for c in range(3):
+            row[c::3] = bytes(
+                (a + b + d + e + 2) >> 2
+                for a, b, d, e in zip(
+                    top[c::step],
+                    top[c + step - 3 :: step],
+                    bottom[c::step],
+                    bottom[c + step - 3 :: step],
+                )
+            )
+        result += row
+    return (half_width, half_height, bytes(result))
+
+
+def write_texture(fileobj, width, height, pixels):
+    # Layout: header, one LEVEL entry per mip level, then the levels from
+    # full size down to 1x1. Each level is cut into TILE_SIZE square tiles of
+    # packed RGB bytes, stored row-major and padded to full size, so a tile
+    # is one contiguous read.
+    levels = [(width, height, pixels)]
+    while width > 1 or height > 1:
+        width, height, pixels = downsample(pixels, width, height)
+        levels.append((width, height, pixels))
+    offset = HEADER_SIZE + len(levels) * LEVEL.size
+    fileobj.write(
+        HEADER.pack(
+            MAGIC, VERSION, levels[0][0], levels[0][1], len(levels), TILE_SIZE
+        ).ljust(HEADER_SIZE, b"\0")
+    )
+    for width, height, _ in levels:
+        fileobj.write(LEVEL.pack(width, height, offset))
+        columns = -(-width // TILE_SIZE)
+        rows = -(-height // TILE_SIZE)
+        offset += columns * rows * TILE_BYTES
+    for width, height, pixels in levels:
+        stride = width * 3
+        for ty in range(0, height, TILE_SIZE):
+            for tx in range(0, width, TILE_SIZE):
+                tile = bytearray(TILE_BYTES)
+                span = min(TILE_SIZE, width - tx) * 3
+                for k, y in enumerate(range(ty, min(ty + TILE_SIZE, height))):
+                    start = y * stride + tx * 3
+                    tile[k * TILE_SIZE * 3 : k * TILE_SIZE * 3 + span] = pixels[
+                        start : start + span
+                    ]
+                fileobj.write(tile)
+
+
+class Texture:
+    # A mipmapped texture in the tiled format written by write_texture. A
+    # texture loaded through a cache directory maps the cache file, so
+    # every render process shares its pages and a pickled texture is just
+    # the path of that file; tiles are decoded to floats on first use.
+
+    def __init__(self, data, path=None):
+        self.path = path
+        self.data = data
+        magic, version, width, height, level_count, tile_size = HEADER.unpack_from(
+            data
+        )
+        if magic != MAGIC or version != VERSION or tile_size != TILE_SIZE:
+            raise ValueError(f"{path or 'data'} is not a texture cache file")
+        self.width = width
+        self.height = height
+        self.levels = [
+            LEVEL.unpack_from(data, HEADER_SIZE + i * LEVEL.size)
+            for i in range(level_count)
+        ]
+        self.key = path if path is not None else id(self)
+
+    @classmethod
+    def load(cls, path, cache_dir=None):
+        with open(path, "rb") as f:
+            source = f.read()
+        if cache_dir is None:
+            buffer = io.BytesIO()
+            write_texture(buffer, *read_png(io.BytesIO(source)))
+            return cls(buffer.getvalue())
+        digest = hashlib.sha256(source)
+        digest.update(f"pray-texture-{VERSION}".encode())
+        cache_path = os.path.join(cache_dir, digest.hexdigest() + ".tex")
+        if not os.path.exists(cache_path):
+            pixels = read_png(io.BytesIO(source))
+            os.makedirs(cache_dir, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=cache_dir)
+            with os.fdopen(fd, "wb") as f:
+                write_texture(f, *pixels)
+            os.replace(tmp_path, cache_path)
+        return cls.mapped(cache_path)
+
+    @classmethod
+    def mapped(cls, path):
+        with open(path, "rb") as f:
+            return cls(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ), path)
+
+    def __getstate__(self):
+        if self.path is not None:
+            return self.path
+        return self.data
+
+    def __setstate__(self, state):
+        if isinstance(state, str):
+            self.__dict__.update(Texture.mapped(state).__dict__)
+        else:
+            self.__init__(state)
+
+    def tile(self, level, tx, ty):
+        key = (self.key, level, tx, ty)
+        tile = tile_cache.get(key)
+        if tile is None:
+            width, _, offset = self.levels[level]
+            offset += (ty * -(-width // TILE_SIZE) + tx) * TILE_BYTES
+            data = self.data[offset : offset + TILE_BYTES]
+            tile = array("d", [b / 255 for b in data])
+            tile_cache.put(key, tile)
+        return tile
+
+    def bilinear(self, level, u, v):
+        width, height, _ = self.levels[level]
+        x = (u % 1.0) * width - 0.5
+        y = (v % 1.0) * height - 0.5
+        x0 = math.floor(x)
+        y0 = math.floor(y)
+        fx = x - x0
+        fy = y - y0
+        r = g = b = 0.0
+        for px, py, weight in (
+            (x0, y0, (1 - fx) * (1 - fy)),
+            (x0 + 1, y0, fx * (1 - fy)),
+            (x0, y0 + 1, (1 - fx) * fy),
+            (x0 + 1, y0 + 1, fx * fy),
+        ):
+            px %= width
+            py %= height
+            tile = self.tile(level, px >> TILE_SHIFT, py >> TILE_SHIFT)
+            i = ((py & TILE_MASK) * TILE_SIZE + (px & TILE_MASK)) * 3
+            r += tile[i] * weight
+            g += tile[i + 1] * weight
+            b += tile[i + 2] * weight
+        return (r, g, b)
+
+    def sample(self, u, v, footprint=0.0):
+        # footprint is the width covered by the lookup in texels of the full
+        # size level; the two nearest levels are blended (trilinear).
+        last = len(self.levels) - 1
+        lod = math.log2(footprint) if footprint > 1 else 0.0
+        if lod >= last:
+            return Color(*self.bilinear(last, u, v))
+        level = int(lod)
+        color = self.bilinear(level, u, v)
+        t = lod - level
+        if t > 0:
+            finer = color
+            coarser = self.bilinear(level + 1, u, v)
+            color = [a + (b - a) * t for a, b in zip(finer, coarser)]
+        return Color(*color)
+
+    def average(self):
+        return Color(*self.bilinear(len(self.levels) - 1, 0.5, 0.5))
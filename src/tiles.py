@@ -0,0 +1,50 @@
+import math
+
+TILE_ORDERS = ("hilbert", "spiral", "scanline")
+
+
+def hilbert_index(order, x, y):
+    index = 0
+    s = order // 2
+    while s > 0:
+        rx = 1 if x & s else 0
+        ry = 1 if y & s else 0
+        index += s * s * ((3 * rx) ^ ry)
+        if ry == 0:
+            if rx == 1:
+                x = s - 1 - x
+                y = s - 1 - y
+            x, y = y, x
+        s //= 2
+    return index
+
+
+def make_tiles(width, height, tile_size=32, order="hilbert"):
+    if tile_size < 1:
+        raise ValueError("Tile size must be at least 1")
+    if order not in TILE_ORDERS:
+        raise ValueError(f"Tile order must be one of: {', '.join(TILE_ORDERS)}")
+    columns = math.ceil(width / tile_size)
+    rows = math.ceil(height / tile_size)
+    cells = [(tx, ty) for ty in range(rows) for tx in range(columns)]
+    if order == "hilbert":
+        side = 1 << (max(columns, rows) - 1).bit_length()
+        cells.sort(key=lambda c: hilbert_index(side, c[0], c[1]))
+    elif order == "spiral":
+        cx = (columns - 1) / 2
+        cy = (rows - 1) / 2
+        cells.sort(
+            key=lambda c: (
+                max(abs(c[0] - cx), abs(c[1] - cy)),
+                math.atan2(c[1] - cy, c[0] - cx),
+            )
+        )
+    return [
+        (
+            tx * tile_size,
+            ty * tile_size,
+            min((tx + 1) * tile_size, width),
+            min((ty + 1) * tile_size, height),
+        )
+        for tx, ty in cells
+    ]
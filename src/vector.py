@@ -2,6 +2,8 @@ import math
 
 
 class Vector:
+    __slots__ = ("x", "y", "z")
+
     def __init__(self, x=0.0, y=0.0, z=0.0):
         self.x = x
         self.y = y
@@ -10,11 +12,20 @@ class Vector:
     def __str__(self):
         return f"({self.x}, {self.y}, {self.z})"
 
+    def __iter__(self):
+        return iter((self.x, self.y, self.z))
+
+    def __getstate__(self):
+        return (self.x, self.y, self.z)
+
+    def __setstate__(self, state):
+        self.x, self.y, self.z = state
+
     def dot_product(self, other):
         return self.x * other.x + self.y * other.y + self.z * other.z
 
     def magnitude(self):
-        return math.sqrt(self.dot_product(self))
+        return math.sqrt(self.x * self.x + self.y * self.y + self.z * self.z)
 
     def normalize(self):
         return self / self.magnitude()
@@ -44,3 +55,58 @@ class Vector:
             self.z * other.x - self.x * other.z,
             self.x * other.y - self.y * other.x,
         )
+
+    # Fused operations: one allocation instead of one per intermediate.
+
+    def add_scaled(self, other, scale):
+        return Vector(
+            self.x + other.x * scale, self.y + other.y * scale, self.z + other.z * scale
+        )
+
+    def direction_to(self, other):
+        x = other.x - self.x
+        y = other.y - self.y
+        z = other.z - self.z
+        inv = 1.0 / math.sqrt(x * x + y * y + z * z)
+        return Vector(x * inv, y * inv, z * inv)
+
+    def distance_to(self, other):
+        x = other.x - self.x
+        y = other.y - self.y
+        z = other.z - self.z
+        return math.sqrt(x * x + y * y + z * z)
+
+    def reflect(self, normal):
+        k = 2 * (self.x * normal.x + self.y * normal.y + self.z * normal.z)
+        return Vector(
+            self.x - k * normal.x, self.y - k * normal.y, self.z - k * normal.z
+        )
+
+    # In-place operations for accumulators the caller owns.
+
+    def iadd(self, other):
+        self.x += other.x
+        self.y += other.y
+        self.z += other.z
+        return self
+
+    def iadd_scaled(self, other, scale):
+        self.x += other.x * scale
+        self.y += other.y * scale
+        self.z += other.z * scale
+        return self
+
+    def iadd_product(self, a, b, scale):
+        self.x += a.x * b.x * scale
+        self.y += a.y * b.y * scale
+        self.z += a.z * b.z * scale
+        return self
+
+    def iscale(self, factor):
+        self.x *= factor
+        self.y *= factor
+        self.z *= factor
+        return self
+
+    def inormalize(self):
+        return self.iscale(1.0 / self.magnitude())
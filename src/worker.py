@@ -0,0 +1,41 @@
+import argparse
+import os
+import time
+
+from distributed import parse_address, run_worker
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Render tiles for a PRay coordinator started with --listen"
+    )
+    parser.add_argument("address", help="Coordinator address as HOST:PORT")
+    parser.add_argument(
+        "--authkey",
+        default=os.environ.get("PRAY_AUTHKEY"),
+        help="Shared secret of the coordinator (default: $PRAY_AUTHKEY)",
+    )
+    parser.add_argument(
+        "--retry",
+        type=float,
+        default=0,
+        help="Keep retrying the connection for this many seconds (default: 0)",
+    )
+    args = parser.parse_args()
+    if not args.authkey:
+        raise ValueError("Error: an authkey is required, pass --authkey")
+    address = parse_address(args.address)
+    deadline = time.monotonic() + args.retry
+    while True:
+        try:
+            tiles = run_worker(address, args.authkey.encode())
+            break
+        except ConnectionRefusedError:
+            if time.monotonic() >= deadline:
+                raise
+            time.sleep(0.5)
+    print(f"Rendered {tiles} tiles")
+
+
+if __name__ == "__main__":
+    main()